@@ -63,6 +63,18 @@ with app.app_context():
     except Exception as e:
         print(f"[WARNING] Failed to initialize global config: {e}")
 
+    try:
+        from utils.admin.upload_s3_utils import import_legacy_registry
+        import_legacy_registry()
+    except Exception as e:
+        print(f"[WARNING] Legacy registry import failed: {e}")
+
+    try:
+        from utils.admin.index_cache import warmup_index_cache
+        warmup_index_cache()
+    except Exception as e:
+        print(f"[WARNING] Index warmup failed: {e}")
+
 load_dotenv()
 app.redis_client = redis_client
 app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Nạp vector của các index đã có vào bảng chunk_embeddings để lần upload lại đầu tiên đã được
+tái sử dụng embedding. Index nén (SQ/PQ) bị bỏ qua vì vector reconstruct chỉ là xấp xỉ.
+
+Vector được gán cho model embedding hiện tại (MODEL_ID / EMBEDDING_DIMENSIONS): chỉ chạy khi
+các index được tạo bằng đúng model đó.
+
+Usage:
+  python backfill_chunk_embeddings.py
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from utils.aws_client import bedrock_embeddings
+from utils.admin.file_registry import list_registry_entries
+from utils.admin.index_builder import describe_index, reconstruct_vectors
+from utils.admin.chunk_store import iter_store_documents
+from utils.admin.chunk_embedding_store import chunk_text_hash, embeddings_model_id, save_chunk_embeddings
+from utils.user.vector_store_utils import load_faiss_index
+
+
+def main():
+    model_id = embeddings_model_id(bedrock_embeddings)
+    with app.app_context():
+        files = list_registry_entries()
+        print(f"🚀 Backfilling chunk embeddings of {len(files)} files for model {model_id}")
+
+        stored = 0
+        for file_info in files:
+            store = load_faiss_index(file_info["unique_filename"], bedrock_embeddings)
+            if store is None:
+                print(f"⚠️  Skipping {file_info['original_filename']}: index not available")
+                continue
+            info = describe_index(store.index)
+            if info.get("bytes_per_vector", 4 * info["dim"]) < 4 * info["dim"]:
+                print(f"⚠️  Skipping {file_info['original_filename']}: compressed index")
+                continue
+
+            vectors = reconstruct_vectors(store.index)
+            by_hash = {chunk_text_hash(doc.page_content): vector for doc, vector in zip(iter_store_documents(store), vectors)}
+            stored += save_chunk_embeddings(by_hash, model_id)
+            print(f"✅ {file_info['original_filename']}: {len(by_hash)} chunks")
+
+        print(f"\n🎉 Stored {stored} chunk embeddings")
+
+
+if __name__ == "__main__":
+    main()
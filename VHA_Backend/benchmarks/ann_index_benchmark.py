@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark recall@k và độ trễ p50/p99 của các loại index (HNSW, IVF) so với Flat (exact)
+trên corpus tổng hợp, dùng đúng hàm dựng index của hệ thống (utils/admin/index_builder).
+
+Dữ liệu là hỗn hợp Gaussian (giống embedding thật: các chunk cùng chủ đề nằm gần nhau),
+query là các điểm dữ liệu có nhiễu. Ground truth lấy từ Flat index.
+
+Usage:
+  python benchmarks/ann_index_benchmark.py                                 # 1k, 10k, 100k
+  python benchmarks/ann_index_benchmark.py --sizes 1000 10000 100000 1000000 --dim 256
+  python benchmarks/ann_index_benchmark.py --nprobe 4 16 64 --ef-search 16 64 256 --json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import faiss
+
+from utils.admin.index_builder import build_faiss_index, ivf_nlist, search_params_for
+
+try:
+    from config.performance import INDEX_HNSW_M
+except ImportError:
+    INDEX_HNSW_M = 32
+
+
+def synthetic_corpus(n, dim, queries, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(n // 200, 8), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=n)
+    data = centers[labels] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    picks = rng.integers(0, n, size=queries)
+    query = data[picks] + 0.1 * rng.normal(size=(queries, dim)).astype(np.float32)
+    return np.ascontiguousarray(data, dtype=np.float32), np.ascontiguousarray(query, dtype=np.float32)
+
+
+def measure(index, queries, k, settings=None):
+    """Single-query latencies (like a chat request) and the returned ids"""
+    faiss.omp_set_num_threads(1)
+    params = search_params_for(index, settings)
+    latencies, ids = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        _, found = index.search(query[None, :], k, params=params)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ids.append(found[0])
+    return np.asarray(latencies), np.asarray(ids)
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def bench_size(n, args):
+    data, queries = synthetic_corpus(n, args.dim, args.queries)
+    rows = []
+
+    t0 = time.time()
+    flat = build_faiss_index(data, "Flat")
+    flat_build = time.time() - t0
+    flat_lat, truth = measure(flat, queries, args.k)
+    rows.append(_row(n, "Flat", "-", flat_build, flat_lat, 1.0))
+
+    configs = [(f"HNSW{INDEX_HNSW_M},Flat", "ef_search", value) for value in args.ef_search]
+    if n >= 39 * 16:
+        configs += [(f"IVF{ivf_nlist(n)},Flat", "nprobe", value) for value in args.nprobe]
+
+    built = {}
+    for factory, param, value in configs:
+        if factory not in built:
+            t0 = time.time()
+            built[factory] = (build_faiss_index(data, factory), time.time() - t0)
+        index, build_s = built[factory]
+        latencies, found = measure(index, queries, args.k, {param: value})
+        rows.append(_row(n, factory, f"{param}={value}", build_s, latencies, recall_at_k(found, truth)))
+    return rows
+
+
+def _row(n, factory, params, build_s, latencies, recall):
+    return {
+        "vectors": n,
+        "index": factory,
+        "params": params,
+        "build_s": round(build_s, 2),
+        "recall_at_k": round(recall, 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of Flat / HNSW / IVF indexes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=256, help="Use 1024 to match Titan v2 default output")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        rows.extend(bench_size(n, args))
+        if not args.json:
+            print(f"[INFO] {n} vectors done")
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"\nrecall@{args.k}, {args.queries} single-vector queries, dim={args.dim}")
+    print(f"{'vectors':>9} {'index':<18} {'params':<14} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in rows:
+        print(f"{r['vectors']:>9} {r['index']:<18} {r['params']:<14} {r['build_s']:>8} "
+              f"{r['recall_at_k']:>7} {r['p50_ms']:>8} {r['p99_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Tiện ích dùng chung cho các benchmark: đo RSS/PSS của process và tắt log khi đo.
+"""
+
+import os
+import contextlib
+
+
+def memory_usage():
+    """RSS/PSS (MB) của process hiện tại từ /proc/self/smaps_rollup; chỉ có max RSS nếu không có /proc"""
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    usage[key.lower() + "_mb"] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+        usage["rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+
+@contextlib.contextmanager
+def quiet(verbose=False):
+    """Bỏ stdout trong khối lệnh (trừ khi verbose): code retrieval log mỗi lần gọi, làm rối báo cáo"""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark dung lượng, recall@k và độ trễ p50/p99 của các kiểu nén vector (fp16, SQ8, PQ)
+so với float32, dùng đúng hàm chọn/dựng index của hệ thống (utils/admin/index_builder).
+
+Dữ liệu tổng hợp như ann_index_benchmark.py; ground truth lấy từ index float32 cùng kích thước.
+Số chiều nhỏ hơn của Titan v2 (--dims 512 256) chỉ cho thấy chi phí lưu trữ/search: chất lượng
+thật của embedding giảm chiều cần đo trên dữ liệu thật bằng reencode_indexes.py --dry-run.
+
+Usage:
+  python benchmarks/compression_benchmark.py                          # 1k, 10k, 50k vectors, dim 1024
+  python benchmarks/compression_benchmark.py --sizes 20000 --dims 1024 512 256 --json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import faiss
+
+from utils.admin.index_builder import COMPRESSIONS, build_faiss_index, choose_index_factory
+
+from ann_index_benchmark import synthetic_corpus, measure, recall_at_k
+
+
+def bench(n, dim, args):
+    data, queries = synthetic_corpus(n, dim, args.queries)
+    _, truth = measure(build_faiss_index(data, choose_index_factory(n, dim=dim, compression="none")), queries, args.k)
+
+    rows = []
+    for compression in args.compressions:
+        factory = choose_index_factory(n, dim=dim, compression=compression)
+        t0 = time.time()
+        index = build_faiss_index(data, factory)
+        build_s = time.time() - t0
+        latencies, found = measure(index, queries, args.k)
+        nbytes = int(faiss.serialize_index(index).nbytes)
+        rows.append({
+            "vectors": n,
+            "dim": dim,
+            "compression": compression,
+            "index": factory,
+            "file_mb": round(nbytes / 1024 / 1024, 2),
+            "bytes_per_vector": round(nbytes / n, 1),
+            "build_s": round(build_s, 2),
+            "recall_at_k": round(recall_at_k(found, truth), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3)
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size / recall / latency of compressed vector encodings")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dims", type=int, nargs="+", default=[1024])
+    parser.add_argument("--compressions", nargs="+", choices=COMPRESSIONS, default=list(COMPRESSIONS))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rows = []
+    for dim in args.dims:
+        for n in args.sizes:
+            rows.extend(bench(n, dim, args))
+            if not args.json:
+                print(f"[INFO] {n} x {dim} done")
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"\nrecall@{args.k} vs float32, {args.queries} single-vector queries")
+    print(f"{'vectors':>9} {'dim':>5} {'index':<18} {'MB':>8} {'B/vec':>7} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in rows:
+        print(f"{r['vectors']:>9} {r['dim']:>5} {r['index']:<18} {r['file_mb']:>8} {r['bytes_per_vector']:>7} "
+              f"{r['build_s']:>8} {r['recall_at_k']:>7} {r['p50_ms']:>8} {r['p99_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark bộ nhớ và độ trễ query đầu tiên khi N worker cùng nạp các FAISS index:
+so sánh FAISS.load_local ("memory") với nạp mmap ("mmap") trên cùng một host.
+
+Mỗi worker là một process riêng (giống gunicorn worker): nạp toàn bộ index, chạy một query,
+đợi mọi worker nạp xong rồi đo RSS/PSS từ /proc/self/smaps_rollup. PSS chia đều các page
+dùng chung giữa các process, nên tổng PSS là RAM vật lý thực sự bị chiếm.
+
+Usage:
+  python benchmarks/mmap_load_benchmark.py --workers 4 --indexes 10 --vectors 20000
+  python benchmarks/mmap_load_benchmark.py --modes mmap --dim 256 --json
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import tempfile
+import multiprocessing as mp
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from bench_utils import memory_usage
+
+
+def _build_indexes(folder, count, vectors, dim):
+    import faiss
+    from langchain.schema import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    rng = np.random.default_rng(0)
+    names = []
+    for i in range(count):
+        name = f"bench_{i}"
+        index = faiss.IndexFlatL2(dim)
+        index.add(rng.random((vectors, dim), dtype=np.float32))
+        faiss.write_index(index, os.path.join(folder, f"{name}.faiss"))
+
+        ids = {position: f"{name}:{position}" for position in range(vectors)}
+        docstore = InMemoryDocstore({
+            doc_id: Document(page_content=f"chunk {doc_id}", metadata={"section": f"S{position % 50}"})
+            for position, doc_id in ids.items()
+        })
+        with open(os.path.join(folder, f"{name}.pkl"), "wb") as f:
+            pickle.dump((docstore, ids), f)
+        names.append(name)
+    return names
+
+
+def _worker(mode, folder, names, dim, barrier, results):
+    import warnings
+    warnings.filterwarnings("ignore")
+    from utils.admin.faiss_io import load_faiss_store
+
+    baseline = memory_usage()
+    t0 = time.time()
+    stores = [load_faiss_store(name, None, folder, mode=mode) for name in names]
+    load_ms = (time.time() - t0) * 1000
+
+    query = np.random.default_rng(os.getpid()).random((1, dim), dtype=np.float32)
+    t0 = time.time()
+    for store in stores:
+        store.index.search(query, 5)
+    first_query_ms = (time.time() - t0) * 1000
+
+    t0 = time.time()
+    for store in stores:
+        store.index.search(query, 5)
+    warm_query_ms = (time.time() - t0) * 1000
+
+    # Measure only once every worker holds its indexes, so shared pages are split across all of them
+    barrier.wait()
+    usage = memory_usage()
+    results.put({
+        "load_ms": load_ms,
+        "first_query_ms": first_query_ms,
+        "warm_query_ms": warm_query_ms,
+        "rss_mb": usage.get("rss_mb", 0) - baseline.get("rss_mb", 0),
+        "pss_mb": usage.get("pss_mb", 0) - baseline.get("pss_mb", 0)
+    })
+    barrier.wait()
+
+
+def run_mode(mode, folder, names, dim, workers):
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(mode, folder, names, dim, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    return {
+        "mode": mode,
+        "workers": workers,
+        "load_ms_avg": round(sum(r["load_ms"] for r in rows) / workers, 1),
+        "first_query_ms_avg": round(sum(r["first_query_ms"] for r in rows) / workers, 2),
+        "first_query_ms_max": round(max(r["first_query_ms"] for r in rows), 2),
+        "warm_query_ms_avg": round(sum(r["warm_query_ms"] for r in rows) / workers, 2),
+        "rss_mb_per_worker": round(sum(r["rss_mb"] for r in rows) / workers, 1),
+        "pss_mb_total": round(sum(r["pss_mb"] for r in rows), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS load_local vs mmap memory/latency benchmark")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--indexes", type=int, default=10)
+    parser.add_argument("--vectors", type=int, default=20000, help="Vectors per index")
+    parser.add_argument("--dim", type=int, default=1024, help="Titan v2 default dimension")
+    parser.add_argument("--modes", nargs="+", default=["memory", "mmap"])
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="faiss_bench_") as folder:
+        names = _build_indexes(folder, args.indexes, args.vectors, args.dim)
+        index_mb = sum(os.path.getsize(os.path.join(folder, f"{n}.faiss")) for n in names) / 1024 / 1024
+        reports = [run_mode(mode, folder, names, args.dim, args.workers) for mode in args.modes]
+
+    if args.json:
+        print(json.dumps({"index_mb": round(index_mb, 1), "results": reports}, indent=2))
+        return
+
+    print(f"\n{args.indexes} indexes x {args.vectors} vectors x {args.dim} dims = {index_mb:.0f}MB of .faiss, {args.workers} workers")
+    print(f"{'mode':<8} {'load ms':>9} {'1st q ms':>9} {'1st q max':>10} {'warm q ms':>10} {'RSS/worker MB':>14} {'PSS total MB':>13}")
+    for r in reports:
+        print(f"{r['mode']:<8} {r['load_ms_avg']:>9} {r['first_query_ms_avg']:>9} {r['first_query_ms_max']:>10} "
+              f"{r['warm_query_ms_avg']:>10} {r['rss_mb_per_worker']:>14} {r['pss_mb_total']:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Benchmark tầng retrieval (get_smart_files -> load_multiple_vector_stores -> retrieve_relevant_docs
+-> build_context) trên corpus sổ tay tổng hợp từ 10 đến 10.000 file, không cần Bedrock, S3 hay database.
+
+Mỗi kích thước corpus chạy trong hai process riêng: một process sinh corpus vào thư mục cache index
+tạm (định dạng giống lúc upload: .faiss/.pkl, chunk store, .bm25, routing + summary vectors), một
+process đo trên registry dựng sẵn. Embedding là hashing embedding tất định (âm tiết + bigram), nên hai
+lần chạy trên cùng tham số cho cùng kết quả retrieval.
+
+"cold": cache vector store trong process bị xóa trước mỗi câu hỏi (shard nạp lại từ đĩa; page cache của
+OS vẫn nóng vì corpus vừa được ghi). "warm": cùng các câu hỏi khi cache đã đầy. Throughput đo với
+``--concurrency`` request song song trên cache nóng.
+
+Usage:
+  python benchmarks/retrieval_benchmark.py                                  # 10, 100, 1000, 10000 files
+  python benchmarks/retrieval_benchmark.py --sizes 10 100 --output before.json
+  python benchmarks/retrieval_benchmark.py --sizes 10 100 --output after.json --compare before.json
+  python benchmarks/retrieval_benchmark.py --embed-latency-ms 40            # simulate Bedrock round trips
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import pickle
+import random
+import argparse
+import tempfile
+import multiprocessing as mp
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from bench_utils import memory_usage, quiet
+
+STAGES = ("select_files", "load_stores", "retrieve", "build_context", "total")
+
+TOPIC_TITLES = {
+    "bao_hiem": "Chính sách bảo hiểm",
+    "luong_thuong": "Chính sách lương thưởng",
+    "nghi_phep": "Quy định nghỉ phép",
+    "tuyen_dung": "Quy trình tuyển dụng",
+    "danh_gia": "Quy chế đánh giá",
+}
+
+SENTENCES = [
+    "Nhân viên được hưởng {kw} theo quy định của công ty và hợp đồng lao động.",
+    "Việc đăng ký {kw} được thực hiện trên hệ thống nội bộ trước ngày {day} hằng tháng.",
+    "Phòng Nhân sự chịu trách nhiệm giải đáp các thắc mắc liên quan đến {kw}.",
+    "Mức {kw} được điều chỉnh hằng năm dựa trên kết quả đánh giá và ngân sách của bộ phận.",
+    "Trường hợp vi phạm quy định về {kw}, nhân viên bị xử lý theo nội quy lao động.",
+    "Chi tiết về {kw} được trình bày tại Điều {article} của sổ tay này.",
+    "Quản lý trực tiếp phê duyệt các yêu cầu về {kw} trong vòng {day} ngày làm việc.",
+]
+
+QUESTIONS = [
+    "Công ty đóng bảo hiểm xã hội cho nhân viên như thế nào?",
+    "Lương tháng 13 được tính ra sao?",
+    "Một năm tôi có bao nhiêu ngày nghỉ phép?",
+    "Quy trình thử việc kéo dài bao lâu?",
+    "Làm thêm giờ được trả phụ cấp thế nào?",
+    "Đánh giá KPI diễn ra khi nào?",
+    "Chế độ thai sản gồm những gì?",
+    "Thủ tục nghỉ việc cần chuẩn bị gì?",
+    "Tôi có được làm việc từ xa không?",
+    "Thưởng cuối năm phụ thuộc vào yếu tố nào?",
+    "Công ty có chương trình đào tạo e-learning không?",
+    "Quy định về kỷ luật lao động là gì?",
+]
+
+
+class HashingEmbeddings(Embeddings):
+    """Embedding giả, tất định, offline: hash term (âm tiết + bigram, bỏ dấu) vào ``dim`` chiều có dấu"""
+
+    def __init__(self, dim: int, latency_ms: float = 0.0):
+        from utils.admin.lexical_index import tokenize, fold_diacritics
+        self.dim = dim
+        self.latency = latency_ms / 1000
+        self.calls = 0
+        self._tokenize = tokenize
+        self._fold = fold_diacritics
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term in self._tokenize(self._fold(text or "")):
+            digest = zlib.crc32(term.encode("utf-8"))
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def embed_documents(self, texts):
+        self._round_trip()
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        self._round_trip()
+        return self._embed(text).tolist()
+
+
+def _prepare_process(folder):
+    # DATA_DIR is os.getcwd()/data, and an uncapped cache keeps record_local_index O(1) per file
+    os.chdir(folder)
+    os.environ["INDEX_CACHE_MAX_BYTES"] = "0"
+    import warnings
+    warnings.filterwarnings("ignore")
+
+
+def synthetic_handbook(position, chunks, rng):
+    """(original_filename, documents) của một sổ tay: chủ đề chính chiếm ~75% câu"""
+    from langchain.schema import Document
+    from utils.admin.file_routing import ROUTING_TOPICS, HANDBOOK_TYPE_TOPICS
+
+    topics = list(TOPIC_TITLES)
+    primary = topics[position % len(topics)]
+    handbook_type = next(name for name, topic in HANDBOOK_TYPE_TOPICS.items() if topic == primary)
+    original_filename = f"{TOPIC_TITLES[primary]} {position:05d}.pdf"
+
+    documents = []
+    for chunk in range(chunks):
+        article = chunk + 1
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            topic = primary if rng.random() < 0.75 else rng.choice(topics)
+            sentences.append(rng.choice(SENTENCES).format(
+                kw=rng.choice(ROUTING_TOPICS[topic]), day=rng.randint(1, 28), article=rng.randint(1, 60)))
+        documents.append(Document(
+            page_content=f"Điều {article}. {TOPIC_TITLES[primary]}\n" + " ".join(sentences),
+            metadata={"section": f"Điều {article}", "handbook_type": handbook_type,
+                      "source_file": original_filename, "page": article // 4 + 1}
+        ))
+    return original_filename, documents
+
+
+def _generate(folder, size, args, results):
+    _prepare_process(folder)
+    try:
+        with quiet(args.verbose):
+            results.put(generate_corpus(size, args))
+    except Exception as e:
+        results.put({"error": f"generate: {e!r}"})
+
+
+def generate_corpus(size, args):
+    """Ghi ``size`` index vào DATA_DIR như lúc upload và lưu registry (kèm routing, summary) ra registry.pkl"""
+    from utils.admin.upload_s3_utils import DATA_DIR
+    from utils.admin.index_builder import build_vector_store_from_embeddings
+    from utils.admin.lexical_index import write_lexical_index
+    from utils.admin.chunk_store import write_chunk_store
+    from utils.admin.index_cache import record_local_index
+    from utils.admin.file_registry import HASH_COLUMNS
+    from utils.admin.file_routing import compute_file_routing, compute_file_summary
+
+    embeddings = HashingEmbeddings(args.dim)
+    rng = random.Random(args.seed + size)
+    t0 = time.time()
+    files, summaries = [], {}
+    for position in range(size):
+        unique_filename = f"bench-{size}-{position:05d}"
+        original_filename, documents = synthetic_handbook(position, args.chunks, rng)
+        texts = [doc.page_content for doc in documents]
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+        store = build_vector_store_from_embeddings(texts, vectors, embeddings, [doc.metadata for doc in documents])
+        store.save_local(index_name=unique_filename, folder_path=DATA_DIR)
+        write_lexical_index(unique_filename, texts)
+        storage_format = "pickle"
+        if args.storage == "chunks":
+            write_chunk_store(unique_filename, store)
+            storage_format = "chunks"
+        hashes = record_local_index(unique_filename)
+        summary = compute_file_summary(vectors)
+
+        files.append({
+            "unique_filename": unique_filename,
+            "original_filename": original_filename,
+            "request_id": unique_filename,
+            "timestamp": 1700000000 + position,
+            **{column: hashes.get(kind) for kind, column in HASH_COLUMNS.items()},
+            "storage_format": storage_format,
+            "routing": {**compute_file_routing(documents), "summary_vectors": len(summary)}
+        })
+        summaries[unique_filename] = summary
+
+    with open("registry.pkl", "wb") as f:
+        pickle.dump({"files": files, "version": 1, "summaries": summaries}, f)
+    index_bytes = sum(os.path.getsize(os.path.join(DATA_DIR, name)) for name in os.listdir(DATA_DIR))
+    return {"files": size, "chunks": size * args.chunks, "index_mb": round(index_bytes / 1024 / 1024, 1),
+            "generate_s": round(time.time() - t0, 1)}
+
+
+def _summarize(samples):
+    values = np.asarray(samples, dtype=np.float64)
+    return {"mean_ms": round(float(values.mean()), 3), "p50_ms": round(float(np.percentile(values, 50)), 3),
+            "p95_ms": round(float(np.percentile(values, 95)), 3), "max_ms": round(float(values.max()), 3)}
+
+
+def _measure(folder, args, results):
+    _prepare_process(folder)
+    try:
+        with quiet(args.verbose):
+            results.put(measure_retrieval(args))
+    except Exception as e:
+        results.put({"error": f"measure: {e!r}"})
+
+
+def measure_retrieval(args):
+    baseline = memory_usage()
+    from utils.admin.index_builder import DEFAULT_INDEX_SETTINGS
+    import utils.user.vector_store_utils as vsu
+
+    # The synthetic cache has no merged corpus index; looking for one would go to S3
+    vsu.USE_CORPUS_INDEX = False
+    with open("registry.pkl", "rb") as f:
+        registry = pickle.load(f)
+
+    t0 = time.time()
+    vsu._install_registry(registry, None)
+    views_ms = (time.time() - t0) * 1000
+    # Serve the installed registry as if it came from the database and was just checked
+    vsu._registry_state.update(db_version=registry["version"], db_checked_at=float("inf"), checked_at=float("inf"))
+
+    embeddings = HashingEmbeddings(args.dim, args.embed_latency_ms)
+    search_settings = dict(DEFAULT_INDEX_SETTINGS)
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.queries)]
+
+    def run_query(question):
+        timings = {}
+        t_start = t = time.perf_counter()
+        files = vsu.get_smart_files(question, args.max_files)
+        files = vsu.prioritize_files_for_hr_questions(files, question)
+        files = vsu.prune_files_by_summary(files, question, embeddings)
+        timings["select_files"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        stores = vsu.load_multiple_vector_stores(files, embeddings)
+        timings["load_stores"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        docs = vsu.retrieve_relevant_docs(stores, question, args.k, search_settings=search_settings)
+        timings["retrieve"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        vsu.build_context(docs, question, model=args.model)
+        timings["build_context"] = time.perf_counter() - t
+        timings["total"] = time.perf_counter() - t_start
+        return {stage: seconds * 1000 for stage, seconds in timings.items()}, len(stores), len(docs)
+
+    def run_pass(cold):
+        samples = {stage: [] for stage in STAGES}
+        shards = hits = 0
+        for question in questions:
+            if cold:
+                vsu.invalidate_vector_store_cache()
+            timings, loaded, found = run_query(question)
+            for stage in STAGES:
+                samples[stage].append(timings[stage])
+            shards += loaded
+            hits += found
+        return {stage: _summarize(values) for stage, values in samples.items()}, shards, hits
+
+    cold, shards, hits = run_pass(cold=True)
+    memory_cold = memory_usage()
+    warm, _, _ = run_pass(cold=False)
+    memory_warm = memory_usage()
+
+    from concurrent.futures import ThreadPoolExecutor
+    requests = questions * args.repeat
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run_query, requests))
+    elapsed = time.perf_counter() - t0
+
+    try:
+        from utils.admin.token_utils import count_tokens
+        count_tokens("kiểm tra")
+        tokenizer = "tiktoken"
+    except Exception:
+        tokenizer = "fallback (800-char excerpts)"
+
+    return {
+        "registry_views_ms": round(views_ms, 2),
+        "shards_per_query": round(shards / len(questions), 2),
+        "docs_per_query": round(hits / len(questions), 2),
+        "cold": cold,
+        "warm": warm,
+        "throughput_qps": round(len(requests) / elapsed, 2),
+        "concurrency": args.concurrency,
+        "embedding_calls": embeddings.calls,
+        "memory_mb": {
+            "rss_after_cold": round(memory_cold.get("rss_mb", 0) - baseline.get("rss_mb", 0), 1),
+            "rss_after_warm": round(memory_warm.get("rss_mb", 0) - baseline.get("rss_mb", 0), 1),
+            "pss_after_warm": round(memory_warm.get("pss_mb", 0) - baseline.get("pss_mb", 0), 1)
+        },
+        "vector_store_cache": vsu.get_vector_store_cache_stats(),
+        "file_pruning": vsu.get_file_pruning_stats(),
+        "tokenizer": tokenizer
+    }
+
+
+def run_size(size, args):
+    ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="retrieval_bench_") as folder:
+        row = {"files": size}
+        for target, target_args in ((_generate, (folder, size, args)), (_measure, (folder, args))):
+            results = ctx.Queue()
+            process = ctx.Process(target=target, args=target_args + (results,))
+            process.start()
+            result = results.get()
+            process.join()
+            row.update(result)
+            if "error" in result:
+                break
+    return row
+
+
+def compare(rows, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        before = {row["files"]: row for row in json.load(f).get("results", [])}
+    print(f"\nwarm p50 vs {baseline_path} (after / before)")
+    print(f"{'files':>7} " + " ".join(f"{stage:>15}" for stage in STAGES) + f" {'qps':>15}")
+    for row in rows:
+        old = before.get(row["files"])
+        if not old or "warm" not in old or "warm" not in row:
+            continue
+        cells = []
+        for stage in STAGES:
+            new_ms, old_ms = row["warm"][stage]["p50_ms"], old["warm"][stage]["p50_ms"]
+            cells.append(f"{new_ms:>7.2f}/{old_ms:<7.2f}")
+        print(f"{row['files']:>7} " + " ".join(cells) + f" {row['throughput_qps']:>7}/{old['throughput_qps']:<7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval-layer latency/memory/throughput on synthetic corpora")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Files per corpus")
+    parser.add_argument("--chunks", type=int, default=20, help="Chunks per file")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--storage", choices=["chunks", "pickle"], default="chunks")
+    parser.add_argument("--queries", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=4, help="Passes over the queries for the throughput run")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--k", type=int, default=5, help="retrieve_k per shard")
+    parser.add_argument("--max-files", type=int, default=25, help="MAX_FILES_TO_LOAD")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Model whose context token budget is used")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Sleep per embedding call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="retrieval_benchmark.json")
+    parser.add_argument("--compare", help="Earlier --output file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the retrieval code's own logs")
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        print(f"🚀 {size} files x {args.chunks} chunks")
+        row = run_size(size, args)
+        rows.append(row)
+        if "error" in row:
+            print(f"❌ {row['error']}")
+            continue
+        print(f"✅ generated {row['index_mb']}MB in {row['generate_s']}s, "
+              f"warm total p50 {row['warm']['total']['p50_ms']}ms, {row['throughput_qps']} qps")
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")},
+        "results": rows
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'files':>7} {'views ms':>9} {'shards':>7} " + " ".join(f"{stage + ' c/w':>22}" for stage in STAGES)
+          + f" {'qps':>7} {'RSS MB':>7}")
+    for row in rows:
+        if "error" in row:
+            continue
+        cells = [f"{row['cold'][stage]['p50_ms']:>10.2f}/{row['warm'][stage]['p50_ms']:<11.2f}" for stage in STAGES]
+        print(f"{row['files']:>7} {row['registry_views_ms']:>9} {row['shards_per_query']:>7} " + " ".join(cells)
+              + f" {row['throughput_qps']:>7} {row['memory_mb']['rss_after_warm']:>7}")
+
+    if args.compare:
+        compare(rows, args.compare)
+    print(f"\n🎉 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
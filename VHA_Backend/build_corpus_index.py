@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Xây dựng lại corpus index (một FAISS index chung cho mọi file) từ các index riêng đã có trong registry.
+
+Usage:
+  python build_corpus_index.py            # merge all registered files
+  python build_corpus_index.py --dry-run  # only report what would be merged
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from utils.aws_client import bedrock_embeddings
+from config.database import db
+from utils.admin.file_registry import load_registry_snapshot, get_registry_version
+from utils.admin.vector_utils import load_vector_store_from_s3
+from utils.admin.corpus_index import corpus_entries_from_store, _save_corpus, corpus_write_lock
+from utils.admin.index_builder import build_vector_store_from_embeddings, describe_index
+
+
+def main():
+    # The registry lives in the database: without an app context the rebuild would silently read
+    # the legacy S3 registry and drop every file uploaded since the migration
+    with app.app_context():
+        rebuild()
+
+
+def rebuild():
+    parser = argparse.ArgumentParser(description="Rebuild the merged corpus FAISS index")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the files that would be merged")
+    args = parser.parse_args()
+
+    version, registry = load_registry_snapshot()
+    files = registry["files"]
+    print(f"🚀 Found {len(files)} files in registry (version {version})")
+
+    texts, vectors, all_metadatas, all_ids = [], [], [], []
+    merged_files = 0
+    merged_chunks = 0
+
+    for file_info in files:
+        unique_filename = file_info.get("unique_filename")
+        original_filename = file_info.get("original_filename", unique_filename)
+        store = load_vector_store_from_s3(unique_filename, bedrock_embeddings=bedrock_embeddings)
+        if store is None:
+            print(f"⚠️  Skipping {original_filename}: index not available")
+            continue
+
+        ntotal = store.index.ntotal
+        if args.dry_run or ntotal == 0:
+            print(f"   {original_filename}: {ntotal} chunks")
+            continue
+
+        text_embeddings, metadatas, ids = corpus_entries_from_store(unique_filename, original_filename, store)
+        for text, vector in text_embeddings:
+            texts.append(text)
+            vectors.append(vector)
+        all_metadatas.extend(metadatas)
+        all_ids.extend(ids)
+
+        merged_files += 1
+        merged_chunks += ntotal
+        print(f"✅ {original_filename}: {ntotal} chunks")
+
+    if args.dry_run:
+        return
+
+    if not texts:
+        print("❌ No indexes could be merged")
+        sys.exit(1)
+
+    # Built in one pass so the index type (Flat/IVF) matches the total corpus size
+    corpus = build_vector_store_from_embeddings(texts, vectors, bedrock_embeddings, all_metadatas, all_ids, mutable=True)
+
+    # Uploads and deletes committed while the corpus was being merged would be overwritten by this
+    # save; under the write lock no further corpus edit can slip in between the check and the save
+    with corpus_write_lock():
+        db.session.rollback()
+        current_version = get_registry_version()
+        if current_version != version:
+            print(f"❌ Registry changed during the rebuild (version {version} -> {current_version}), "
+                  f"corpus not saved; run the script again")
+            sys.exit(1)
+        _save_corpus(corpus)
+    print(f"\n🎉 Corpus index built: {merged_files} files, {merged_chunks} chunks, {describe_index(corpus.index)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tính metadata định tuyến (handbook_type, chủ đề, summary vectors) cho các file đã upload trước khi
+có routing index. File chưa có routing / summary vẫn được tìm kiếm với mọi câu hỏi, nên chạy script
+này một lần sau khi deploy.
+
+Usage:
+  python build_file_routing.py
+  python build_file_routing.py --dry-run
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from utils.aws_client import bedrock_embeddings
+from utils.admin.file_registry import list_registry_entries, set_file_routing
+from utils.admin.file_routing import compute_file_routing, compute_file_summary
+from utils.admin.index_builder import reconstruct_vectors
+from utils.admin.chunk_store import iter_store_documents
+from utils.user.vector_store_utils import load_faiss_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build topic routing metadata for existing indexes")
+    parser.add_argument("--dry-run", action="store_true", help="Print topics without saving them")
+    parser.add_argument("--all", action="store_true", help="Recompute files that already have routing metadata")
+    args = parser.parse_args()
+
+    with app.app_context():
+        files = [
+            f for f in list_registry_entries()
+            if args.all or not (f.get("routing") or {}).get("summary_vectors")
+        ]
+        print(f"🚀 Building routing metadata for {len(files)} files")
+
+        saved = 0
+        for file_info in files:
+            store = load_faiss_index(file_info["unique_filename"], bedrock_embeddings)
+            if store is None:
+                print(f"⚠️  Skipping {file_info['original_filename']}: index not available")
+                continue
+            routing = compute_file_routing(iter_store_documents(store))
+            summary = compute_file_summary(reconstruct_vectors(store.index))
+            print(f"✅ {file_info['original_filename']}: {routing['handbook_type']} {routing['topics']}, "
+                  f"{len(summary)} summary vectors")
+            if args.dry_run:
+                continue
+            error = set_file_routing(file_info["unique_filename"], routing, summary)
+            if error:
+                print(f"❌ {error}")
+            else:
+                saved += 1
+
+        print(f"\n🎉 Saved routing for {saved} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Dựng file BM25 (.bm25) cho các index đã upload trước khi có hybrid retrieval, kể cả corpus index,
+rồi upload lên S3 cạnh file .faiss. Index đã có .bm25 bị bỏ qua trừ khi dùng --force.
+
+Usage:
+  python build_lexical_indexes.py
+  python build_lexical_indexes.py --force
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from utils.aws_client import bedrock_embeddings, s3_client
+from utils.admin.upload_s3_utils import BUCKET_NAME, s3_lock
+from utils.admin.file_registry import list_registry_entries
+from utils.admin.corpus_index import CORPUS_INDEX_NAME
+from utils.admin.index_cache import ensure_local_index, record_local_index, LEXICAL_KINDS
+from utils.admin.chunk_store import iter_store_documents
+from utils.admin.lexical_index import write_lexical_index
+from utils.user.vector_store_utils import load_faiss_index, invalidate_vector_store_cache
+
+
+def build_one(unique_filename: str, label: str, force: bool) -> bool:
+    if not force and ensure_local_index(unique_filename, None, LEXICAL_KINDS):
+        print(f"⏭️  {label}: already has a lexical index")
+        return False
+    store = load_faiss_index(unique_filename, bedrock_embeddings)
+    if store is None:
+        print(f"⚠️  Skipping {label}: index not available")
+        return False
+
+    path = write_lexical_index(unique_filename, (doc.page_content for doc in iter_store_documents(store)))
+    with s3_lock:
+        s3_client.upload_file(Filename=path, Bucket=BUCKET_NAME, Key=f"faiss_indexes/{os.path.basename(path)}")
+    record_local_index(unique_filename)
+    invalidate_vector_store_cache(unique_filename)
+    print(f"✅ {label}: {store.index.ntotal} chunks")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build BM25 lexical indexes for existing FAISS indexes")
+    parser.add_argument("--force", action="store_true", help="Rebuild even when a .bm25 file already exists")
+    args = parser.parse_args()
+
+    with app.app_context():
+        files = list_registry_entries()
+        print(f"🚀 Building lexical indexes for {len(files)} files and the corpus index")
+
+        built = 0
+        for file_info in files:
+            try:
+                built += build_one(file_info["unique_filename"], file_info["original_filename"], args.force)
+            except Exception as e:
+                print(f"❌ {file_info['original_filename']}: {e}")
+        try:
+            built += build_one(CORPUS_INDEX_NAME, "corpus index", args.force)
+        except Exception as e:
+            print(f"❌ corpus index: {e}")
+
+        print(f"\n🎉 Built {built} lexical indexes")
+
+
+if __name__ == "__main__":
+    main()
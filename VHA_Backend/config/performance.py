@@ -7,12 +7,113 @@ MAX_DOCS_TO_RETRIEVE = 5
 MAX_DOCS_TO_PROCESS = 5
 
 VECTOR_STORE_CACHE_SIZE = 32
-EMBEDDING_CACHE_SIZE = 100
+VECTOR_STORE_CACHE_MAX_BYTES = int(os.getenv("VECTOR_STORE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+EMBEDDING_CACHE_SIZE = 1000
+EMBEDDING_CACHE_TTL = 7 * 24 * 3600
+
+RETRIEVAL_MAX_WORKERS = 8
+# Shard loads (S3 download + disk read) run on their own pool so slow loads cannot starve searches
+SHARD_LOAD_MAX_WORKERS = int(os.getenv("SHARD_LOAD_MAX_WORKERS", 16))
+SHARD_LOAD_TIMEOUT = 5.0
+SHARD_SEARCH_TIMEOUT = 2.0
+RETRIEVAL_DEADLINE = 8.0
 
 S3_TIMEOUT = 10
+
+# Index downloads: parts of one index are fetched in parallel, files above the threshold as
+# multipart ranged GETs of S3_MULTIPART_CHUNKSIZE with up to S3_MAX_CONCURRENCY threads each
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 8))
+S3_DOWNLOAD_WORKERS = int(os.getenv("S3_DOWNLOAD_WORKERS", 8))
 LLM_TIMEOUT = 30
 
 DEBUG_MODE = False
 
+USE_CORPUS_INDEX = True
+CORPUS_FETCH_K_MULTIPLIER = 4
+CORPUS_REFRESH_INTERVAL = 300
+
+REGISTRY_VERSION_CHECK_INTERVAL = 5
+
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+INDEX_WARMUP_COUNT = int(os.getenv("INDEX_WARMUP_COUNT", 5))
+INDEX_PREFETCH_COUNT = int(os.getenv("INDEX_PREFETCH_COUNT", 20))
+INDEX_WARMUP_STRATEGY = os.getenv("INDEX_WARMUP_STRATEGY", "recent")
+
+# Negative cache for indexes that could not be downloaded or read: skipped for MISSING_INDEX_MIN_TTL
+# seconds after the first failure, doubling up to MISSING_INDEX_TTL while they keep failing
+MISSING_INDEX_MIN_TTL = 30
+MISSING_INDEX_TTL = int(os.getenv("MISSING_INDEX_TTL", 300))
+
+CHUNK_STORE_ENABLED = os.getenv("CHUNK_STORE_ENABLED", "true").lower() == "true"
+
+# "mmap": page .faiss files in on demand and share them between workers; "memory": read fully into RAM
+FAISS_LOAD_MODE = os.getenv("FAISS_LOAD_MODE", "mmap")
+
+# Index type by vector count: Flat up to INDEX_FLAT_MAX_VECTORS, then HNSW, then IVF
+INDEX_FLAT_MAX_VECTORS = 20000
+INDEX_HNSW_MAX_VECTORS = 500000
+INDEX_HNSW_M = 32
+INDEX_HNSW_EF_CONSTRUCTION = 200
+# Defaults for the "index_settings" global config (nprobe / ef_search)
+INDEX_DEFAULT_NPROBE = 16
+INDEX_DEFAULT_EF_SEARCH = 64
+INDEX_SETTINGS_TTL = 30
+
+# Opt-in vector compression for new indexes: "none" (float32), "fp16", "sq8" or "pq"
+INDEX_COMPRESSION = os.getenv("INDEX_COMPRESSION", "none")
+# PQ needs enough vectors to train 256 centroids per sub-quantizer; smaller indexes fall back to sq8
+INDEX_PQ_MIN_VECTORS = 10000
+INDEX_PQ_BYTES_PER_VECTOR = 64
+# Titan v2 output size (1024 default; 512 or 256 shrink every index). Changing it requires
+# re-encoding all indexes with reencode_indexes.py --dimensions and rebuilding the corpus index.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None
+
+# Ingestion embedding pipeline: chunks per task and bounded concurrent Bedrock calls (halved on throttling)
+EMBEDDING_BATCH_SIZE = 8
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 8))
+EMBEDDING_MIN_CONCURRENCY = 1
+EMBEDDING_MAX_RETRIES = 6
+EMBEDDING_BACKOFF_BASE = 0.5
+EMBEDDING_BACKOFF_MAX = 20.0
+
+# Hybrid retrieval: BM25 over syllables (+ syllable bigrams) built next to every index, fused with
+# vector hits by weighted reciprocal rank fusion
+HYBRID_RETRIEVAL_ENABLED = os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true"
+LEXICAL_IGNORE_DIACRITICS = True
+LEXICAL_BM25_K1 = 1.2
+LEXICAL_BM25_B = 0.75
+HYBRID_RRF_K = 60
+HYBRID_VECTOR_WEIGHT = 1.0
+HYBRID_LEXICAL_WEIGHT = 1.0
+# Multi-query retrieval: the raw question is searched together with its rewrite in the same shard
+# pass; rankings of variants after the first (the rewrite) count this much in the fusion
+MULTI_QUERY_ENABLED = os.getenv("MULTI_QUERY_ENABLED", "true").lower() == "true"
+MULTI_QUERY_SECONDARY_WEIGHT = 0.5
+
+# Near-duplicate suppression before context assembly: a chunk is dropped when it is this close to a
+# better-ranked one (cosine of stored vectors, or Jaccard of word shingles when a vector is missing)
+DEDUP_ENABLED = True
+DEDUP_COSINE_THRESHOLD = 0.95
+DEDUP_SHINGLE_SIZE = 5
+DEDUP_JACCARD_THRESHOLD = 0.8
+
+# Prompt context budget in tokens of each chat model's tokenizer; chunks are packed in rank order
+# and the last one that does not fit is cut at a sentence boundary
+CONTEXT_TOKEN_BUDGETS = {"gpt-4o-mini": 4000, "gpt-4.1-mini": 4000, "gpt-4o": 6000, "gpt-4.1": 6000}
+CONTEXT_DEFAULT_TOKEN_BUDGET = 3000
+# A cut chunk shorter than this is left out instead of sending a fragment
+CONTEXT_MIN_PARTIAL_TOKENS = 60
+
+# Topic routing built at ingestion: questions that mention a topic only search the files tagged with it
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "true").lower() == "true"
+ROUTING_MIN_TOPIC_SHARE = 0.05
+# Per-file summary vectors (mean + up to FILE_SUMMARY_VECTORS k-means centroids) scored against the
+# question in one matrix product; only the FILE_PRUNING_TOP_M best files are loaded and searched
+FILE_SUMMARY_VECTORS = 4
+FILE_PRUNING_ENABLED = os.getenv("FILE_PRUNING_ENABLED", "true").lower() == "true"
+FILE_PRUNING_TOP_M = 8
+
 FILE_LOADING_STRATEGY = "latest"
 SMART_LOADING_KEYWORDS = ["lương", "bảo hiểm", "nghỉ phép", "tuyển dụng"]
@@ -1,2 +1,8 @@
+import os
+
 ENABLE_RERANKER = True
-RERANK_TOP_K = 3
\ No newline at end of file
+RERANK_TOP_K = 3
+# Scorer used by the rerank stage: "combined" (stored-vector cosine + term overlap), "embedding",
+# "lexical", or any name registered with utils.user.rerank_utils.register_reranker
+RERANKER = os.getenv("RERANKER", "combined")
+RERANK_EMBEDDING_WEIGHT = 0.7
@@ -789,6 +789,108 @@ def get_admin_files():
         log_system_action("ERROR", "ADMIN_FILES", details={"error": str(e)})
         return jsonify(api_response(ErrorCode.INTERNAL_SERVER_ERROR, f"Error retrieving files: {str(e)}")), 500 
 
+@admin_bp.route("/retrieval/stats", methods=["GET"])
+@require_session
+@require_admin
+def get_retrieval_stats():
+    """
+    Lấy thống kê cache của tầng truy xuất tài liệu (Admin only)
+    ---
+    tags:
+      - Admin
+    responses:
+      200:
+        description: Lấy thống kê thành công
+    """
+    try:
+        from utils.user.vector_store_utils import (
+            get_vector_store_cache_stats, get_hybrid_retrieval_stats, get_context_packing_stats,
+            get_file_pruning_stats, get_multi_query_stats, get_missing_index_stats
+        )
+        from utils.user.shard_fanout import get_shard_latency_stats, get_fanout_pool_stats
+        from utils.embedding_cache import get_embedding_cache_stats
+        from utils.admin.index_cache import get_index_cache_stats
+        from utils.admin.upload_s3_utils import get_s3_download_stats
+        from utils.admin.embedding_pipeline import get_embedding_pipeline_stats
+        from utils.admin.chunk_embedding_store import get_chunk_embedding_store_stats
+        from utils.user.rerank_utils import get_rerank_stats
+        from utils.user.dedup_utils import get_dedup_stats
+
+        stats = {
+            "vector_store_cache": get_vector_store_cache_stats(),
+            "index_cache": get_index_cache_stats(),
+            "s3_downloads": get_s3_download_stats(),
+            "shard_latency": get_shard_latency_stats(),
+            "fanout_pools": get_fanout_pool_stats(),
+            "embedding_cache": get_embedding_cache_stats(),
+            "ingestion_embeddings": get_embedding_pipeline_stats(),
+            "chunk_embedding_store": get_chunk_embedding_store_stats(),
+            "hybrid_retrieval": get_hybrid_retrieval_stats(),
+            "rerank": get_rerank_stats(),
+            "dedup": get_dedup_stats(),
+            "context": get_context_packing_stats(),
+            "file_pruning": get_file_pruning_stats(),
+            "multi_query": get_multi_query_stats(),
+            "missing_indexes": get_missing_index_stats()
+        }
+        return jsonify(api_response(ErrorCode.SUCCESS, "Retrieval stats retrieved successfully", stats)), 200
+    except Exception as e:
+        return jsonify(api_response(ErrorCode.SERVER_ERROR, "Failed to retrieve retrieval stats", {
+            "error": str(e)
+        })), 500
+
+@admin_bp.route("/retrieval/missing-indexes", methods=["GET"])
+@require_session
+@require_admin
+def get_missing_indexes():
+    """
+    Danh sách index đang bị bỏ qua vì thiếu trên S3 hoặc không đọc được (Admin only).
+    Cache âm nằm trong từng worker, nên kết quả là của worker trả lời request.
+    ---
+    tags:
+      - Admin
+    responses:
+      200:
+        description: Lấy danh sách thành công
+    """
+    try:
+        from utils.user.vector_store_utils import get_missing_index_stats
+        return jsonify(api_response(ErrorCode.SUCCESS, "Missing indexes retrieved successfully", get_missing_index_stats())), 200
+    except Exception as e:
+        return jsonify(api_response(ErrorCode.SERVER_ERROR, "Failed to retrieve missing indexes", {
+            "error": str(e)
+        })), 500
+
+@admin_bp.route("/retrieval/missing-indexes", methods=["DELETE"])
+@require_session
+@require_admin
+def clear_missing_indexes():
+    """
+    Thử lại ngay các index đang bị bỏ qua (Admin only), ví dụ sau khi upload lại file lên S3 bằng tay.
+    Truyền ?unique_filename=... để chỉ thử lại một file.
+    ---
+    tags:
+      - Admin
+    parameters:
+      - name: unique_filename
+        in: query
+        type: string
+        required: false
+    responses:
+      200:
+        description: Xóa thành công
+    """
+    try:
+        from utils.user.vector_store_utils import forget_missing_index
+        unique_filename = request.args.get("unique_filename") or None
+        forget_missing_index(unique_filename)
+        log_system_action("DELETE", "MISSING_INDEX_CACHE", details={"unique_filename": unique_filename})
+        return jsonify(api_response(ErrorCode.SUCCESS, "Missing index cache cleared")), 200
+    except Exception as e:
+        return jsonify(api_response(ErrorCode.SERVER_ERROR, "Failed to clear missing index cache", {
+            "error": str(e)
+        })), 500
+
 @admin_bp.route("/config/global", methods=["GET"])
 @require_session
 @require_admin
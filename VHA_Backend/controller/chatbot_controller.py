@@ -142,10 +142,7 @@ def upload_pdf():
                     request_id=unique_filename,
                     documents=docs,
                     original_filename=original_filename,
-                    bedrock_embeddings=BedrockEmbeddings(
-                        model_id=os.getenv("MODEL_ID"),
-                        client=bedrock_client
-                    )
+                    bedrock_embeddings=bedrock_embeddings
                 )
             finally:
                 if os.path.exists(temp_file_path):
@@ -345,12 +342,13 @@ def get_full_doc():
 
     try:
         from utils.user.vector_store_utils import load_faiss_index
+        from utils.admin.chunk_store import iter_store_documents
         from utils.aws_client import bedrock_embeddings
         vectorstore = load_faiss_index(unique_filename, bedrock_embeddings)
         if not vectorstore:
             return jsonify(api_response(ErrorCode.NOT_FOUND, "File not found")), 404
 
-        docs = vectorstore.docstore._dict.values()
+        docs = iter_store_documents(vectorstore)
         doc_list = []
         for doc in docs:
             doc_list.append({
@@ -12,9 +12,11 @@ from utils.admin.vector_utils import (
     advanced_semantic_split,
     create_vector_store,
 )
-from utils.aws_client import bedrock_client
+from utils.admin.index_maintenance import list_index_chunks, update_index
+from utils.aws_client import bedrock_client, bedrock_embeddings
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.embeddings import BedrockEmbeddings
+from langchain.schema import Document
 from error.error_codes import ErrorCode
 from urllib.parse import unquote_plus
 
@@ -91,10 +93,7 @@ def upload_file():
             request_id=unique_filename,
             documents=docs,
             original_filename=original_filename,
-            bedrock_embeddings=BedrockEmbeddings(
-                model_id=os.getenv("MODEL_ID"),
-                client=bedrock_client
-            )
+            bedrock_embeddings=bedrock_embeddings
         )
 
         file_doc = FileDocument(
@@ -129,6 +128,107 @@ def upload_file():
         db.session.rollback()
         return jsonify(api_response(ErrorCode.SERVER_ERROR, f"Upload failed: {str(e)}")), 500
 
+@file_bp.route("/index/<string:unique_filename>/chunks", methods=["GET"])
+@require_session
+@require_admin
+def list_index_chunks_route(unique_filename):
+    """
+    Liệt kê các chunk trong index của một file (Admin only)
+    ---
+    tags:
+      - File Management
+    parameters:
+      - name: unique_filename
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Danh sách chunk (id, section, page_number, preview)
+      404:
+        description: Không tìm thấy index
+    """
+    try:
+        chunks = list_index_chunks(unique_filename)
+    except ValueError as e:
+        return jsonify(api_response(ErrorCode.NOT_FOUND, str(e))), 404
+    except Exception as e:
+        return jsonify(api_response(ErrorCode.SERVER_ERROR, f"Failed to list chunks: {str(e)}")), 500
+    return jsonify(api_response(ErrorCode.SUCCESS, "Chunks retrieved successfully", {
+        "unique_filename": unique_filename,
+        "chunks": chunks
+    })), 200
+
+@file_bp.route("/index/<string:unique_filename>/chunks", methods=["PATCH"])
+@require_session
+@require_admin
+def update_index_chunks(unique_filename):
+    """
+    Thêm / xóa chunk trong index của một file mà không dựng lại toàn bộ index (Admin only)
+    ---
+    tags:
+      - File Management
+    parameters:
+      - name: unique_filename
+        in: path
+        type: string
+        required: true
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            add:
+              type: array
+              items:
+                type: object
+                properties:
+                  text:
+                    type: string
+                  metadata:
+                    type: object
+            remove_ids:
+              type: array
+              items:
+                type: string
+            remove_sections:
+              type: array
+              items:
+                type: string
+    responses:
+      200:
+        description: Cập nhật thành công
+      400:
+        description: Dữ liệu không hợp lệ
+      404:
+        description: Không tìm thấy index
+    """
+    data = request.get_json(silent=True) or {}
+    add = data.get("add") or []
+    remove_ids = data.get("remove_ids") or []
+    remove_sections = data.get("remove_sections") or []
+    if not isinstance(add, list) or not isinstance(remove_ids, list) or not isinstance(remove_sections, list):
+        return jsonify(api_response(ErrorCode.BAD_REQUEST, "add, remove_ids and remove_sections must be lists")), 400
+    if any(not isinstance(item, dict) or not str(item.get("text", "")).strip() for item in add):
+        return jsonify(api_response(ErrorCode.BAD_REQUEST, "Every added chunk needs a non-empty text")), 400
+    if not add and not remove_ids and not remove_sections:
+        return jsonify(api_response(ErrorCode.BAD_REQUEST, "Nothing to update")), 400
+
+    documents = [Document(page_content=item["text"], metadata=dict(item.get("metadata") or {})) for item in add]
+    try:
+        result = update_index(unique_filename, documents, remove_ids, remove_sections, bedrock_embeddings)
+    except ValueError as e:
+        return jsonify(api_response(ErrorCode.NOT_FOUND, str(e))), 404
+    except Exception as e:
+        return jsonify(api_response(ErrorCode.SERVER_ERROR, f"Index update failed: {str(e)}")), 500
+
+    log_system_action("UPDATE", "FILE_INDEX", unique_filename, {
+        "added": result["added"],
+        "removed": result["removed"]
+    })
+    return jsonify(api_response(ErrorCode.SUCCESS, "Index updated successfully", result)), 200
+
 @file_bp.route("/<string:file_id>", methods=["GET"])
 @require_session
 @require_member_or_admin
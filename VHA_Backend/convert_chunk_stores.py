@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Chuyển các index đã có từ docstore pickle (.pkl) sang chunk store (.chunks.bin + .chunks.idx).
+
+File .pkl vẫn được giữ trên S3 để rollback (CHUNK_STORE_ENABLED=false) và cho corpus index.
+
+Usage:
+  python convert_chunk_stores.py            # convert every file still in pickle format
+  python convert_chunk_stores.py --dry-run  # only list the files that would be converted
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_community.vectorstores import FAISS
+from app import app
+from utils.aws_client import s3_client, bedrock_embeddings
+from utils.admin.upload_s3_utils import DATA_DIR, BUCKET_NAME, s3_lock
+from utils.admin.file_registry import list_registry_entries, set_registry_storage_format
+from utils.admin.index_cache import ensure_local_index, record_local_index, registry_index_hashes
+from utils.admin.chunk_store import write_chunk_store, chunk_store_paths, load_lazy_store
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def convert_file(file_info):
+    unique_filename = file_info["unique_filename"]
+    if not ensure_local_index(unique_filename, registry_index_hashes(file_info)):
+        print(f"⚠️  Skipping {file_info['original_filename']}: index not available")
+        return False
+
+    t0 = time.time()
+    store = FAISS.load_local(
+        index_name=unique_filename,
+        folder_path=DATA_DIR,
+        embeddings=bedrock_embeddings,
+        allow_dangerous_deserialization=True
+    )
+    pickle_ms = (time.time() - t0) * 1000
+
+    chunks = write_chunk_store(unique_filename, store)
+
+    t0 = time.time()
+    load_lazy_store(unique_filename, bedrock_embeddings)
+    lazy_ms = (time.time() - t0) * 1000
+
+    with s3_lock:
+        for path in chunk_store_paths(unique_filename):
+            s3_client.upload_file(Filename=path, Bucket=BUCKET_NAME, Key=f"faiss_indexes/{os.path.basename(path)}")
+
+    error = set_registry_storage_format(unique_filename, "chunks", record_local_index(unique_filename))
+    if error:
+        print(f"❌ {file_info['original_filename']}: {error}")
+        return False
+
+    bin_path, idx_path = chunk_store_paths(unique_filename)
+    pkl_path = os.path.join(DATA_DIR, f"{unique_filename}.pkl")
+    print(f"✅ {file_info['original_filename']}: {chunks} chunks | "
+          f"pkl {_size(pkl_path) / 1024:.0f}KB loaded in {pickle_ms:.0f}ms -> "
+          f"bin {_size(bin_path) / 1024:.0f}KB + idx {_size(idx_path) / 1024:.0f}KB loaded in {lazy_ms:.0f}ms")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert pickled docstores to chunk stores")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the files that would be converted")
+    args = parser.parse_args()
+
+    with app.app_context():
+        files = [f for f in list_registry_entries() if f.get("storage_format") != "chunks"]
+        print(f"🚀 {len(files)} files still use the pickle format")
+        if args.dry_run:
+            for file_info in files:
+                print(f"   {file_info['original_filename']} ({file_info['unique_filename']})")
+            return
+
+        converted = 0
+        for file_info in files:
+            try:
+                if convert_file(file_info):
+                    converted += 1
+            except Exception as e:
+                print(f"❌ {file_info['original_filename']}: {e}")
+
+        print(f"\n🎉 Converted {converted}/{len(files)} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Đo tác động của rerank stage trên các index thật: với mỗi câu hỏi, so sánh context đầy đủ
+(mọi chunk retrieval trả về) với context sau rerank (rerank_k chunk) theo từng scorer.
+
+Chỉ số:
+  - số chunk / ký tự của context, độ trễ rerank
+  - hit@rerank_k nếu câu hỏi có "expected_text" (đoạn văn bản phải có trong context)
+  - với --generate: độ trễ LLM và answer recall (tỉ lệ term của câu trả lời mẫu "expected_answer"
+    xuất hiện trong câu trả lời sinh ra) cho context đầy đủ và context sau rerank
+
+Mặc định dùng các câu hỏi + câu trả lời mẫu trong data_chatting/hr_quick_responses.json.
+
+Usage:
+  python evaluate_rerank.py
+  python evaluate_rerank.py --questions eval.json --retrieve-k 5 --rerank-k 3 --rerankers combined lexical
+  python evaluate_rerank.py --generate --json rerank_eval.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from utils.aws_client import bedrock_embeddings
+from utils.admin.lexical_index import tokenize, fold_diacritics
+from utils.user.vector_store_utils import (
+    get_smart_files, load_multiple_vector_stores, retrieve_relevant_docs, build_context, embed_question
+)
+from utils.user.rerank_utils import rerank_documents, available_rerankers
+from utils.user.llm_services import chatgpt_generate, build_prompt
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_chatting", "hr_quick_responses.json")
+
+
+def load_questions(path, limit):
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    questions = []
+    for item in items:
+        questions.append({
+            "question": item["question"],
+            "expected_text": item.get("expected_text"),
+            "expected_answer": item.get("expected_answer") or item.get("response")
+        })
+    return questions[:limit] if limit else questions
+
+
+def _terms(text):
+    return {fold_diacritics(term) for term in tokenize(text or "") if "_" not in term}
+
+
+def answer_recall(answer, expected):
+    expected_terms = _terms(expected)
+    return len(expected_terms & _terms(answer)) / len(expected_terms) if expected_terms else None
+
+
+def contains_expected(docs, expected_text):
+    if not expected_text:
+        return None
+    needle = fold_diacritics(expected_text.lower())
+    return any(needle in fold_diacritics(doc.page_content.lower()) for doc in docs)
+
+
+def evaluate_context(item, docs, generate, model):
+    context = build_context(docs, item["question"])
+    row = {"chunks": len(docs), "chars": len(context), "hit": contains_expected(docs, item["expected_text"])}
+    if generate:
+        t0 = time.time()
+        answer = chatgpt_generate(build_prompt(context, item["question"], "vi"), model=model)
+        row["llm_ms"] = round((time.time() - t0) * 1000, 1)
+        row["answer_recall"] = answer_recall(answer, item["expected_answer"])
+    return row
+
+
+def _mean(rows, key):
+    values = [row[key] for row in rows if row.get(key) is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the rerank stage against full retrieval context")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS,
+                        help="JSON list of {question, expected_text?, expected_answer?}")
+    parser.add_argument("--limit", type=int, default=0, help="Only evaluate the first N questions")
+    parser.add_argument("--retrieve-k", type=int, default=5)
+    parser.add_argument("--rerank-k", type=int, default=3)
+    parser.add_argument("--rerankers", nargs="+", default=available_rerankers())
+    parser.add_argument("--generate", action="store_true", help="Also generate answers with the LLM (costs tokens)")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--json", dest="json_path", help="Write per-question results to this file")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions, args.limit)
+    print(f"🚀 Evaluating rerankers {', '.join(args.rerankers)} on {len(questions)} questions")
+
+    results = {"full": [], **{name: [] for name in args.rerankers}}
+    per_question = []
+    with app.app_context():
+        for item in questions:
+            vector_stores = load_multiple_vector_stores(get_smart_files(item["question"]), bedrock_embeddings)
+            query_embedding = embed_question(item["question"], bedrock_embeddings)
+            docs = retrieve_relevant_docs(vector_stores, item["question"], k=args.retrieve_k, query_embedding=query_embedding)
+            if not docs:
+                print(f"⚠️  No documents for: {item['question']}")
+                continue
+
+            row = {"question": item["question"], "full": evaluate_context(item, docs, args.generate, args.model)}
+            results["full"].append(row["full"])
+            for name in args.rerankers:
+                t0 = time.time()
+                kept = rerank_documents(item["question"], [doc for doc in docs], args.rerank_k,
+                                        vector_stores, query_embedding, reranker=name)
+                rerank_ms = round((time.time() - t0) * 1000, 2)
+                row[name] = {**evaluate_context(item, kept, args.generate, args.model), "rerank_ms": rerank_ms}
+                results[name].append(row[name])
+            per_question.append(row)
+            print(f"✅ {item['question'][:60]}: {row['full']['chunks']} -> {args.rerank_k} chunks")
+
+    print(f"\n{'variant':<12} {'chunks':>7} {'chars':>8} {'hit':>6} {'rerank ms':>10} {'llm ms':>8} {'recall':>7}")
+    summary = {}
+    for name, rows in results.items():
+        summary[name] = {key: _mean(rows, key) for key in ("chunks", "chars", "hit", "rerank_ms", "llm_ms", "answer_recall")}
+        s = summary[name]
+        print(f"{name:<12} {s['chunks'] or 0:>7} {s['chars'] or 0:>8.0f} {s['hit'] if s['hit'] is not None else '-':>6} "
+              f"{s['rerank_ms'] if s['rerank_ms'] is not None else '-':>10} {s['llm_ms'] if s['llm_ms'] is not None else '-':>8} "
+              f"{s['answer_recall'] if s['answer_recall'] is not None else '-':>7}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "questions": per_question}, f, ensure_ascii=False, indent=2)
+        print(f"\n🎉 Results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
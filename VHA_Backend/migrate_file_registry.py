@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Migration script chuyển faiss_indexes/file_registry.json trên S3 sang bảng file_registry
+"""
+
+import os
+import json
+
+from app import app
+from sqlalchemy import text
+from models.models_db import db, FileRegistryEntry
+from utils.aws_client import s3_client
+from utils.admin.file_registry import import_registry_entries
+
+REGISTRY_KEY = "faiss_indexes/file_registry.json"
+
+def add_missing_columns():
+    """Thêm các cột sha256 của chunk store vào bảng file_registry tạo trước khi có chúng"""
+    for column in ("chunks_bin_sha256", "chunks_idx_sha256"):
+        db.session.execute(text(f"ALTER TABLE file_registry ADD COLUMN IF NOT EXISTS {column} VARCHAR(64)"))
+    db.session.commit()
+
+def migrate_file_registry():
+    """Import các entry của registry JSON vào database (bỏ qua entry đã tồn tại)"""
+    with app.app_context():
+        try:
+            db.create_all()
+            add_missing_columns()
+
+            try:
+                response = s3_client.get_object(Bucket=os.getenv("BUCKET_NAME"), Key=REGISTRY_KEY)
+                registry = json.loads(response['Body'].read().decode('utf-8'))
+            except s3_client.exceptions.NoSuchKey:
+                print(f"{REGISTRY_KEY} not found in S3, nothing to migrate")
+                return
+
+            files = registry.get("files", [])
+            print(f"Registry JSON: {len(files)} files, table: {FileRegistryEntry.query.count()} rows")
+
+            imported, error = import_registry_entries(files)
+            if error:
+                print(f"Migration error: {error}")
+                return
+            print(f"Imported {imported} registry entries")
+
+        except Exception as e:
+            print(f"Migration error: {e}")
+            db.session.rollback()
+
+if __name__ == "__main__":
+    migrate_file_registry()
@@ -1,5 +1,6 @@
 from config.database import db
 from datetime import datetime
+import json
 import uuid
 
 from models.email_models import EmailTemplate, EmailKeyword, ContactEmail, TeamStructure, EmailConversation
@@ -70,6 +71,78 @@ class FileDocument(db.Model):
     file_size = db.Column(db.Integer)
     description = db.Column(db.Text)
 
+class FileRegistryEntry(db.Model):
+    """Registry các FAISS index đã upload (thay cho faiss_indexes/file_registry.json trên S3)"""
+    __tablename__ = "file_registry"
+
+    unique_filename = db.Column(db.String(100), primary_key=True)
+    original_filename = db.Column(db.String(255), nullable=False, index=True)
+    request_id = db.Column(db.String(100), nullable=True, index=True)
+    timestamp = db.Column(db.BigInteger, nullable=False, index=True)
+    upload_date = db.Column(db.DateTime, default=datetime.now)
+    faiss_key = db.Column(db.String(255), nullable=True)
+    pkl_key = db.Column(db.String(255), nullable=True)
+    faiss_sha256 = db.Column(db.String(64), nullable=True)
+    pkl_sha256 = db.Column(db.String(64), nullable=True)
+    chunks_bin_sha256 = db.Column(db.String(64), nullable=True)
+    chunks_idx_sha256 = db.Column(db.String(64), nullable=True)
+    storage_format = db.Column(db.String(20), nullable=False, default="pickle")
+
+    def to_dict(self):
+        return {
+            "unique_filename": self.unique_filename,
+            "original_filename": self.original_filename,
+            "request_id": self.request_id,
+            "timestamp": self.timestamp,
+            "upload_date": self.upload_date.isoformat() if self.upload_date else None,
+            "faiss_key": self.faiss_key,
+            "pkl_key": self.pkl_key,
+            "faiss_sha256": self.faiss_sha256,
+            "pkl_sha256": self.pkl_sha256,
+            "chunks_bin_sha256": self.chunks_bin_sha256,
+            "chunks_idx_sha256": self.chunks_idx_sha256,
+            "storage_format": self.storage_format or "pickle"
+        }
+
+class FileRegistryVersion(db.Model):
+    """Một dòng duy nhất, version tăng dần mỗi lần registry thay đổi"""
+    __tablename__ = "file_registry_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+class FileRouting(db.Model):
+    """Chủ đề của một file (tính lúc ingest) để chọn shard theo câu hỏi"""
+    __tablename__ = "file_routing"
+
+    unique_filename = db.Column(db.String(100), primary_key=True)
+    handbook_type = db.Column(db.String(200), nullable=True)
+    topics = db.Column(db.Text, nullable=False, default="{}")
+    chunk_count = db.Column(db.Integer, nullable=False, default=0)
+    # float32 summary vectors (mean + k-means centroids) used to prune files per question
+    summary_vectors = db.Column(db.LargeBinary, nullable=True)
+    summary_dim = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def to_dict(self):
+        return {
+            "handbook_type": self.handbook_type,
+            "topics": json.loads(self.topics or "{}"),
+            "chunk_count": self.chunk_count,
+            "summary_vectors": len(self.summary_vectors) // (4 * self.summary_dim) if self.summary_vectors and self.summary_dim else 0
+        }
+
+class ChunkEmbedding(db.Model):
+    """Embedding của một chunk, theo sha256 của text đã chuẩn hóa và model id (tái sử dụng khi upload lại)"""
+    __tablename__ = "chunk_embeddings"
+
+    model_id = db.Column(db.String(200), primary_key=True)
+    text_sha256 = db.Column(db.String(64), primary_key=True)
+    dim = db.Column(db.Integer, nullable=False)
+    vector = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
 class TokenUsage(db.Model):
     __tablename__ = "token_usage"
 
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Mã hóa lại các index đã có với vector nén (fp16 / SQ8 / PQ) và/hoặc số chiều Titan v2 nhỏ hơn.
+
+Chỉ file .faiss được thay thế: thứ tự vector giữ nguyên nên .pkl và chunk store dùng lại được.
+Mỗi file được báo cáo dung lượng trước/sau, recall@k so với index cũ và độ trễ search p50.
+
+--dimensions embed lại toàn bộ chunk qua Bedrock (Titan v2: 256/512/1024); không có
+--dimensions thì vector được lấy lại từ index hiện tại. Sau khi đổi số chiều cần đặt
+EMBEDDING_DIMENSIONS cho server và chạy lại build_corpus_index.py.
+
+Usage:
+  python reencode_indexes.py --compression sq8 --dry-run   # report only, nothing is replaced
+  python reencode_indexes.py --compression pq
+  python reencode_indexes.py --compression fp16 --dimensions 512 --json report.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from app import app
+from utils.aws_client import s3_client, bedrock_embeddings, make_bedrock_embeddings
+from utils.admin.upload_s3_utils import DATA_DIR, BUCKET_NAME, s3_lock, _invalidate_loaded_indexes
+from utils.admin.file_registry import list_registry_entries, set_registry_storage_format
+from utils.admin.index_cache import ensure_local_index, record_local_index, registry_index_hashes
+from utils.admin.index_builder import COMPRESSIONS, build_faiss_index, describe_index, reconstruct_vectors
+from utils.admin.chunk_store import iter_store_documents
+from utils.admin.faiss_io import replace_index_files
+
+
+def _neighbours(index, queries, query_ids, k):
+    """Top-k ids per query without the query's own chunk, plus single-query latencies"""
+    latencies, found = [], []
+    for query_id, query in zip(query_ids, queries):
+        t0 = time.perf_counter()
+        _, ids = index.search(query[None, :], k + 1)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append([i for i in ids[0] if i != -1 and i != query_id][:k])
+    return found, latencies
+
+
+def compare_indexes(old_index, old_queries, new_index, new_queries, query_ids, k):
+    """recall@k of the new index against the old one, each queried in its own embedding space"""
+    truth, old_latencies = _neighbours(old_index, old_queries, query_ids, k)
+    found, new_latencies = _neighbours(new_index, new_queries, query_ids, k)
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    expected = sum(len(t) for t in truth)
+    return {
+        "recall_at_k": round(hits / expected, 4) if expected else 1.0,
+        "old_p50_ms": round(float(np.percentile(old_latencies, 50)), 3) if old_latencies else 0.0,
+        "new_p50_ms": round(float(np.percentile(new_latencies, 50)), 3) if new_latencies else 0.0
+    }
+
+
+def reencode_file(file_info, args, target_embeddings):
+    unique_filename = file_info["unique_filename"]
+    if not ensure_local_index(unique_filename, registry_index_hashes(file_info)):
+        print(f"⚠️  Skipping {file_info['original_filename']}: index not available")
+        return None
+
+    faiss_path = os.path.join(DATA_DIR, f"{unique_filename}.faiss")
+    store = FAISS.load_local(
+        index_name=unique_filename,
+        folder_path=DATA_DIR,
+        embeddings=bedrock_embeddings,
+        allow_dangerous_deserialization=True
+    )
+    old_index = store.index
+    if old_index.ntotal == 0:
+        print(f"⚠️  Skipping {file_info['original_filename']}: empty index")
+        return None
+
+    old_info = describe_index(old_index)
+    old_vectors = reconstruct_vectors(old_index)
+    if target_embeddings is not None:
+        texts = [doc.page_content for doc in iter_store_documents(store)]
+        vectors = np.asarray(target_embeddings.embed_documents(texts), dtype=np.float32)
+    else:
+        if old_info.get("bytes_per_vector", 4 * old_index.d) < 4 * old_index.d:
+            print(f"   {file_info['original_filename']}: index is already compressed; "
+                  f"pass --dimensions to re-embed from text instead of re-quantizing")
+        vectors = old_vectors
+
+    t0 = time.time()
+    new_index = build_faiss_index(vectors, compression=args.compression)
+    build_ms = (time.time() - t0) * 1000
+
+    rng = np.random.default_rng(0)
+    query_ids = rng.choice(old_index.ntotal, size=min(args.queries, old_index.ntotal), replace=False)
+    quality = compare_indexes(old_index, old_vectors[query_ids], new_index, vectors[query_ids], query_ids, args.k)
+
+    new_info = describe_index(new_index)
+    row = {
+        "unique_filename": unique_filename,
+        "original_filename": file_info["original_filename"],
+        "vectors": int(new_index.ntotal),
+        "old_index": old_info,
+        "new_index": new_info,
+        "old_bytes": os.path.getsize(faiss_path),
+        "new_bytes": int(faiss.serialize_index(new_index).nbytes),
+        "build_ms": round(build_ms, 1),
+        **quality
+    }
+    print(f"{'🔎' if args.dry_run else '✅'} {row['original_filename']}: {row['vectors']} vectors, "
+          f"dim {old_info['dim']} -> {new_info['dim']} | {row['old_bytes'] / 1024:.0f}KB -> {row['new_bytes'] / 1024:.0f}KB | "
+          f"recall@{args.k} {row['recall_at_k']} | p50 {row['old_p50_ms']}ms -> {row['new_p50_ms']}ms")
+
+    if args.dry_run:
+        return row
+
+    tmp_name = f"{unique_filename}.reencode.{os.getpid()}"
+    faiss.write_index(new_index, os.path.join(DATA_DIR, f"{tmp_name}.faiss"))
+    replace_index_files(tmp_name, unique_filename, extensions=(".faiss",))
+    with s3_lock:
+        s3_client.upload_file(Filename=faiss_path, Bucket=BUCKET_NAME, Key=f"faiss_indexes/{unique_filename}.faiss")
+    _invalidate_loaded_indexes(unique_filename)
+
+    error = set_registry_storage_format(unique_filename, file_info.get("storage_format") or "pickle",
+                                        record_local_index(unique_filename))
+    if error:
+        print(f"❌ {file_info['original_filename']}: {error}")
+        return None
+    return row
+
+
+def _summary(rows, k):
+    old_bytes = sum(r["old_bytes"] for r in rows)
+    new_bytes = sum(r["new_bytes"] for r in rows)
+    vectors = sum(r["vectors"] for r in rows)
+    return {
+        "files": len(rows),
+        "old_bytes": old_bytes,
+        "new_bytes": new_bytes,
+        "size_ratio": round(new_bytes / old_bytes, 4) if old_bytes else 0.0,
+        # Weighted by vector count so large handbooks dominate, like they do in retrieval
+        f"recall_at_{k}": round(sum(r["recall_at_k"] * r["vectors"] for r in rows) / vectors, 4) if vectors else 0.0,
+        "old_p50_ms": round(float(np.median([r["old_p50_ms"] for r in rows])), 3) if rows else 0.0,
+        "new_p50_ms": round(float(np.median([r["new_p50_ms"] for r in rows])), 3) if rows else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode FAISS indexes with compressed / reduced-dimension vectors")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="sq8")
+    parser.add_argument("--dimensions", type=int, choices=[256, 512, 1024],
+                        help="Re-embed every chunk with this Titan v2 output size")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="Chunks used as queries for the recall report")
+    parser.add_argument("--dry-run", action="store_true", help="Only report, do not replace any index")
+    parser.add_argument("--json", metavar="PATH", help="Write the per-file report to this JSON file")
+    args = parser.parse_args()
+
+    target_embeddings = make_bedrock_embeddings(args.dimensions) if args.dimensions else None
+
+    with app.app_context():
+        files = list_registry_entries()
+        print(f"🚀 Re-encoding {len(files)} indexes with compression={args.compression}"
+              f"{f', dimensions={args.dimensions}' if args.dimensions else ''}{' (dry run)' if args.dry_run else ''}")
+
+        rows = []
+        for file_info in files:
+            try:
+                row = reencode_file(file_info, args, target_embeddings)
+                if row:
+                    rows.append(row)
+            except Exception as e:
+                print(f"❌ {file_info['original_filename']}: {e}")
+
+    summary = _summary(rows, args.k)
+    print(f"\n🎉 {summary['files']}/{len(files)} files: {summary['old_bytes'] / 1024 / 1024:.1f}MB -> "
+          f"{summary['new_bytes'] / 1024 / 1024:.1f}MB ({summary['size_ratio']:.0%}), "
+          f"recall@{args.k} {summary[f'recall_at_{args.k}']}, "
+          f"median p50 {summary['old_p50_ms']}ms -> {summary['new_p50_ms']}ms")
+    if args.dimensions and not args.dry_run:
+        print(f"   Set EMBEDDING_DIMENSIONS={args.dimensions} and run build_corpus_index.py before serving queries")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "files": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("langchain_community")
+
+from utils.admin.index_builder import build_vector_store_from_embeddings, delete_from_store
+
+
+def _nearest_text(store, vector):
+    _, indices = store.index.search(np.asarray([vector], dtype=np.float32), 1)
+    return store.docstore.search(store.index_to_docstore_id[int(indices[0][0])]).page_content
+
+
+@pytest.mark.parametrize("factory", ["IVF16,Flat", "IVF16,SQ8", "Flat"])
+def test_delete_keeps_hits_mapped_to_their_chunks(factory):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((2000, 16), dtype=np.float32)
+    texts = [f"chunk {i}" for i in range(len(vectors))]
+    store = build_vector_store_from_embeddings(texts, vectors, None, ids=[f"id-{i}" for i in range(len(vectors))],
+                                               factory=factory)
+
+    store = delete_from_store(store, [f"id-{i}" for i in range(0, len(vectors), 3)])
+    assert store.index.ntotal == len(vectors) - len(range(0, len(vectors), 3))
+
+    extra = rng.random((5, 16), dtype=np.float32)
+    store.add_embeddings([(f"new {i}", vector.tolist()) for i, vector in enumerate(extra)], ids=[f"new-{i}" for i in range(5)])
+
+    if "IVF" in factory:
+        import faiss
+        faiss.extract_index_ivf(store.index).nprobe = 16
+    for i in range(1, 300, 3):
+        assert _nearest_text(store, vectors[i]) == f"chunk {i}"
+    for i, vector in enumerate(extra):
+        assert _nearest_text(store, vector) == f"new {i}"
@@ -0,0 +1,80 @@
+import threading
+from typing import Dict, Iterable
+
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert
+
+from config.database import db
+from models.models_db import ChunkEmbedding
+from utils.embedding_cache import chunk_text_hash
+
+LOOKUP_BATCH_SIZE = 500
+
+_stats_lock = threading.Lock()
+_stats = {"reused": 0, "computed": 0, "stored": 0, "errors": 0}
+
+
+def embeddings_model_id(embeddings) -> str:
+    # CachedEmbeddings suffixes reduced Titan v2 dimensions (":512"), so vectors of different sizes never mix
+    return getattr(embeddings, "model_id", None) or "default"
+
+
+def lookup_chunk_embeddings(text_hashes: Iterable[str], model_id: str) -> Dict[str, np.ndarray]:
+    """Vector đã lưu cho các hash; lỗi database được coi như không có vector nào (embed lại)"""
+    hashes = list(dict.fromkeys(text_hashes))
+    found: Dict[str, np.ndarray] = {}
+    try:
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            rows = ChunkEmbedding.query.filter(
+                ChunkEmbedding.model_id == model_id,
+                ChunkEmbedding.text_sha256.in_(hashes[start:start + LOOKUP_BATCH_SIZE])
+            ).all()
+            for row in rows:
+                found[row.text_sha256] = np.frombuffer(row.vector, dtype=np.float32)
+    except Exception as e:
+        db.session.rollback()
+        _record(errors=1)
+        print(f"[WARNING] Chunk embedding store unavailable, embedding every chunk: {e}")
+        return {}
+    return found
+
+
+def save_chunk_embeddings(vectors: Dict[str, np.ndarray], model_id: str) -> int:
+    """Lưu các vector mới tính; bỏ qua hash đã có (một worker khác có thể vừa ghi)"""
+    if not vectors:
+        return 0
+    rows = [
+        {"model_id": model_id, "text_sha256": text_hash, "dim": int(len(vector)),
+         "vector": np.asarray(vector, dtype=np.float32).tobytes()}
+        for text_hash, vector in vectors.items()
+    ]
+    try:
+        for start in range(0, len(rows), LOOKUP_BATCH_SIZE):
+            db.session.execute(insert(ChunkEmbedding).values(rows[start:start + LOOKUP_BATCH_SIZE]).on_conflict_do_nothing())
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        _record(errors=1)
+        print(f"[WARNING] Failed to store chunk embeddings: {e}")
+        return 0
+    _record(stored=len(rows))
+    return len(rows)
+
+
+def _record(**counts: int):
+    with _stats_lock:
+        for counter, amount in counts.items():
+            _stats[counter] += amount
+
+
+def record_reuse(reused: int, computed: int):
+    _record(reused=reused, computed=computed)
+
+
+def get_chunk_embedding_store_stats() -> Dict[str, float]:
+    """Số embedding tái sử dụng / phải tính mới khi ingest trong process này"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["reused"] + stats["computed"]
+    stats["reuse_rate"] = round(stats["reused"] / total, 4) if total else 0.0
+    return stats
@@ -0,0 +1,139 @@
+import os
+import json
+import mmap
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from .upload_s3_utils import DATA_DIR
+from .faiss_io import read_faiss_index
+from .index_builder import search_params_for
+
+CHUNKS_BIN_EXT = ".chunks.bin"
+CHUNKS_IDX_EXT = ".chunks.idx"
+
+
+def chunk_store_paths(unique_filename: str, folder_path: str = DATA_DIR) -> Tuple[str, str]:
+    return (
+        os.path.join(folder_path, f"{unique_filename}{CHUNKS_BIN_EXT}"),
+        os.path.join(folder_path, f"{unique_filename}{CHUNKS_IDX_EXT}"),
+    )
+
+
+def has_chunk_store(unique_filename: str, folder_path: str = DATA_DIR) -> bool:
+    return all(os.path.exists(path) for path in chunk_store_paths(unique_filename, folder_path))
+
+
+def write_chunk_store(unique_filename: str, vectorstore, folder_path: str = DATA_DIR) -> int:
+    """
+    Ghi docstore của một FAISS store ra định dạng chunk store theo thứ tự vector id:
+    ``.chunks.bin`` chứa các bản ghi JSON nối liền nhau, ``.chunks.idx`` chứa mảng offset (npy).
+    Trả về số chunk đã ghi.
+    """
+    bin_path, idx_path = chunk_store_paths(unique_filename, folder_path)
+    ntotal = vectorstore.index.ntotal
+    offsets = np.zeros(ntotal + 1, dtype=np.uint64)
+
+    tmp_bin, tmp_idx = f"{bin_path}.tmp", f"{idx_path}.tmp"
+    with open(tmp_bin, "wb") as f:
+        position = 0
+        for vector_id in range(ntotal):
+            docstore_id = vectorstore.index_to_docstore_id[vector_id]
+            doc = vectorstore.docstore.search(docstore_id)
+            record = {
+                "id": docstore_id,
+                "page_content": doc.page_content if isinstance(doc, Document) else "",
+                "metadata": doc.metadata if isinstance(doc, Document) else {}
+            }
+            data = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8")
+            f.write(data)
+            position += len(data)
+            offsets[vector_id + 1] = position
+
+    with open(tmp_idx, "wb") as f:
+        np.save(f, offsets)
+    os.replace(tmp_bin, bin_path)
+    os.replace(tmp_idx, idx_path)
+    return ntotal
+
+
+class ChunkStore:
+    """Đọc lazy các chunk theo vector id; chỉ decode những bản ghi được truy cập"""
+
+    def __init__(self, bin_path: str, idx_path: str):
+        self.offsets = np.load(idx_path, mmap_mode="r")
+        self._file = open(bin_path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+    def _record(self, vector_id: int) -> Dict[str, Any]:
+        start, end = int(self.offsets[vector_id]), int(self.offsets[vector_id + 1])
+        return json.loads(self._data[start:end].decode("utf-8"))
+
+    def get(self, vector_id: int) -> Optional[Document]:
+        if vector_id < 0 or vector_id >= len(self):
+            return None
+        record = self._record(vector_id)
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def docstore_id(self, vector_id: int) -> str:
+        return self._record(vector_id)["id"]
+
+    def __iter__(self) -> Iterator[Document]:
+        for vector_id in range(len(self)):
+            yield self.get(vector_id)
+
+
+class LazyFaissStore:
+    """
+    Thay thế cho FAISS.load_local không cần unpickle docstore: index FAISS được đọc bình thường,
+    còn text/metadata lấy từ ChunkStore theo vector id khi cần.
+    """
+
+    def __init__(self, index, chunks: ChunkStore, embedding_function, normalize_L2: bool = False):
+        self.index = index
+        self.chunks = chunks
+        self.embedding_function = embedding_function
+        self._normalize_L2 = normalize_L2
+
+    def get_document(self, vector_id: int) -> Optional[Document]:
+        return self.chunks.get(int(vector_id))
+
+    def iter_documents(self) -> Iterator[Document]:
+        return iter(self.chunks)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        vector = np.asarray([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            import faiss
+            faiss.normalize_L2(vector)
+        scores, indices = self.index.search(vector, k, params=search_params_for(self.index, kwargs.get("search_settings")))
+        return [
+            (self.get_document(vector_id), float(score))
+            for score, vector_id in zip(scores[0], indices[0])
+            if vector_id != -1
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+
+def load_lazy_store(unique_filename: str, embeddings, folder_path: str = DATA_DIR) -> LazyFaissStore:
+    index = read_faiss_index(os.path.join(folder_path, f"{unique_filename}.faiss"))
+    chunks = ChunkStore(*chunk_store_paths(unique_filename, folder_path))
+    if len(chunks) != index.ntotal:
+        raise ValueError(f"Chunk store of {unique_filename} has {len(chunks)} chunks, index has {index.ntotal}")
+    return LazyFaissStore(index, chunks, embeddings)
+
+
+def iter_store_documents(store) -> Iterator[Document]:
+    """Duyệt mọi chunk của một store, dù là FAISS (pickle) hay LazyFaissStore"""
+    if hasattr(store, "iter_documents"):
+        return store.iter_documents()
+    return (store.docstore.search(store.index_to_docstore_id[i]) for i in range(store.index.ntotal))
@@ -0,0 +1,258 @@
+import os
+import threading
+import contextlib
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from sqlalchemy import text
+
+from .upload_s3_utils import DATA_DIR, BUCKET_NAME, s3_lock, download_from_s3, _invalidate_loaded_indexes
+from .faiss_io import replace_index_files
+from .lexical_index import write_lexical_index, lexical_index_path
+from .index_builder import build_vector_store_from_embeddings, reconstruct_vectors, delete_from_store
+from utils.aws_client import s3_client
+from config.database import db
+
+CORPUS_INDEX_NAME = "corpus_index"
+
+_corpus_write_lock = threading.Lock()
+# pg advisory lock id serialising corpus read-modify-write across workers and hosts
+CORPUS_WRITE_LOCK_ID = 730417001
+
+
+@contextlib.contextmanager
+def corpus_write_lock():
+    """
+    Khóa ghi corpus index: lock trong process và pg_advisory_xact_lock trên một connection riêng,
+    giữ đến khi ghi S3 xong, để worker khác không ghi đè corpus bằng bản tải về trước đó.
+    Không có PostgreSQL (hoặc app context) thì chỉ khóa trong process.
+    """
+    with _corpus_write_lock:
+        connection = transaction = None
+        try:
+            connection = db.engine.connect()
+            transaction = connection.begin()
+            connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": CORPUS_WRITE_LOCK_ID})
+        except Exception as e:
+            print(f"[WARNING] Corpus write lock is process-local only: {e}")
+            if connection is not None:
+                connection.close()
+            connection = transaction = None
+        try:
+            yield
+        finally:
+            if connection is not None:
+                # Ending the transaction releases the advisory lock
+                transaction.rollback()
+                connection.close()
+
+
+def _corpus_paths():
+    return (
+        os.path.join(DATA_DIR, f"{CORPUS_INDEX_NAME}.faiss"),
+        os.path.join(DATA_DIR, f"{CORPUS_INDEX_NAME}.pkl"),
+    )
+
+
+def _load_corpus_for_update(embeddings) -> Optional[FAISS]:
+    """Load the latest corpus index from S3 (falling back to the local copy) for a write"""
+    faiss_path, pkl_path = _corpus_paths()
+    if not download_from_s3(CORPUS_INDEX_NAME) and not (os.path.exists(faiss_path) and os.path.exists(pkl_path)):
+        return None
+    try:
+        return FAISS.load_local(
+            index_name=CORPUS_INDEX_NAME,
+            folder_path=DATA_DIR,
+            embeddings=embeddings,
+            allow_dangerous_deserialization=True
+        )
+    except Exception as e:
+        print(f"[ERROR] Cannot load corpus index for update: {e}")
+        return None
+
+
+def _save_corpus(corpus: FAISS):
+    # Write under a temporary name and rename: readers may have the current file memory-mapped
+    tmp_name = f"{CORPUS_INDEX_NAME}.tmp.{os.getpid()}"
+    corpus.save_local(index_name=tmp_name, folder_path=DATA_DIR)
+    replace_index_files(tmp_name, CORPUS_INDEX_NAME)
+    faiss_path, pkl_path = _corpus_paths()
+    write_lexical_index(CORPUS_INDEX_NAME, (
+        corpus.docstore.search(corpus.index_to_docstore_id[position]).page_content
+        for position in range(corpus.index.ntotal)
+    ))
+    with s3_lock:
+        s3_client.upload_file(Filename=faiss_path, Bucket=BUCKET_NAME, Key=f"faiss_indexes/{CORPUS_INDEX_NAME}.faiss")
+        s3_client.upload_file(Filename=pkl_path, Bucket=BUCKET_NAME, Key=f"faiss_indexes/{CORPUS_INDEX_NAME}.pkl")
+        s3_client.upload_file(Filename=lexical_index_path(CORPUS_INDEX_NAME), Bucket=BUCKET_NAME,
+                              Key=f"faiss_indexes/{CORPUS_INDEX_NAME}.bm25")
+    _invalidate_loaded_indexes(CORPUS_INDEX_NAME)
+
+    from .index_cache import record_local_index
+    record_local_index(CORPUS_INDEX_NAME)
+
+
+def get_corpus_file_positions(corpus: FAISS) -> Dict[str, np.ndarray]:
+    """unique_filename -> vector positions of its chunks in the corpus index (computed once per load)"""
+    positions = getattr(corpus, "_corpus_file_positions", None)
+    if positions is None:
+        by_file: Dict[str, List[int]] = {}
+        for position, doc_id in corpus.index_to_docstore_id.items():
+            unique_filename = corpus.docstore.search(doc_id).metadata.get("unique_filename")
+            if unique_filename:
+                by_file.setdefault(unique_filename, []).append(position)
+        positions = {name: np.asarray(ids, dtype=np.int64) for name, ids in by_file.items()}
+        corpus._corpus_file_positions = positions
+    return positions
+
+
+def get_corpus_files(corpus: FAISS) -> Set[str]:
+    """Return the set of unique_filenames whose chunks live in the corpus index"""
+    return set(get_corpus_file_positions(corpus))
+
+
+def corpus_positions_for(corpus: FAISS, unique_filenames: Iterable[str]) -> np.ndarray:
+    """Sorted vector positions of the chunks of ``unique_filenames`` in the corpus index"""
+    positions = get_corpus_file_positions(corpus)
+    parts = [positions[name] for name in unique_filenames if name in positions]
+    return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+
+def corpus_chunk_id(unique_filename: str, docstore_id: str) -> str:
+    # Keyed by the per-file docstore id (stable across incremental updates), not the vector position
+    return f"{unique_filename}:{docstore_id}"
+
+
+def corpus_entries_from_store(unique_filename: str, original_filename: str, vectorstore: FAISS,
+                              docstore_ids: Optional[Iterable[str]] = None):
+    """Extract (text_embeddings, metadatas, ids) of a per-file index (or only ``docstore_ids``) in corpus format"""
+    position_of = {doc_id: position for position, doc_id in vectorstore.index_to_docstore_id.items()}
+    wanted = list(docstore_ids) if docstore_ids is not None else [
+        vectorstore.index_to_docstore_id[position] for position in range(vectorstore.index.ntotal)
+    ]
+    if not wanted:
+        return [], [], []
+
+    vectors = reconstruct_vectors(vectorstore.index, [position_of[doc_id] for doc_id in wanted])
+    texts, metadatas, ids = [], [], []
+    for doc_id in wanted:
+        doc = vectorstore.docstore.search(doc_id)
+        metadata = dict(doc.metadata)
+        metadata["unique_filename"] = unique_filename
+        metadata["source_file"] = original_filename
+        texts.append(doc.page_content)
+        metadatas.append(metadata)
+        ids.append(corpus_chunk_id(unique_filename, doc_id))
+
+    return list(zip(texts, vectors.tolist())), metadatas, ids
+
+
+def _file_chunk_ids(corpus: FAISS, unique_filename: str) -> List[str]:
+    return [
+        doc_id for doc_id, doc in corpus.docstore._dict.items()
+        if doc.metadata.get("unique_filename") == unique_filename
+    ]
+
+
+def add_to_corpus_index(unique_filename: str, original_filename: str, vectorstore: FAISS, embeddings) -> bool:
+    """
+    Thêm các chunk của một file vào corpus index chung.
+    Dùng lại vector đã tính trong index riêng của file nên không gọi lại Bedrock.
+    """
+    try:
+        text_embeddings, metadatas, ids = corpus_entries_from_store(unique_filename, original_filename, vectorstore)
+        if not text_embeddings:
+            return False
+
+        with corpus_write_lock():
+            corpus = _load_corpus_for_update(embeddings)
+            if corpus is None:
+                texts, vectors = zip(*text_embeddings)
+                corpus = build_vector_store_from_embeddings(list(texts), vectors, embeddings, metadatas, ids, mutable=True)
+            else:
+                # Replace every chunk of the file, including entries written with older id formats
+                stale_ids = _file_chunk_ids(corpus, unique_filename)
+                if stale_ids:
+                    corpus = delete_from_store(corpus, stale_ids)
+                corpus.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            _save_corpus(corpus)
+
+        print(f"[INFO] Added {len(ids)} chunks of {original_filename} to corpus index")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Failed to add {unique_filename} to corpus index: {e}")
+        return False
+
+
+def update_corpus_chunks(unique_filename: str, original_filename: str, vectorstore: FAISS,
+                         added_ids: List[str], removed_ids: List[str], embeddings) -> bool:
+    """
+    Áp dụng thay đổi tăng dần của một file vào corpus index: xóa ``removed_ids`` và thêm
+    ``added_ids`` (docstore id của index riêng). Nếu corpus còn chunk của file theo định dạng
+    id cũ (theo vị trí vector) hoặc chưa có file này thì thay toàn bộ chunk của file.
+    """
+    try:
+        with corpus_write_lock():
+            corpus = _load_corpus_for_update(embeddings)
+            if corpus is None:
+                return False
+
+            file_ids = set(_file_chunk_ids(corpus, unique_filename))
+            prefix_length = len(f"{unique_filename}:")
+            known_ids = set(vectorstore.docstore._dict) | set(removed_ids)
+            replace_all = not file_ids or any(doc_id[prefix_length:] not in known_ids for doc_id in file_ids)
+            if replace_all:
+                stale_ids = list(file_ids)
+                text_embeddings, metadatas, ids = corpus_entries_from_store(unique_filename, original_filename, vectorstore)
+            else:
+                removed = {corpus_chunk_id(unique_filename, doc_id) for doc_id in removed_ids}
+                stale_ids = list(removed & file_ids)
+                text_embeddings, metadatas, ids = corpus_entries_from_store(
+                    unique_filename, original_filename, vectorstore, added_ids)
+
+            if stale_ids:
+                corpus = delete_from_store(corpus, stale_ids)
+            if text_embeddings:
+                corpus.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            _save_corpus(corpus)
+
+        print(f"[INFO] Corpus index: -{len(stale_ids)} +{len(ids)} chunks for {original_filename}"
+              f"{' (file replaced)' if replace_all else ''}")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Failed to update corpus chunks of {unique_filename}: {e}")
+        return False
+
+
+def remove_from_corpus_index(unique_filenames: Iterable[str], embeddings=None) -> int:
+    """Xóa toàn bộ chunk của các file khỏi corpus index, trả về số chunk đã xóa"""
+    names = {name for name in unique_filenames if name}
+    if not names:
+        return 0
+
+    try:
+        if embeddings is None:
+            from utils.aws_client import bedrock_embeddings
+            embeddings = bedrock_embeddings
+
+        with corpus_write_lock():
+            corpus = _load_corpus_for_update(embeddings)
+            if corpus is None:
+                return 0
+
+            doc_ids: List[str] = [
+                doc_id for doc_id, doc in corpus.docstore._dict.items()
+                if doc.metadata.get("unique_filename") in names
+            ]
+            if not doc_ids:
+                return 0
+
+            corpus = delete_from_store(corpus, doc_ids)
+            _save_corpus(corpus)
+
+        print(f"[INFO] Removed {len(doc_ids)} chunks from corpus index")
+        return len(doc_ids)
+    except Exception as e:
+        print(f"[ERROR] Failed to remove {names} from corpus index: {e}")
+        return 0
@@ -0,0 +1,161 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from config.performance import (
+        EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_CONCURRENCY, EMBEDDING_MIN_CONCURRENCY,
+        EMBEDDING_MAX_RETRIES, EMBEDDING_BACKOFF_BASE, EMBEDDING_BACKOFF_MAX
+    )
+except ImportError:
+    EMBEDDING_BATCH_SIZE = 8
+    EMBEDDING_MAX_CONCURRENCY = 8
+    EMBEDDING_MIN_CONCURRENCY = 1
+    EMBEDDING_MAX_RETRIES = 6
+    EMBEDDING_BACKOFF_BASE = 0.5
+    EMBEDDING_BACKOFF_MAX = 20.0
+
+THROTTLING_MARKERS = ("ThrottlingException", "TooManyRequests", "Too many requests", "Rate exceeded",
+                      "ServiceUnavailable", "ModelNotReady")
+
+
+class AdaptiveConcurrency:
+    """
+    Giới hạn số lời gọi Bedrock đồng thời theo kiểu AIMD: giảm một nửa khi bị throttle,
+    tăng thêm 1 sau mỗi ``limit`` lời gọi thành công liên tiếp.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self._active -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+# Shared by every upload in this process: Bedrock throttles per account, not per request
+_limiter = AdaptiveConcurrency(EMBEDDING_MAX_CONCURRENCY, EMBEDDING_MIN_CONCURRENCY, EMBEDDING_MAX_CONCURRENCY)
+_executor = ThreadPoolExecutor(max_workers=EMBEDDING_MAX_CONCURRENCY, thread_name_prefix="ingest-embed")
+
+_stats_lock = threading.Lock()
+_stats = {"runs": 0, "chunks": 0, "batches": 0, "throttled": 0, "failed_runs": 0, "seconds": 0.0,
+          "last_chunks_per_sec": 0.0}
+
+
+def is_throttling_error(e: Exception) -> bool:
+    # BedrockEmbeddings wraps botocore errors in ValueError, so match on the message
+    text = f"{type(e).__name__} {e}"
+    return any(marker in text for marker in THROTTLING_MARKERS)
+
+
+def _backoff_delay(attempt: int) -> float:
+    # Exponential backoff with jitter so throttled workers do not retry in lockstep
+    return min(EMBEDDING_BACKOFF_MAX, EMBEDDING_BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def _embed_batch(embeddings, texts: List[str], counters: Dict[str, int]) -> List[List[float]]:
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        throttled = False
+        _limiter.acquire()
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == EMBEDDING_MAX_RETRIES or not is_throttling_error(e):
+                raise
+            throttled = True
+        finally:
+            _limiter.release(throttled)
+        with _stats_lock:
+            counters["throttled"] += 1
+        time.sleep(_backoff_delay(attempt))
+
+
+def embed_documents_concurrently(texts: List[str], embeddings,
+                                 on_batch: Optional[Callable[[int, np.ndarray], None]] = None,
+                                 batch_size: int = None) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Embed các chunk theo batch với số lời gọi Bedrock đồng thời có giới hạn (tự giảm khi bị throttle).
+    ``on_batch(start, vectors)`` được gọi trên thread gọi hàm ngay khi mỗi batch xong (có thể
+    không theo thứ tự) để dựng index song song với việc embed. Trả về (vectors theo thứ tự texts, stats).
+    """
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    t0 = time.time()
+    counters = {"throttled": 0}
+    starts = list(range(0, len(texts), batch_size))
+    futures = {
+        _executor.submit(_embed_batch, embeddings, texts[start:start + batch_size], counters): start
+        for start in starts
+    }
+
+    results: Dict[int, np.ndarray] = {}
+    try:
+        for future in as_completed(futures):
+            start = futures[future]
+            vectors = np.asarray(future.result(), dtype=np.float32)
+            results[start] = vectors
+            if on_batch is not None:
+                on_batch(start, vectors)
+    except Exception:
+        for future in futures:
+            future.cancel()
+        with _stats_lock:
+            _stats["failed_runs"] += 1
+        raise
+
+    elapsed = time.time() - t0
+    stats = {
+        "chunks": len(texts),
+        "batches": len(starts),
+        "throttled": counters["throttled"],
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(len(texts) / elapsed, 2) if elapsed > 0 else 0.0,
+        "concurrency": _limiter.limit
+    }
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["chunks"] += stats["chunks"]
+        _stats["batches"] += stats["batches"]
+        _stats["throttled"] += stats["throttled"]
+        _stats["seconds"] += elapsed
+        _stats["last_chunks_per_sec"] = stats["chunks_per_sec"]
+    print(f"[INFO] Embedded {stats['chunks']} chunks in {stats['batches']} batches in {elapsed:.1f}s "
+          f"({stats['chunks_per_sec']} chunks/s, {stats['throttled']} throttled retries, concurrency {stats['concurrency']})")
+
+    if not starts:
+        return np.zeros((0, 0), dtype=np.float32), stats
+    return np.vstack([results[start] for start in starts]), stats
+
+
+def get_embedding_pipeline_stats() -> Dict[str, Any]:
+    """Counters of the ingestion embedding pipeline in this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["chunks_per_sec"] = round(stats["chunks"] / stats["seconds"], 2) if stats["seconds"] else 0.0
+    stats["seconds"] = round(stats["seconds"], 3)
+    stats["concurrency"] = _limiter.limit
+    stats["max_concurrency"] = EMBEDDING_MAX_CONCURRENCY
+    return stats
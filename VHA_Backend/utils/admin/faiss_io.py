@@ -0,0 +1,64 @@
+import os
+import pickle
+from typing import Optional
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from .upload_s3_utils import DATA_DIR
+
+try:
+    from config.performance import FAISS_LOAD_MODE
+except ImportError:
+    FAISS_LOAD_MODE = "mmap"
+
+
+def _mmap_flags() -> Optional[int]:
+    # IO_FLAG_MMAP_IFC maps flat codes in place (zero-copy), so every worker on the host shares
+    # the same page-cache pages; older faiss builds only have IO_FLAG_MMAP (inverted lists only)
+    for name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+        flag = getattr(faiss, name, None)
+        if flag is not None:
+            return flag | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+    return None
+
+
+def read_faiss_index(path: str, mode: str = None):
+    """
+    Đọc file .faiss theo ``mode``: "mmap" (page theo nhu cầu, chia sẻ giữa các process)
+    hoặc "memory" (đọc toàn bộ vào RAM như FAISS.load_local). Index mmap là read-only.
+    """
+    mode = mode or FAISS_LOAD_MODE
+    if mode == "mmap":
+        flags = _mmap_flags()
+        if flags is not None:
+            try:
+                return faiss.read_index(path, flags)
+            except Exception as e:
+                print(f"[WARNING] mmap load failed for {path}, reading into memory: {e}")
+    return faiss.read_index(path)
+
+
+def load_faiss_store(index_name: str, embeddings, folder_path: str = DATA_DIR, mode: str = None) -> FAISS:
+    """Tương đương FAISS.load_local nhưng đọc index qua read_faiss_index"""
+    if (mode or FAISS_LOAD_MODE) != "mmap":
+        return FAISS.load_local(
+            index_name=index_name,
+            folder_path=folder_path,
+            embeddings=embeddings,
+            allow_dangerous_deserialization=True
+        )
+
+    index = read_faiss_index(os.path.join(folder_path, f"{index_name}.faiss"), mode)
+    with open(os.path.join(folder_path, f"{index_name}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def replace_index_files(tmp_name: str, index_name: str, folder_path: str = DATA_DIR, extensions=(".faiss", ".pkl")):
+    """
+    Đổi tên file tạm thành file index bằng os.replace: process nào đang mmap bản cũ vẫn
+    giữ inode cũ, không bị ghi đè giữa chừng (tránh SIGBUS).
+    """
+    for ext in extensions:
+        os.replace(os.path.join(folder_path, f"{tmp_name}{ext}"), os.path.join(folder_path, f"{index_name}{ext}"))
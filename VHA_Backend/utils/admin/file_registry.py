@@ -0,0 +1,211 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from config.database import db
+from models.models_db import FileRegistryEntry, FileRegistryVersion, FileRouting
+
+REGISTRY_VERSION_ROW_ID = 1
+
+# Index file kind -> registry column holding its sha256
+HASH_COLUMNS = {
+    "faiss": "faiss_sha256",
+    "pkl": "pkl_sha256",
+    "chunks.bin": "chunks_bin_sha256",
+    "chunks.idx": "chunks_idx_sha256",
+}
+
+
+def _bump_registry_version():
+    """Tăng version trong cùng transaction với thay đổi registry (UPDATE ... SET version = version + 1)"""
+    result = db.session.execute(
+        update(FileRegistryVersion)
+        .where(FileRegistryVersion.id == REGISTRY_VERSION_ROW_ID)
+        .values(version=FileRegistryVersion.version + 1, updated_at=datetime.now())
+    )
+    if result.rowcount == 0:
+        db.session.add(FileRegistryVersion(id=REGISTRY_VERSION_ROW_ID, version=1))
+
+
+def get_registry_version() -> int:
+    """Version hiện tại của registry; cache có thể dùng làm key"""
+    row = db.session.get(FileRegistryVersion, REGISTRY_VERSION_ROW_ID)
+    return int(row.version) if row else 0
+
+
+def add_registry_entry(unique_filename: str, original_filename: str, timestamp: int, request_id: str,
+                       content_hashes: Optional[Dict[str, str]] = None,
+                       storage_format: str = "pickle") -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Insert một dòng registry (kèm sha256 của .faiss/.pkl/chunk store nếu có); trả về (entry, error)"""
+    content_hashes = content_hashes or {}
+    entry = FileRegistryEntry(
+        unique_filename=unique_filename,
+        original_filename=original_filename,
+        request_id=request_id,
+        timestamp=timestamp,
+        upload_date=datetime.fromtimestamp(timestamp),
+        faiss_key=f"faiss_indexes/{unique_filename}.faiss",
+        pkl_key=f"faiss_indexes/{unique_filename}.pkl",
+        storage_format=storage_format,
+        **{column: content_hashes.get(kind) for kind, column in HASH_COLUMNS.items()}
+    )
+    for attempt in range(2):
+        try:
+            db.session.merge(entry)
+            _bump_registry_version()
+            db.session.commit()
+            return entry.to_dict(), None
+        except IntegrityError:
+            # Another worker created the version row first; retry the increment once
+            db.session.rollback()
+            if attempt:
+                return None, "Registry version conflict"
+        except Exception as e:
+            db.session.rollback()
+            return None, f"Error writing registry: {str(e)}"
+    return None, "Registry version conflict"
+
+
+def set_registry_storage_format(unique_filename: str, storage_format: str,
+                                content_hashes: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """Đổi định dạng lưu trữ (pickle/chunks) của một file; trả về error nếu có"""
+    try:
+        entry = db.session.get(FileRegistryEntry, unique_filename)
+        if entry is None:
+            return f"File {unique_filename} not found in registry"
+        entry.storage_format = storage_format
+        for kind, column in HASH_COLUMNS.items():
+            if content_hashes and kind in content_hashes:
+                setattr(entry, column, content_hashes[kind])
+        _bump_registry_version()
+        db.session.commit()
+        return None
+    except Exception as e:
+        db.session.rollback()
+        return f"Error updating registry: {str(e)}"
+
+
+def find_registry_entries(identifiers: Iterable[str]) -> List[FileRegistryEntry]:
+    """Tra cứu theo unique_filename / original_filename / request_id (đều có index)"""
+    names = [name for name in set(identifiers) if name]
+    if not names:
+        return []
+    return FileRegistryEntry.query.filter(or_(
+        FileRegistryEntry.unique_filename.in_(names),
+        FileRegistryEntry.original_filename.in_(names),
+        FileRegistryEntry.request_id.in_(names)
+    )).all()
+
+
+def remove_registry_entries(unique_filenames: Iterable[str]) -> Tuple[List[str], Optional[str]]:
+    """Xóa các dòng theo unique_filename (primary key); trả về (đã xóa, error)"""
+    names = [name for name in set(unique_filenames) if name]
+    if not names:
+        return [], None
+    try:
+        removed = FileRegistryEntry.query.filter(
+            FileRegistryEntry.unique_filename.in_(names)
+        ).delete(synchronize_session=False)
+        FileRouting.query.filter(FileRouting.unique_filename.in_(names)).delete(synchronize_session=False)
+        if removed:
+            _bump_registry_version()
+        db.session.commit()
+        return (names if removed else []), None
+    except Exception as e:
+        db.session.rollback()
+        return [], f"Error updating registry: {str(e)}"
+
+
+def set_file_routing(unique_filename: str, routing: Dict[str, Any], summary: Optional[np.ndarray] = None) -> Optional[str]:
+    """Lưu metadata định tuyến (handbook_type, topics, summary vectors) của một file; trả về error nếu có"""
+    try:
+        row = FileRouting(
+            unique_filename=unique_filename,
+            handbook_type=routing.get("handbook_type"),
+            topics=json.dumps(routing.get("topics", {}), ensure_ascii=False),
+            chunk_count=int(routing.get("chunk_count", 0))
+        )
+        if summary is not None and len(summary):
+            row.summary_vectors = np.asarray(summary, dtype=np.float32).tobytes()
+            row.summary_dim = int(summary.shape[1])
+        db.session.merge(row)
+        # Routing is part of the registry views, so readers reload it on the next version check
+        _bump_registry_version()
+        db.session.commit()
+        return None
+    except Exception as e:
+        db.session.rollback()
+        return f"Error updating file routing: {str(e)}"
+
+
+def import_registry_entries(files: Iterable[Dict[str, Any]]) -> Tuple[int, Optional[str]]:
+    """Import các entry của registry JSON cũ (bỏ qua entry đã có) và tăng version; trả về (số entry, error)"""
+    try:
+        existing = {row.unique_filename for row in FileRegistryEntry.query.with_entities(FileRegistryEntry.unique_filename)}
+        imported = 0
+        for entry in files:
+            unique_filename = entry.get("unique_filename")
+            if not unique_filename or unique_filename in existing:
+                continue
+            timestamp = int(float(entry.get("timestamp", 0)))
+            db.session.add(FileRegistryEntry(
+                unique_filename=unique_filename,
+                original_filename=entry.get("original_filename", unique_filename),
+                request_id=entry.get("request_id", unique_filename),
+                timestamp=timestamp,
+                upload_date=datetime.fromtimestamp(timestamp),
+                faiss_key=entry.get("faiss_key", f"faiss_indexes/{unique_filename}.faiss"),
+                pkl_key=entry.get("pkl_key", f"faiss_indexes/{unique_filename}.pkl"),
+                storage_format=entry.get("storage_format") or "pickle",
+                **{column: entry.get(column) for column in HASH_COLUMNS.values()}
+            ))
+            existing.add(unique_filename)
+            imported += 1
+
+        if imported or db.session.get(FileRegistryVersion, REGISTRY_VERSION_ROW_ID) is None:
+            _bump_registry_version()
+        db.session.commit()
+        return imported, None
+    except IntegrityError:
+        # Another worker imported the same entries concurrently
+        db.session.rollback()
+        return 0, "Registry import conflict"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Error importing registry: {str(e)}"
+
+
+def list_registry_entries() -> List[Dict[str, Any]]:
+    """Toàn bộ registry theo thứ tự upload, giống thứ tự append của file JSON cũ"""
+    entries = FileRegistryEntry.query.order_by(FileRegistryEntry.timestamp.asc()).all()
+    routing = {row.unique_filename: row.to_dict() for row in FileRouting.query.all()}
+    files = []
+    for entry in entries:
+        file_info = entry.to_dict()
+        if entry.unique_filename in routing:
+            file_info["routing"] = routing[entry.unique_filename]
+        files.append(file_info)
+    return files
+
+
+def load_file_summaries() -> Dict[str, np.ndarray]:
+    """unique_filename -> summary vectors (n, dim) của các file đã có"""
+    rows = FileRouting.query.filter(FileRouting.summary_vectors.isnot(None)).all()
+    return {
+        row.unique_filename: np.frombuffer(row.summary_vectors, dtype=np.float32).reshape(-1, row.summary_dim)
+        for row in rows if row.summary_dim
+    }
+
+
+def load_registry_snapshot() -> Tuple[int, Dict[str, Any]]:
+    """
+    (version, registry). Version được đọc trước danh sách file, nên nếu có thay đổi
+    xen giữa thì lần kiểm tra version kế tiếp sẽ tự tải lại.
+    """
+    version = get_registry_version()
+    files = list_registry_entries()
+    return version, {"files": files, "version": version, "summaries": load_file_summaries()}
@@ -0,0 +1,158 @@
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List
+
+import faiss
+import numpy as np
+
+from .lexical_index import fold_diacritics
+
+try:
+    from config.performance import ROUTING_MIN_TOPIC_SHARE, FILE_SUMMARY_VECTORS
+except ImportError:
+    ROUTING_MIN_TOPIC_SHARE = 0.05
+    FILE_SUMMARY_VECTORS = 4
+
+# k-means needs a few points per centroid to be meaningful; smaller files keep only the mean
+SUMMARY_MIN_POINTS_PER_CENTROID = 8
+
+# Chủ đề định tuyến -> từ khóa (khớp không dấu, cả ở câu hỏi lẫn nội dung chunk)
+ROUTING_TOPICS = {
+    "bao_hiem": ["bảo hiểm", "bhxh", "bhyt", "bhtn", "insurance", "ốm đau", "thai sản", "tai nạn lao động"],
+    "luong_thuong": ["lương", "thưởng", "phụ cấp", "trợ cấp", "phúc lợi", "salary", "bonus", "payroll", "tháng 13"],
+    "nghi_phep": ["nghỉ phép", "nghỉ lễ", "ngày nghỉ", "nghỉ ốm", "leave", "holiday", "e-leave", "thời gian làm việc",
+                  "làm thêm giờ", "tăng ca", "overtime", "ot", "làm việc từ xa", "remote", "wfh"],
+    "tuyen_dung": ["tuyển dụng", "thử việc", "đào tạo", "e-learning", "elearning", "onboarding", "recruitment", "training"],
+    "danh_gia": ["đánh giá", "kpi", "kỷ luật", "nghỉ việc", "thôi việc", "chấm dứt hợp đồng", "performance", "resign"],
+}
+
+# handbook_type do advanced_semantic_split gán theo tên file
+HANDBOOK_TYPE_TOPICS = {
+    "CHÍNH SÁCH VỀ LƯƠNG, PHÚC LỢI VÀ THƯỞNG": "luong_thuong",
+    "CHÍNH SÁCH NGHỈ VÀ THỜI GIAN LÀM VIỆC": "nghi_phep",
+    "CHÍNH SÁCH BẢO HIỂM & PHÚC LỢI XÃ HỘI": "bao_hiem",
+    "TUYỂN DỤNG, THỬ VIỆC VÀ ĐÀO TẠO": "tuyen_dung",
+    "ĐÁNH GIÁ, KỶ LUẬT VÀ NGHỈ VIỆC": "danh_gia",
+}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _normalize(text: str) -> str:
+    # Pad with spaces so keywords only match whole words ("ot" must not match "một" or "ot?")
+    return f" {' '.join(_WORD_RE.findall(fold_diacritics((text or '').lower())))} "
+
+
+_FOLDED_TOPICS = {
+    topic: [_normalize(keyword) for keyword in keywords]
+    for topic, keywords in ROUTING_TOPICS.items()
+}
+
+
+def _text_topics(text: str) -> List[str]:
+    normalized = _normalize(text)
+    return [topic for topic, keywords in _FOLDED_TOPICS.items() if any(keyword in normalized for keyword in keywords)]
+
+
+def question_topics(question: str) -> List[str]:
+    """Các chủ đề định tuyến mà câu hỏi nhắc tới"""
+    return _text_topics(question)
+
+
+def compute_file_routing(documents: Iterable) -> Dict[str, Any]:
+    """
+    Metadata định tuyến của một file từ các chunk lúc ingest: handbook_type phổ biến nhất và
+    tỉ lệ chunk nhắc tới mỗi chủ đề (chủ đề dưới ROUTING_MIN_TOPIC_SHARE bị bỏ). Chủ đề suy ra
+    từ handbook_type luôn có trọng số 1.0.
+    """
+    handbook_types = Counter()
+    topic_chunks = Counter()
+    chunk_count = 0
+    for doc in documents:
+        chunk_count += 1
+        handbook_type = doc.metadata.get("handbook_type")
+        if handbook_type:
+            handbook_types[handbook_type] += 1
+        topic_chunks.update(_text_topics(f"{doc.metadata.get('section', '')} {doc.page_content}"))
+
+    topics = {
+        topic: round(count / chunk_count, 4)
+        for topic, count in topic_chunks.items()
+        if chunk_count and count / chunk_count >= ROUTING_MIN_TOPIC_SHARE
+    }
+    handbook_type = handbook_types.most_common(1)[0][0] if handbook_types else None
+    if handbook_type in HANDBOOK_TYPE_TOPICS:
+        topics[HANDBOOK_TYPE_TOPICS[handbook_type]] = 1.0
+    return {"handbook_type": handbook_type, "topics": topics, "chunk_count": chunk_count}
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def compute_file_summary(vectors: np.ndarray, count: int = FILE_SUMMARY_VECTORS) -> np.ndarray:
+    """Vector tóm tắt của một file: vector trung bình + tối đa ``count`` centroid k-means (đã chuẩn hóa)"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return np.zeros((0, vectors.shape[1] if vectors.ndim == 2 else 0), dtype=np.float32)
+    normalized = _normalize_rows(vectors)
+    summary = [normalized.mean(axis=0, keepdims=True)]
+    clusters = min(count, len(normalized) // SUMMARY_MIN_POINTS_PER_CENTROID)
+    if clusters >= 2:
+        kmeans = faiss.Kmeans(normalized.shape[1], clusters, niter=20, seed=1234, verbose=False,
+                              min_points_per_centroid=SUMMARY_MIN_POINTS_PER_CENTROID)
+        kmeans.train(normalized)
+        summary.append(kmeans.centroids)
+    return np.ascontiguousarray(_normalize_rows(np.vstack(summary)), dtype=np.float32)
+
+
+def build_summary_matrix(summaries: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """
+    Gộp summary vectors của mọi file thành một ma trận (dòng của cùng một file liền nhau) để chấm
+    điểm tất cả file bằng một phép nhân ma trận. Bỏ các file khác số chiều với đa số.
+    """
+    if not summaries:
+        return {"summary_matrix": None, "summary_files": [], "summary_offsets": None}
+    dims = Counter(vectors.shape[1] for vectors in summaries.values())
+    dim = dims.most_common(1)[0][0]
+    names = [name for name, vectors in summaries.items() if vectors.shape[1] == dim and len(vectors)]
+    if not names:
+        return {"summary_matrix": None, "summary_files": [], "summary_offsets": None}
+    offsets = np.cumsum([0] + [len(summaries[name]) for name in names[:-1]])
+    return {
+        "summary_matrix": np.ascontiguousarray(np.vstack([summaries[name] for name in names]), dtype=np.float32),
+        "summary_files": names,
+        "summary_offsets": offsets
+    }
+
+
+def score_files(summary_views: Dict[str, Any], query_embedding) -> Dict[str, float]:
+    """unique_filename -> cosine cao nhất giữa câu hỏi và các summary vector của file"""
+    matrix = summary_views.get("summary_matrix")
+    if matrix is None:
+        return {}
+    query = np.asarray(query_embedding, dtype=np.float32)
+    if query.shape[0] != matrix.shape[1]:
+        return {}
+    query = query / (np.linalg.norm(query) or 1.0)
+    row_scores = matrix @ query
+    file_scores = np.maximum.reduceat(row_scores, summary_views["summary_offsets"])
+    return dict(zip(summary_views["summary_files"], file_scores.tolist()))
+
+
+def build_topic_files(files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """topic -> các file có chủ đề đó (trọng số giảm dần, mới trước), và các file chưa có metadata định tuyến"""
+    topic_files: Dict[str, List[Dict[str, Any]]] = {topic: [] for topic in ROUTING_TOPICS}
+    unrouted = []
+    for file_info in files:
+        routing = file_info.get("routing")
+        if not routing:
+            unrouted.append(file_info)
+            continue
+        for topic in routing.get("topics", {}):
+            topic_files.setdefault(topic, []).append(file_info)
+    for topic, routed in topic_files.items():
+        routed.sort(key=lambda f: (f["routing"]["topics"][topic], f.get("timestamp", 0)), reverse=True)
+    unrouted.sort(key=lambda f: f.get("timestamp", 0), reverse=True)
+    return {"topic_files": topic_files, "unrouted_files": unrouted}
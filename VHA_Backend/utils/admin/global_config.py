@@ -114,6 +114,10 @@ def initialize_default_global_configs():
             "max_tokens_per_day": 10000,
             "max_conversations_per_user": 50,
             "session_timeout_minutes": 30
+        },
+        "index_settings": {
+            "nprobe": 16,
+            "ef_search": 64
         }
     }
     
@@ -0,0 +1,356 @@
+import math
+import time
+import uuid
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from utils.embedding_cache import chunk_text_hash
+
+try:
+    from config.performance import (
+        INDEX_FLAT_MAX_VECTORS, INDEX_HNSW_MAX_VECTORS, INDEX_HNSW_M, INDEX_HNSW_EF_CONSTRUCTION,
+        INDEX_DEFAULT_NPROBE, INDEX_DEFAULT_EF_SEARCH, INDEX_SETTINGS_TTL,
+        INDEX_COMPRESSION, INDEX_PQ_MIN_VECTORS, INDEX_PQ_BYTES_PER_VECTOR
+    )
+except ImportError:
+    INDEX_FLAT_MAX_VECTORS = 20000
+    INDEX_HNSW_MAX_VECTORS = 500000
+    INDEX_HNSW_M = 32
+    INDEX_HNSW_EF_CONSTRUCTION = 200
+    INDEX_DEFAULT_NPROBE = 16
+    INDEX_DEFAULT_EF_SEARCH = 64
+    INDEX_SETTINGS_TTL = 30
+    INDEX_COMPRESSION = "none"
+    INDEX_PQ_MIN_VECTORS = 10000
+    INDEX_PQ_BYTES_PER_VECTOR = 64
+
+COMPRESSIONS = ("none", "fp16", "sq8", "pq")
+SQ8_MIN_VECTORS = 256
+
+DEFAULT_INDEX_SETTINGS = {"nprobe": INDEX_DEFAULT_NPROBE, "ef_search": INDEX_DEFAULT_EF_SEARCH}
+
+_settings_lock = threading.Lock()
+_direct_map_lock = threading.Lock()
+_settings_cache = {"value": None, "loaded_at": 0.0}
+
+
+def ivf_nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid as faiss recommends
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def pq_subquantizers(dim: int, max_bytes: int = None) -> int:
+    # PQ needs m | dim; take the largest divisor within the per-vector byte budget (8-bit codes)
+    max_bytes = max_bytes or INDEX_PQ_BYTES_PER_VECTOR
+    return max(m for m in range(1, min(max_bytes, dim) + 1) if dim % m == 0)
+
+
+def vector_encoding(n: int, dim: int = None, compression: str = None) -> str:
+    """
+    Phần mã hóa vector trong factory string: "Flat" (float32), "SQfp16", "SQ8" hoặc "PQ<m>".
+    PQ cần đủ vector để train nên index nhỏ hơn INDEX_PQ_MIN_VECTORS dùng SQ8 thay thế.
+    Mã hóa SQ/PQ làm vector bị xấp xỉ: reconstruct (corpus index) trả về vector đã lượng tử hóa.
+    """
+    compression = (compression or INDEX_COMPRESSION or "none").lower()
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown index compression '{compression}', expected one of {COMPRESSIONS}")
+    if compression == "fp16":
+        return "SQfp16"
+    if compression == "pq" and dim and n >= INDEX_PQ_MIN_VECTORS:
+        return f"PQ{pq_subquantizers(dim)}"
+    if compression in ("sq8", "pq"):
+        # SQ8 learns per-dimension min/max; too few vectors give degenerate ranges, so keep fp16
+        return "SQ8" if n >= SQ8_MIN_VECTORS else "SQfp16"
+    return "Flat"
+
+
+def choose_index_factory(n: int, mutable: bool = False, dim: int = None, compression: str = None) -> str:
+    """
+    Chọn loại index theo số vector: Flat (exact) cho index nhỏ, HNSW cho index vừa,
+    IVF cho index lớn. ``mutable`` (xóa thường xuyên, ví dụ corpus index) loại trừ HNSW vì
+    xóa khỏi index không phẳng phải dựng lại index (xem delete_from_store) và dựng lại đồ thị
+    HNSW chậm hơn nhiều so với add lại vào IVF đã train. ``compression`` (mặc định
+    INDEX_COMPRESSION) chọn cách lưu vector, xem vector_encoding.
+    """
+    encoding = vector_encoding(n, dim, compression)
+    if n <= INDEX_FLAT_MAX_VECTORS:
+        return encoding
+    if n <= INDEX_HNSW_MAX_VECTORS and not mutable:
+        return f"HNSW{INDEX_HNSW_M},{encoding}"
+    return f"IVF{ivf_nlist(n)},{encoding}"
+
+
+def _new_index(dim: int, factory: str):
+    index = faiss.index_factory(dim, factory)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = INDEX_HNSW_EF_CONSTRUCTION
+    return index
+
+
+def _trained_index(vectors: np.ndarray, factory: str):
+    index = _new_index(vectors.shape[1], factory)
+    if not index.is_trained:
+        index.train(vectors)
+    return index
+
+
+class _OrderedIndexFeeder:
+    """Add vectors to an index in vector-id order, buffering positions that arrive early"""
+
+    def __init__(self, index):
+        self.index = index
+        self.next_position = 0
+        self.pending: Dict[int, np.ndarray] = {}
+
+    def __call__(self, positions: Iterable[int], vectors: np.ndarray):
+        for position, vector in zip(positions, vectors):
+            self.pending[position] = vector
+        run = []
+        while self.next_position in self.pending:
+            run.append(self.pending.pop(self.next_position))
+            self.next_position += 1
+        if run:
+            self.index.add(np.ascontiguousarray(np.vstack(run), dtype=np.float32))
+
+
+def _store_from_index(index, texts: List[str], embeddings, metadatas: List[Dict[str, Any]] = None,
+                      ids: List[str] = None) -> FAISS:
+    # Same docstore layout as FAISS.add_embeddings: uuid ids, vector id -> docstore id
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    metadatas = metadatas or [{} for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata or {})
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
+
+def delete_from_store(store: FAISS, doc_ids: Iterable[str]) -> FAISS:
+    """
+    Xóa chunk khỏi store, trả về store (có thể là object mới). FAISS.delete đánh lại vector id
+    thành 0..n-1 sau remove_ids, chỉ đúng với index phẳng (Flat/SQ/PQ dồn id khi xóa). IVF giữ
+    nguyên id cũ và HNSW không xóa được, nên các index đó được dựng lại từ vector còn lại
+    (không gọi Bedrock), giữ loại index và phần đã train.
+    """
+    doomed = set(doc_ids)
+    if not doomed:
+        return store
+    if isinstance(store.index, faiss.IndexFlatCodes):
+        store.delete(list(doomed))
+        return store
+
+    keep = [(position, doc_id) for position, doc_id in sorted(store.index_to_docstore_id.items()) if doc_id not in doomed]
+    vectors = reconstruct_vectors(store.index, [position for position, _ in keep])
+    index = faiss.clone_index(store.index)
+    index.reset()
+    if keep:
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    docstore = InMemoryDocstore({doc_id: store.docstore.search(doc_id) for _, doc_id in keep})
+    return FAISS(store.embedding_function, index, docstore, {position: doc_id for position, (_, doc_id) in enumerate(keep)},
+                 normalize_L2=getattr(store, "_normalize_L2", False), distance_strategy=store.distance_strategy)
+
+
+def build_faiss_index(vectors: np.ndarray, factory: str = None, mutable: bool = False, compression: str = None):
+    """Tạo index (train nếu cần) và add toàn bộ vectors"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = _trained_index(vectors, factory or choose_index_factory(len(vectors), mutable, vectors.shape[1], compression))
+    index.add(vectors)
+    return index
+
+
+def embed_chunks(texts: List[str], embeddings, on_vectors: Callable[[List[str], np.ndarray], None] = None,
+                 reuse_embeddings: bool = True, hashes: List[str] = None):
+    """
+    Embed các chunk cho ingestion: chunk đã có vector trong chunk embedding store (cùng text
+    đã chuẩn hóa và model id) được dùng lại, mỗi text còn thiếu được embed một lần qua
+    embedding_pipeline. ``on_vectors(hashes, vectors)`` nhận vector ngay khi có (vector tái
+    sử dụng trước, sau đó từng batch). Trả về (hash theo texts, {hash: vector}, stats).
+    Cần app context khi ``reuse_embeddings``.
+    """
+    from .embedding_pipeline import embed_documents_concurrently
+
+    hashes = hashes or [chunk_text_hash(text) for text in texts]
+    known: Dict[str, np.ndarray] = {}
+    if reuse_embeddings:
+        from .chunk_embedding_store import embeddings_model_id, lookup_chunk_embeddings, save_chunk_embeddings, record_reuse
+        model_id = embeddings_model_id(embeddings)
+        known = lookup_chunk_embeddings(hashes, model_id)
+    if known and on_vectors is not None:
+        on_vectors(list(known.keys()), np.vstack(list(known.values())))
+
+    missing: Dict[str, str] = {}
+    for text_hash, text in zip(hashes, texts):
+        if text_hash not in known:
+            missing.setdefault(text_hash, text)
+    missing_hashes = list(missing.keys())
+    computed: Dict[str, np.ndarray] = {}
+
+    def on_batch(start: int, vectors: np.ndarray):
+        batch_hashes = missing_hashes[start:start + len(vectors)]
+        computed.update(zip(batch_hashes, vectors))
+        if on_vectors is not None:
+            on_vectors(batch_hashes, vectors)
+
+    stats = {"chunks": 0}
+    if missing:
+        _, stats = embed_documents_concurrently(list(missing.values()), embeddings, on_batch)
+
+    reused = sum(1 for text_hash in hashes if text_hash in known)
+    stats = dict(stats, reused=reused, computed=len(missing))
+    if reuse_embeddings:
+        record_reuse(reused, len(missing))
+        save_chunk_embeddings(computed, model_id)
+    return hashes, {**known, **computed}, stats
+
+
+def build_vector_store(documents: List[Document], embeddings, mutable: bool = False, factory: str = None,
+                       compression: str = None, reuse_embeddings: bool = True) -> FAISS:
+    """
+    Thay cho FAISS.from_documents: embed qua embed_chunks (tái sử dụng vector đã lưu) và add
+    vào index ngay khi từng batch về. Index cần train (IVF/SQ8/PQ) được train sau khi đủ vector.
+    Docstore/index_to_docstore_id giống hệt from_documents nên các chỗ đọc store không đổi.
+    """
+    texts = [doc.page_content for doc in documents]
+    metadatas = [doc.metadata for doc in documents]
+    if not texts:
+        raise ValueError("No documents to index")
+
+    t0 = time.time()
+    hashes = [chunk_text_hash(text) for text in texts]
+    positions_by_hash: Dict[str, List[int]] = {}
+    for position, text_hash in enumerate(hashes):
+        positions_by_hash.setdefault(text_hash, []).append(position)
+
+    state = {"index": None, "feeder": None, "factory": factory}
+
+    def add_vectors(batch_hashes: List[str], vectors: np.ndarray):
+        if state["index"] is None:
+            dim = vectors.shape[1]
+            state["factory"] = state["factory"] or choose_index_factory(len(texts), mutable, dim, compression)
+            state["index"] = _new_index(dim, state["factory"])
+            if state["index"].is_trained:
+                state["feeder"] = _OrderedIndexFeeder(state["index"])
+        if state["feeder"] is not None:
+            positions = [position for text_hash in batch_hashes for position in positions_by_hash[text_hash]]
+            rows = [vector for text_hash, vector in zip(batch_hashes, vectors) for _ in positions_by_hash[text_hash]]
+            state["feeder"](positions, rows)
+
+    _, vectors_by_hash, stats = embed_chunks(texts, embeddings, add_vectors, reuse_embeddings, hashes)
+
+    index = state["index"]
+    if state["feeder"] is None:
+        vectors = np.vstack([vectors_by_hash[text_hash] for text_hash in hashes])
+        index.train(vectors)
+        index.add(vectors)
+
+    store = _store_from_index(index, texts, embeddings, metadatas)
+    store.embedding_stats = stats
+    print(f"[INFO] Built {state['factory']} index with {index.ntotal} vectors in {(time.time() - t0) * 1000:.0f}ms "
+          f"({stats['reused']} embeddings reused, {stats['computed']} computed, "
+          f"{'streamed' if state['feeder'] is not None else 'trained after embedding'})")
+    return store
+
+
+def build_vector_store_from_embeddings(texts: List[str], vectors: np.ndarray, embeddings,
+                                       metadatas: List[Dict[str, Any]] = None, ids: List[str] = None,
+                                       mutable: bool = False, factory: str = None, compression: str = None) -> FAISS:
+    """Dựng FAISS store từ vector đã có (ví dụ vector tái sử dụng từ index khác)"""
+    t0 = time.time()
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    factory = factory or choose_index_factory(len(vectors), mutable, vectors.shape[1], compression)
+    index = _trained_index(vectors, factory)
+
+    store = FAISS(embeddings, index, InMemoryDocstore(), {})
+    store.add_embeddings(list(zip(texts, vectors.tolist())), metadatas=metadatas, ids=ids)
+    print(f"[INFO] Built {factory} index with {index.ntotal} vectors in {(time.time() - t0) * 1000:.0f}ms")
+    return store
+
+
+def _ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except Exception:
+        return None
+
+
+def describe_index(index) -> Dict[str, Any]:
+    """Loại index và tham số chính (cho log/stats)"""
+    info = {"type": type(index).__name__, "ntotal": int(index.ntotal), "dim": int(index.d)}
+    ivf = _ivf(index)
+    if ivf is not None:
+        info["nlist"] = int(ivf.nlist)
+    try:
+        info["bytes_per_vector"] = int(index.sa_code_size())
+    except Exception:
+        pass
+    return info
+
+
+def reconstruct_vectors(index, vector_ids: Optional[List[int]] = None) -> np.ndarray:
+    """Lấy lại vector theo id; IVF cần direct map để reconstruct"""
+    ivf = _ivf(index)
+    if ivf is not None:
+        with _direct_map_lock:
+            if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                ivf.make_direct_map()
+    if vector_ids is None:
+        return index.reconstruct_n(0, index.ntotal)
+    return np.vstack([index.reconstruct(int(vector_id)) for vector_id in vector_ids]) if vector_ids else \
+        np.zeros((0, index.d), dtype=np.float32)
+
+
+def search_params_for(index, settings: Optional[Dict[str, Any]], selector=None):
+    """
+    SearchParameters cho từng lần search (nprobe cho IVF, efSearch cho HNSW, ``selector`` giới hạn
+    các vector id được trả về). Truyền theo từng lời gọi nên an toàn khi nhiều thread cùng search
+    một index. Caller phải giữ tham chiếu tới ``selector`` đến khi search xong.
+    """
+    if not settings and selector is None:
+        return None
+    settings = settings or {}
+    if isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(efSearch=int(settings.get("ef_search", INDEX_DEFAULT_EF_SEARCH)))
+    elif _ivf(index) is not None:
+        params = faiss.SearchParametersIVF(nprobe=int(settings.get("nprobe", INDEX_DEFAULT_NPROBE)))
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def get_index_search_settings() -> Dict[str, Any]:
+    """
+    nprobe/efSearch từ global config "index_settings" (cache INDEX_SETTINGS_TTL giây).
+    Gọi trên thread xử lý request (cần app context), không gọi trong các thread fan-out.
+    """
+    with _settings_lock:
+        if _settings_cache["value"] is not None and time.time() - _settings_cache["loaded_at"] < INDEX_SETTINGS_TTL:
+            return _settings_cache["value"]
+
+    settings = dict(DEFAULT_INDEX_SETTINGS)
+    try:
+        from utils.admin.global_config import get_global_config
+        configured = get_global_config("index_settings")
+        if configured:
+            settings.update(configured)
+    except Exception as e:
+        print(f"[WARNING] Cannot read index_settings, using defaults: {e}")
+
+    with _settings_lock:
+        _settings_cache["value"] = settings
+        _settings_cache["loaded_at"] = time.time()
+    return settings
+
+
+def clear_index_settings_cache():
+    with _settings_lock:
+        _settings_cache["value"] = None
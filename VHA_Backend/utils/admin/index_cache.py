@@ -0,0 +1,341 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import contextlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .upload_s3_utils import DATA_DIR, download_from_s3
+from .corpus_index import CORPUS_INDEX_NAME
+from .file_registry import HASH_COLUMNS
+
+try:
+    from config.performance import INDEX_CACHE_MAX_BYTES, INDEX_WARMUP_COUNT, INDEX_PREFETCH_COUNT, INDEX_WARMUP_STRATEGY
+except ImportError:
+    INDEX_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    INDEX_WARMUP_COUNT = 5
+    INDEX_PREFETCH_COUNT = 20
+    INDEX_WARMUP_STRATEGY = "recent"
+
+# File kinds of one index: kind "x" is stored as "<unique_filename>.x"
+PICKLE_KINDS = ("faiss", "pkl")
+CHUNK_STORE_KINDS = ("faiss", "chunks.bin", "chunks.idx")
+ALL_KINDS = ("faiss", "pkl", "chunks.bin", "chunks.idx", "bm25")
+# Optional sidecar: indexes uploaded before hybrid retrieval have no .bm25 on S3
+LEXICAL_KINDS = ("bm25",)
+HASH_SUFFIX = ".sha256"
+
+_cache_lock = threading.Lock()
+_fetch_locks: Dict[str, threading.Lock] = {}
+# unique_filename -> number of fetches/loads in progress; never evicted while pinned
+_pinned: Dict[str, int] = {}
+_cache_stats = {"hits": 0, "downloads": 0, "hash_mismatches": 0, "evictions": 0, "evicted_bytes": 0}
+
+
+def _index_paths(unique_filename: str, kinds: Iterable[str] = ALL_KINDS) -> Dict[str, str]:
+    return {kind: os.path.join(DATA_DIR, f"{unique_filename}.{kind}") for kind in kinds}
+
+
+def _hash_path(unique_filename: str) -> str:
+    return os.path.join(DATA_DIR, f"{unique_filename}{HASH_SUFFIX}")
+
+
+def _fetch_lock(unique_filename: str) -> threading.Lock:
+    with _cache_lock:
+        return _fetch_locks.setdefault(unique_filename, threading.Lock())
+
+
+@contextlib.contextmanager
+def pin_local_index(unique_filename: str):
+    """
+    Giữ bản local của index khỏi bị evict trong process này suốt lúc kiểm tra, tải và nạp.
+    Bọc cả ensure_local_index lẫn lần đọc file sau đó, nếu không index của thread khác có thể bị
+    xóa giữa lúc kiểm tra xong và lúc load.
+    """
+    with _cache_lock:
+        _pinned[unique_filename] = _pinned.get(unique_filename, 0) + 1
+    try:
+        yield
+    finally:
+        with _cache_lock:
+            _pinned[unique_filename] -= 1
+            if not _pinned[unique_filename]:
+                del _pinned[unique_filename]
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_index_hashes(unique_filename: str, kinds: Iterable[str] = ALL_KINDS) -> Dict[str, str]:
+    """sha256 của các file index (.faiss, .pkl, chunk store) đang có trong thư mục cache"""
+    return {
+        kind: _sha256_file(path)
+        for kind, path in _index_paths(unique_filename, kinds).items()
+        if os.path.exists(path)
+    }
+
+
+def _read_hash_record(unique_filename: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_hash_path(unique_filename), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_hash_record(unique_filename: str, hashes: Dict[str, str]):
+    # Merge with the existing record: a store may be fetched in one format and later in another
+    record = _read_hash_record(unique_filename) or {}
+    record.update(hashes)
+    for kind, path in _index_paths(unique_filename, hashes.keys()).items():
+        record[f"{kind}_size"] = os.path.getsize(path)
+    tmp_path = f"{_hash_path(unique_filename)}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, _hash_path(unique_filename))
+
+
+def _touch(unique_filename: str):
+    # The hash record's mtime doubles as the last-used time, shared by every worker on this host
+    try:
+        os.utime(_hash_path(unique_filename), None)
+    except OSError:
+        pass
+
+
+def _is_valid_local_copy(unique_filename: str, expected: Optional[Dict[str, str]], kinds: Iterable[str]) -> bool:
+    """
+    Kiểm tra bản local mà không phải hash lại: so sánh hash đã ghi lúc tải về với registry
+    và kích thước file với lúc ghi (phát hiện file bị ghi dở/cắt cụt).
+    """
+    paths = _index_paths(unique_filename, kinds)
+    if not all(os.path.exists(path) for path in paths.values()):
+        return False
+
+    record = _read_hash_record(unique_filename) or {}
+    unrecorded = [kind for kind in paths if kind not in record]
+    if unrecorded:
+        # Copy written before the cache existed: hash it once, then treat it like a download
+        try:
+            _write_hash_record(unique_filename, compute_index_hashes(unique_filename, unrecorded))
+            record = _read_hash_record(unique_filename) or {}
+        except OSError:
+            return False
+
+    for kind, path in paths.items():
+        try:
+            if os.path.getsize(path) != record.get(f"{kind}_size"):
+                return False
+        except OSError:
+            return False
+        if expected and expected.get(kind) and record.get(kind) != expected[kind]:
+            return False
+    return True
+
+
+def remove_local_index(*unique_filenames: str, kinds: Iterable[str] = None):
+    """Xóa bản local của các index (mặc định mọi file kèm bản ghi .sha256)"""
+    for name in set(unique_filenames):
+        if not name:
+            continue
+        paths = list(_index_paths(name, kinds).values()) if kinds else list(_index_paths(name).values()) + [_hash_path(name)]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARNING] Failed to remove cached index file {path}: {e}")
+
+
+def record_local_index(unique_filename: str) -> Dict[str, str]:
+    """Ghi hash cho index vừa tạo tại local; trả về hash để lưu vào registry"""
+    hashes = compute_index_hashes(unique_filename)
+    _write_hash_record(unique_filename, hashes)
+    enforce_index_cache_quota(protect=[unique_filename])
+    return hashes
+
+
+def ensure_local_index(unique_filename: str, expected_hashes: Optional[Dict[str, str]] = None,
+                       kinds: Iterable[str] = PICKLE_KINDS) -> bool:
+    """
+    Đảm bảo các file ``kinds`` của index có trong thư mục cache local và khớp hash của registry.
+    Tải lại từ S3 nếu thiếu hoặc không khớp; trả về False nếu không lấy được bản hợp lệ.
+    """
+    with pin_local_index(unique_filename):
+        return _ensure_local_index(unique_filename, expected_hashes, tuple(kinds))
+
+
+def _ensure_local_index(unique_filename: str, expected_hashes: Optional[Dict[str, str]], kinds: Tuple[str, ...]) -> bool:
+    with _fetch_lock(unique_filename):
+        if _is_valid_local_copy(unique_filename, expected_hashes, kinds):
+            _touch(unique_filename)
+            with _cache_lock:
+                _cache_stats["hits"] += 1
+            return True
+
+        # The BM25 sidecar has no registry hash: drop it with the index so it is fetched again too
+        remove_local_index(unique_filename, kinds=kinds + (LEXICAL_KINDS if "faiss" in kinds else ()))
+        t0 = time.time()
+        if not download_from_s3(unique_filename, extensions=[f".{kind}" for kind in kinds]):
+            remove_local_index(unique_filename, kinds=kinds)
+            return False
+
+        try:
+            hashes = compute_index_hashes(unique_filename, kinds)
+        except OSError as e:
+            print(f"[ERROR] Downloaded index {unique_filename} is unreadable: {e}")
+            remove_local_index(unique_filename, kinds=kinds)
+            return False
+
+        mismatched = [
+            kind for kind, digest in hashes.items()
+            if expected_hashes and expected_hashes.get(kind) and expected_hashes[kind] != digest
+        ]
+        if mismatched:
+            with _cache_lock:
+                _cache_stats["hash_mismatches"] += 1
+            print(f"[ERROR] Hash mismatch for {unique_filename} ({', '.join(mismatched)}), discarding download")
+            remove_local_index(unique_filename, kinds=kinds)
+            return False
+
+        _write_hash_record(unique_filename, hashes)
+        with _cache_lock:
+            _cache_stats["downloads"] += 1
+        print(f"[INFO] Cached index {unique_filename} from S3 in {(time.time() - t0) * 1000:.0f}ms")
+
+    enforce_index_cache_quota(protect=[unique_filename])
+    return True
+
+
+def _cached_indexes() -> List[Dict[str, Any]]:
+    entries = []
+    try:
+        filenames = os.listdir(DATA_DIR)
+    except OSError:
+        return entries
+
+    for filename in filenames:
+        if not filename.endswith(".faiss"):
+            continue
+        name = filename[:-len(".faiss")]
+        size = 0
+        for path in list(_index_paths(name).values()) + [_hash_path(name)]:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        try:
+            last_used = os.path.getmtime(_hash_path(name))
+        except OSError:
+            last_used = os.path.getmtime(os.path.join(DATA_DIR, filename))
+        entries.append({"unique_filename": name, "bytes": size, "last_used": last_used})
+    return entries
+
+
+def enforce_index_cache_quota(max_bytes: int = INDEX_CACHE_MAX_BYTES, protect: Iterable[str] = ()) -> int:
+    """Xóa các index ít dùng gần đây nhất cho đến khi tổng dung lượng dưới quota"""
+    if not max_bytes or max_bytes <= 0:
+        return 0
+
+    with _cache_lock:
+        protected = set(protect) | set(_pinned) | {CORPUS_INDEX_NAME}
+    entries = _cached_indexes()
+    total = sum(entry["bytes"] for entry in entries)
+    if total <= max_bytes:
+        return 0
+
+    evicted = 0
+    for entry in sorted(entries, key=lambda e: e["last_used"]):
+        if total <= max_bytes:
+            break
+        if entry["unique_filename"] in protected:
+            continue
+        remove_local_index(entry["unique_filename"])
+        total -= entry["bytes"]
+        evicted += 1
+        with _cache_lock:
+            _cache_stats["evictions"] += 1
+            _cache_stats["evicted_bytes"] += entry["bytes"]
+        print(f"[INFO] Evicted index {entry['unique_filename']} from local cache ({entry['bytes']} bytes)")
+    return evicted
+
+
+def get_index_cache_stats() -> Dict[str, Any]:
+    """Counters and disk usage of the local index cache"""
+    entries = _cached_indexes()
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["pinned"] = len(_pinned)
+    stats["entries"] = len(entries)
+    stats["bytes"] = sum(entry["bytes"] for entry in entries)
+    stats["max_bytes"] = INDEX_CACHE_MAX_BYTES
+    return stats
+
+
+def registry_index_kinds(file_info: Dict[str, Any]) -> Tuple[str, ...]:
+    """Files needed to serve a registry entry in its storage format"""
+    return CHUNK_STORE_KINDS if file_info.get("storage_format") == "chunks" else PICKLE_KINDS
+
+
+def registry_index_hashes(file_info: Dict[str, Any]) -> Dict[str, str]:
+    """Expected {kind: sha256} of a registry entry (empty for entries uploaded before hashing)"""
+    return {
+        kind: file_info.get(column)
+        for kind, column in HASH_COLUMNS.items()
+        if file_info.get(column)
+    }
+
+
+def _warmup_candidates(files: List[Dict[str, Any]], strategy: str) -> List[Dict[str, Any]]:
+    by_recency = sorted(files, key=lambda f: f.get("timestamp", 0), reverse=True)
+    if strategy != "used":
+        return by_recency
+
+    # "used": indexes touched most recently on this host first, then the newest uploads
+    last_used = {entry["unique_filename"]: entry["last_used"] for entry in _cached_indexes()}
+    return sorted(by_recency, key=lambda f: last_used.get(f.get("unique_filename"), 0), reverse=True)
+
+
+def _prefetch(files: List[Dict[str, Any]]):
+    t0 = time.time()
+    fetched = sum(
+        1 for f in files
+        if ensure_local_index(f["unique_filename"], registry_index_hashes(f), registry_index_kinds(f))
+    )
+    print(f"[INFO] Prefetched {fetched}/{len(files)} indexes in {time.time() - t0:.1f}s")
+
+
+def warmup_index_cache(warmup_count: int = INDEX_WARMUP_COUNT, prefetch_count: int = INDEX_PREFETCH_COUNT,
+                       strategy: str = INDEX_WARMUP_STRATEGY) -> int:
+    """
+    Khởi động worker: tải và nạp vào bộ nhớ ``warmup_count`` index trước khi nhận request,
+    sau đó prefetch thêm ``prefetch_count`` index xuống đĩa trong background.
+    Cần gọi trong app context (đọc registry từ database).
+    """
+    if warmup_count <= 0 and prefetch_count <= 0:
+        return 0
+
+    from utils.aws_client import bedrock_embeddings
+    from utils.user.vector_store_utils import get_registry_views, load_faiss_index
+
+    t0 = time.time()
+    candidates = _warmup_candidates(get_registry_views()["files"], strategy)
+    warm, rest = candidates[:max(warmup_count, 0)], candidates[max(warmup_count, 0):]
+
+    loaded = 0
+    for file_info in warm:
+        if load_faiss_index(file_info["unique_filename"], bedrock_embeddings) is not None:
+            loaded += 1
+    print(f"[INFO] Index warmup: {loaded}/{len(warm)} indexes ready in {time.time() - t0:.1f}s")
+
+    rest = rest[:max(prefetch_count, 0)]
+    if rest:
+        threading.Thread(target=_prefetch, args=(rest,), name="index-prefetch", daemon=True).start()
+    return loaded
@@ -0,0 +1,165 @@
+import os
+import time
+import uuid
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from .upload_s3_utils import DATA_DIR, BUCKET_NAME, s3_lock, _invalidate_loaded_indexes, _mark_registry_changed
+from .file_registry import find_registry_entries, set_registry_storage_format, set_file_routing
+from .file_routing import compute_file_routing, compute_file_summary
+from .index_cache import ensure_local_index, record_local_index, registry_index_hashes, pin_local_index
+from .index_builder import embed_chunks, reconstruct_vectors, delete_from_store
+from .chunk_store import write_chunk_store, chunk_store_paths, iter_store_documents
+from .lexical_index import write_lexical_index
+from .corpus_index import update_corpus_chunks
+from .faiss_io import replace_index_files
+from utils.aws_client import s3_client
+
+_locks_guard = threading.Lock()
+_write_locks: Dict[str, threading.Lock] = {}
+
+
+def _write_lock(unique_filename: str) -> threading.Lock:
+    with _locks_guard:
+        return _write_locks.setdefault(unique_filename, threading.Lock())
+
+
+def _registry_entry(unique_filename: str) -> Dict[str, Any]:
+    for entry in find_registry_entries([unique_filename]):
+        if entry.unique_filename == unique_filename:
+            return entry.to_dict()
+    raise ValueError(f"File {unique_filename} not found in registry")
+
+
+def _load_for_update(entry: Dict[str, Any], embeddings) -> FAISS:
+    """Bản có thể ghi (đọc toàn bộ vào RAM, không mmap) của index riêng một file"""
+    unique_filename = entry["unique_filename"]
+    with pin_local_index(unique_filename):
+        if not ensure_local_index(unique_filename, registry_index_hashes(entry)):
+            raise ValueError(f"Index of {unique_filename} is not available")
+        return FAISS.load_local(
+            index_name=unique_filename,
+            folder_path=DATA_DIR,
+            embeddings=embeddings,
+            allow_dangerous_deserialization=True
+        )
+
+
+def list_index_chunks(unique_filename: str, embeddings=None) -> List[Dict[str, Any]]:
+    """Các chunk của một index theo thứ tự vector: docstore id, section, trang và đoạn đầu nội dung"""
+    if embeddings is None:
+        from utils.aws_client import bedrock_embeddings
+        embeddings = bedrock_embeddings
+    store = _load_for_update(_registry_entry(unique_filename), embeddings)
+    chunks = []
+    for position in range(store.index.ntotal):
+        doc_id = store.index_to_docstore_id[position]
+        doc = store.docstore.search(doc_id)
+        chunks.append({
+            "id": doc_id,
+            "section": doc.metadata.get("section"),
+            "page_number": doc.metadata.get("page_number"),
+            "preview": doc.page_content[:200]
+        })
+    return chunks
+
+
+def _save_index(store: FAISS, entry: Dict[str, Any]) -> Tuple[Dict[str, str], str]:
+    """Ghi index (qua file tạm + rename), chunk store nếu có, BM25, upload S3; trả về (hashes, storage_format)"""
+    unique_filename = entry["unique_filename"]
+    tmp_name = f"{unique_filename}.update.{os.getpid()}"
+    store.save_local(index_name=tmp_name, folder_path=DATA_DIR)
+    replace_index_files(tmp_name, unique_filename)
+
+    storage_format = entry.get("storage_format") or "pickle"
+    paths = [os.path.join(DATA_DIR, f"{unique_filename}{ext}") for ext in (".faiss", ".pkl")]
+    if storage_format == "chunks":
+        write_chunk_store(unique_filename, store)
+        paths.extend(chunk_store_paths(unique_filename))
+    paths.append(write_lexical_index(unique_filename, (doc.page_content for doc in iter_store_documents(store))))
+
+    with s3_lock:
+        for path in paths:
+            s3_client.upload_file(Filename=path, Bucket=BUCKET_NAME, Key=f"faiss_indexes/{os.path.basename(path)}")
+    return record_local_index(unique_filename), storage_format
+
+
+def update_index(unique_filename: str, add_documents: Optional[List[Document]] = None,
+                 remove_ids: Optional[Iterable[str]] = None, remove_sections: Optional[Iterable[str]] = None,
+                 embeddings=None) -> Dict[str, Any]:
+    """
+    Cập nhật tăng dần index của một file: xóa chunk theo docstore id và/hoặc theo section,
+    rồi thêm ``add_documents`` (chỉ embed các chunk mới, dùng lại vector đã lưu nếu có).
+    Index riêng, chunk store, S3, registry (hash + version) và corpus index được cập nhật
+    trong cùng một thao tác. Thay một section = remove_sections + add_documents.
+    Cần app context.
+    """
+    if embeddings is None:
+        from utils.aws_client import bedrock_embeddings
+        embeddings = bedrock_embeddings
+
+    t0 = time.time()
+    entry = _registry_entry(unique_filename)
+    add_documents = add_documents or []
+    with _write_lock(unique_filename):
+        store = _load_for_update(entry, embeddings)
+
+        requested = set(remove_ids or [])
+        sections = set(remove_sections or [])
+        existing = set(store.index_to_docstore_id.values())
+        doomed = [
+            doc_id for doc_id in store.index_to_docstore_id.values()
+            if doc_id in requested or (sections and store.docstore.search(doc_id).metadata.get("section") in sections)
+        ]
+        missing_ids = sorted(requested - existing)
+        if doomed:
+            store = delete_from_store(store, doomed)
+
+        added_ids: List[str] = []
+        embedding_stats: Dict[str, Any] = {}
+        if add_documents:
+            texts = [doc.page_content for doc in add_documents]
+            metadatas = []
+            for doc in add_documents:
+                metadata = dict(doc.metadata)
+                metadata.setdefault("source_file", entry["original_filename"])
+                metadatas.append(metadata)
+            hashes, vectors_by_hash, embedding_stats = embed_chunks(texts, embeddings)
+            vectors = np.vstack([vectors_by_hash[text_hash] for text_hash in hashes])
+            added_ids = [str(uuid.uuid4()) for _ in texts]
+            store.add_embeddings(list(zip(texts, vectors.tolist())), metadatas=metadatas, ids=added_ids)
+
+        if not doomed and not added_ids:
+            return {"unique_filename": unique_filename, "removed": 0, "added": 0, "added_ids": [],
+                    "missing_ids": missing_ids, "chunks": int(store.index.ntotal),
+                    "elapsed_ms": round((time.time() - t0) * 1000, 1)}
+
+        content_hashes, storage_format = _save_index(store, entry)
+        error = set_registry_storage_format(unique_filename, storage_format, content_hashes)
+        if error:
+            raise RuntimeError(error)
+        update_corpus_chunks(unique_filename, entry["original_filename"], store, added_ids, doomed, embeddings)
+        routing_error = set_file_routing(unique_filename, compute_file_routing(iter_store_documents(store)),
+                                         compute_file_summary(reconstruct_vectors(store.index)))
+        if routing_error:
+            print(f"[WARNING] {routing_error}")
+
+    _invalidate_loaded_indexes(unique_filename)
+    _mark_registry_changed()
+    result = {
+        "unique_filename": unique_filename,
+        "removed": len(doomed),
+        "added": len(added_ids),
+        "added_ids": added_ids,
+        "missing_ids": missing_ids,
+        "chunks": int(store.index.ntotal),
+        "embeddings": embedding_stats,
+        "elapsed_ms": round((time.time() - t0) * 1000, 1)
+    }
+    print(f"[INFO] Updated index {unique_filename}: -{result['removed']} +{result['added']} chunks "
+          f"({result['chunks']} total) in {result['elapsed_ms']:.0f}ms")
+    return result
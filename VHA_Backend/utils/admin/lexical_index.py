@@ -0,0 +1,173 @@
+import io
+import os
+import re
+import json
+import math
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .upload_s3_utils import DATA_DIR
+
+try:
+    from config.performance import LEXICAL_BM25_K1, LEXICAL_BM25_B, LEXICAL_IGNORE_DIACRITICS
+except ImportError:
+    LEXICAL_BM25_K1 = 1.2
+    LEXICAL_BM25_B = 0.75
+    LEXICAL_IGNORE_DIACRITICS = True
+
+LEXICAL_INDEX_EXT = ".bm25"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Viết tắt hay gặp trong câu hỏi HR; mở rộng ở phía query để khớp với văn bản chính sách
+QUERY_EXPANSIONS = {
+    "bhxh": "bảo hiểm xã hội",
+    "bhyt": "bảo hiểm y tế",
+    "bhtn": "bảo hiểm thất nghiệp",
+    "ot": "làm thêm giờ tăng ca overtime",
+    "wfh": "làm việc từ xa remote",
+    "hđlđ": "hợp đồng lao động",
+    "hdld": "hợp đồng lao động",
+    "nv": "nhân viên",
+    "kpi": "đánh giá hiệu suất kpi",
+}
+
+
+def lexical_index_path(unique_filename: str, folder_path: str = DATA_DIR) -> str:
+    return os.path.join(folder_path, f"{unique_filename}{LEXICAL_INDEX_EXT}")
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "phép năm" -> "phep nam", "đ" -> "d" """
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(c for c in decomposed if unicodedata.category(c) != "Mn")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tách theo âm tiết (tiếng Việt viết cách nhau theo âm tiết) và thêm bigram âm tiết
+    ("bảo_hiểm") để từ ghép khớp chặt hơn từng âm tiết riêng lẻ.
+    """
+    syllables = _TOKEN_RE.findall(unicodedata.normalize("NFC", text or "").lower())
+    return syllables + [f"{first}_{second}" for first, second in zip(syllables, syllables[1:])]
+
+
+def tokenize_query(query: str) -> List[str]:
+    syllables = _TOKEN_RE.findall(unicodedata.normalize("NFC", query or "").lower())
+    expanded = " ".join([query or ""] + [QUERY_EXPANSIONS[s] for s in syllables if s in QUERY_EXPANSIONS])
+    return tokenize(expanded)
+
+
+class LexicalIndex:
+    """
+    Inverted index BM25 của một FAISS index, doc id = vector id (cùng thứ tự với chunk store).
+    Postings lưu dạng CSR: ``indptr`` theo term, ``doc_ids``/``tfs`` theo posting.
+    """
+
+    def __init__(self, vocab: List[str], indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray):
+        self.vocab = vocab
+        self.term_ids = {term: term_id for term_id, term in enumerate(vocab)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+        self._folded = None
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "LexicalIndex":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_len = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        vocab = sorted(postings)
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for term_id, term in enumerate(vocab):
+            indptr[term_id + 1] = indptr[term_id] + len(postings[term])
+        doc_ids = np.fromiter((d for term in vocab for d, _ in postings[term]), dtype=np.int32, count=int(indptr[-1]))
+        tfs = np.fromiter((tf for term in vocab for _, tf in postings[term]), dtype=np.float32, count=int(indptr[-1]))
+        return cls(vocab, indptr, doc_ids, tfs, np.asarray(doc_len, dtype=np.float32))
+
+    def save(self, path: str):
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            vocab=np.frombuffer(json.dumps(self.vocab, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+            indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs, doc_len=self.doc_len
+        )
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path) as data:
+            vocab = json.loads(data["vocab"].tobytes().decode("utf-8"))
+            return cls(vocab, data["indptr"], data["doc_ids"], data["tfs"], data["doc_len"])
+
+    def _folded_terms(self) -> Dict[str, List[int]]:
+        # Built lazily: only needed when diacritics are ignored
+        if self._folded is None:
+            folded: Dict[str, List[int]] = {}
+            for term_id, term in enumerate(self.vocab):
+                folded.setdefault(fold_diacritics(term), []).append(term_id)
+            self._folded = folded
+        return self._folded
+
+    def _query_term_ids(self, query: str, ignore_diacritics: bool) -> List[int]:
+        term_ids = set()
+        for token in tokenize_query(query):
+            if ignore_diacritics:
+                term_ids.update(self._folded_terms().get(fold_diacritics(token), ()))
+            elif token in self.term_ids:
+                term_ids.add(self.term_ids[token])
+        return sorted(term_ids)
+
+    def search(self, query: str, k: int, ignore_diacritics: bool = None,
+               allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top-k (vector_id, điểm BM25) cho query; bỏ qua doc có điểm 0 và doc ngoài ``allowed_ids`` (nếu có)"""
+        if ignore_diacritics is None:
+            ignore_diacritics = LEXICAL_IGNORE_DIACRITICS
+        n_docs = len(self)
+        if not n_docs or k <= 0:
+            return []
+
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term_id in self._query_term_ids(query, ignore_diacritics):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            df = end - start
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = LEXICAL_BM25_K1 * (1.0 - LEXICAL_BM25_B + LEXICAL_BM25_B * self.doc_len[docs] / (self.avg_len or 1.0))
+            scores[docs] += idf * tfs * (LEXICAL_BM25_K1 + 1.0) / (tfs + norm)
+
+        candidates = np.flatnonzero(scores > 0)
+        if allowed_ids is not None:
+            candidates = candidates[np.isin(candidates, allowed_ids, assume_unique=True)]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in ranked]
+
+
+def write_lexical_index(unique_filename: str, texts: Iterable[str], folder_path: str = DATA_DIR) -> str:
+    """Dựng và ghi ``<unique_filename>.bm25``; ``texts`` phải theo thứ tự vector id"""
+    path = lexical_index_path(unique_filename, folder_path)
+    LexicalIndex.build(texts).save(path)
+    return path
+
+
+def load_lexical_index(unique_filename: str, folder_path: str = DATA_DIR) -> LexicalIndex:
+    return LexicalIndex.load(lexical_index_path(unique_filename, folder_path))
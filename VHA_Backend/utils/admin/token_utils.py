@@ -1,5 +1,21 @@
+from functools import lru_cache
+
 import tiktoken
 
-def count_tokens(text: str) -> int:
-    enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
+DEFAULT_TOKEN_MODEL = "gpt-3.5-turbo"
+
+
+@lru_cache(maxsize=16)
+def get_encoding(model: str = DEFAULT_TOKEN_MODEL):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Models newer than the installed tiktoken (gpt-4.1 family) use the gpt-4o encoding
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except ValueError:
+            return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str, model: str = None) -> int:
+    enc = get_encoding(model or DEFAULT_TOKEN_MODEL)
     return len(enc.encode(text))
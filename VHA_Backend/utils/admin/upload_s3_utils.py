@@ -8,13 +8,68 @@ import pdfplumber
 import requests
 import io
 from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from utils.aws_client import session, s3_client
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from urllib.parse import urlparse
-from models.models_db import FileDocument
+from models.models_db import FileDocument, FileRegistryEntry
 from config.database import db
+from .file_registry import (
+    add_registry_entry, find_registry_entries, remove_registry_entries, list_registry_entries,
+    get_registry_version, import_registry_entries
+)
 s3_lock = threading.Lock()
 
+try:
+    from config.performance import S3_MULTIPART_THRESHOLD, S3_MULTIPART_CHUNKSIZE, S3_MAX_CONCURRENCY, S3_DOWNLOAD_WORKERS
+except ImportError:
+    S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+    S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+    S3_MAX_CONCURRENCY = 8
+    S3_DOWNLOAD_WORKERS = 8
+
+# Large .faiss files are fetched as parallel ranged GETs; small .pkl/.bm25 parts stay single requests
+_transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    use_threads=True
+)
+_download_executor = ThreadPoolExecutor(max_workers=S3_DOWNLOAD_WORKERS, thread_name_prefix="s3-download")
+_inflight_downloads = {}
+_inflight_lock = threading.Lock()
+_download_stats = {"downloads": 0, "coalesced": 0, "failures": 0, "bytes": 0, "seconds": 0.0}
+
+def _mark_registry_changed():
+    """Make this worker revalidate the registry instead of serving its stale copy"""
+    try:
+        from utils.user.vector_store_utils import clear_registry_cache
+        clear_registry_cache()
+    except Exception as e:
+        print(f"[WARNING] Failed to clear registry cache: {e}")
+
+def _remove_cached_index_files(*unique_filenames):
+    """Drop local index cache entries (including hash records) of deleted files"""
+    try:
+        from .index_cache import remove_local_index
+        remove_local_index(*unique_filenames)
+    except Exception as e:
+        print(f"[WARNING] Failed to clean local index cache: {e}")
+
+def _invalidate_loaded_indexes(*unique_filenames):
+    """Drop in-process cached vector stores for files whose index changed"""
+    try:
+        from utils.user.vector_store_utils import invalidate_vector_store_cache
+        for name in set(unique_filenames):
+            if name:
+                invalidate_vector_store_cache(name)
+    except Exception as e:
+        print(f"[WARNING] Failed to invalidate vector store cache: {e}")
+
+# Every object stored per index on S3: vectors, pickle docstore, chunk store, BM25 sidecar
+INDEX_FILE_EXTENSIONS = (".faiss", ".pkl", ".chunks.bin", ".chunks.idx", ".bm25")
+
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 BUCKET_NAME_2 = os.getenv("BUCKET_NAME_2")
 
@@ -28,20 +83,11 @@ def generate_unique_filename(base_name, timestamp=None):
     unique_id = str(uuid.uuid4())
     return unique_id
 
-def update_file_registry(unique_filename, original_filename, timestamp, request_id):
-    registry_key = "faiss_indexes/file_registry.json"
+def update_file_registry(unique_filename, original_filename, timestamp, request_id, content_hashes=None, storage_format="pickle"):
     try:
         if not all([unique_filename, original_filename, request_id]) or not isinstance(timestamp, (int, float)):
             return None, "Invalid input parameters"
 
-        try:
-            response = s3_client.get_object(Bucket=BUCKET_NAME, Key=registry_key)
-            registry = json.loads(response['Body'].read().decode('utf-8'))
-        except s3_client.exceptions.NoSuchKey:
-            registry = {"files": []}
-        except ClientError as e:
-            return None, f"Error accessing registry: {str(e)}"
-
         if isinstance(timestamp, str) and timestamp.isdigit():
             timestamp = int(timestamp)
         elif not isinstance(timestamp, int):
@@ -50,48 +96,25 @@ def update_file_registry(unique_filename, original_filename, timestamp, request_
             except (ValueError, TypeError):
                 timestamp = int(time.time())
 
-        file_entry = {
-            "unique_filename": unique_filename,
-            "original_filename": original_filename,
-            "request_id": request_id,
-            "timestamp": timestamp,
-            "upload_date": datetime.fromtimestamp(timestamp).isoformat(),
-            "faiss_key": f"faiss_indexes/{unique_filename}.faiss",
-            "pkl_key": f"faiss_indexes/{unique_filename}.pkl"
-        }
-
-        registry["files"].append(file_entry)
-        registry["last_updated"] = timestamp
+        file_entry, error = add_registry_entry(unique_filename, original_filename, timestamp, request_id, content_hashes, storage_format)
+        if error:
+            return None, error
 
-        try:
-            registry_body = json.dumps(registry, indent=2)
-            s3_client.put_object(Bucket=BUCKET_NAME, Key=registry_key, Body=registry_body)
-            return file_entry, None
-        except ClientError as e:
-            return None, f"Error writing registry to S3: {str(e)}"
+        _invalidate_loaded_indexes(unique_filename)
+        _mark_registry_changed()
+        return file_entry, None
 
     except Exception as e:
         return None, f"Unexpected error: {str(e)}"
 
 def delete_file_from_registry(filename):
-    registry_key = "faiss_indexes/file_registry.json"
     try:
-        try:
-            response = s3_client.get_object(Bucket=BUCKET_NAME, Key=registry_key)
-            registry = json.loads(response['Body'].read().decode('utf-8'))
-        except s3_client.exceptions.NoSuchKey:
-            print(f"Registry file {registry_key} not found in S3")
-            return False, "Registry file not found in S3"
-        except ClientError as e:
-            print(f"Error accessing registry file: {e}")
-            return False, f"Error accessing registry: {str(e)}"
-
-        if not any(f["unique_filename"] == filename for f in registry.get("files", [])):
+        if db.session.get(FileRegistryEntry, filename) is None:
             print(f"Filename {filename} not found in registry")
             return False, f"File {filename} not found in registry"
 
         s3_deletion_errors = []
-        for key in [f"faiss_indexes/{filename}.faiss", f"faiss_indexes/{filename}.pkl"]:
+        for key in [f"faiss_indexes/{filename}{ext}" for ext in INDEX_FILE_EXTENSIONS]:
             try:
                 s3_client.delete_object(Bucket=BUCKET_NAME, Key=key)
                 print(f"Deleted S3 object: {key}")
@@ -110,16 +133,18 @@ def delete_file_from_registry(filename):
             else:
                 print(f"Local file not found: {local_path}")
 
-        registry["files"] = [f for f in registry.get("files", []) if f["unique_filename"] != filename]
-        registry["last_updated"] = int(time.time())
+        _, registry_error = remove_registry_entries([filename])
+        _invalidate_loaded_indexes(filename)
+        _remove_cached_index_files(filename)
+        _mark_registry_changed()
 
-        try:
-            updated_body = json.dumps(registry, indent=2)
-            s3_client.put_object(Bucket=BUCKET_NAME, Key=registry_key, Body=updated_body)
-            print(f"Updated registry: {registry_key}")
-        except ClientError as e:
-            print(f"Error updating registry: {e}")
-            return False, f"Error updating registry: {str(e)}"
+        from .corpus_index import remove_from_corpus_index
+        remove_from_corpus_index([filename])
+
+        if registry_error:
+            print(f"Error updating registry: {registry_error}")
+            return False, registry_error
+        print(f"Removed {filename} from registry")
         if s3_deletion_errors or local_deletion_errors:
             error_message = "Deletion completed with issues: " + "; ".join(s3_deletion_errors + local_deletion_errors)
             return True, error_message
@@ -129,7 +154,8 @@ def delete_file_from_registry(filename):
         print(f"Unexpected error in delete_file_from_registry: {e}")
         return False, f"Unexpected error: {str(e)}"
 
-def list_registry():
+def load_legacy_registry():
+    """Danh sách file của faiss_indexes/file_registry.json trên S3; None nếu không đọc được"""
     registry_key = "faiss_indexes/file_registry.json"
     try:
         response = s3_client.get_object(Bucket=BUCKET_NAME, Key=registry_key)
@@ -137,21 +163,109 @@ def list_registry():
         return registry.get("files", [])
     except s3_client.exceptions.NoSuchKey:
         return []
-    except Exception:
-        return []
+    except Exception as e:
+        print(f"[WARNING] Cannot read legacy S3 registry: {e}")
+        return None
 
-def download_from_s3(unique_filename):
-    faiss_key = f"faiss_indexes/{unique_filename}.faiss"
-    pkl_key = f"faiss_indexes/{unique_filename}.pkl"
-    local_faiss_path = os.path.join(DATA_DIR, f"{unique_filename}.faiss")
-    local_pkl_path = os.path.join(DATA_DIR, f"{unique_filename}.pkl")
+def import_legacy_registry():
+    """
+    Import registry JSON trên S3 vào bảng file_registry nếu bảng chưa từng được ghi (version 0),
+    để deploy đầu tiên không phục vụ registry rỗng khi chưa chạy migrate_file_registry.py.
+    """
+    if get_registry_version():
+        return 0
+    files = load_legacy_registry()
+    if files is None:
+        # Retried at the next boot; readers keep using the S3 registry while the table is at version 0
+        return 0
+    imported, error = import_registry_entries(files)
+    if error:
+        print(f"[WARNING] {error}")
+        return 0
+    print(f"[INFO] Imported {imported} entries from the legacy S3 registry")
+    _mark_registry_changed()
+    return imported
+
+def list_registry():
+    try:
+        return list_registry_entries()
+    except Exception as e:
+        print(f"[WARNING] Registry table unavailable, reading legacy S3 registry: {e}")
+    return load_legacy_registry() or []
+
+def _download_part(key, tmp_path):
+    s3_client.download_file(BUCKET_NAME, key, tmp_path, Config=_transfer_config)
+    return os.path.getsize(tmp_path)
+
+def _download_index_parts(unique_filename, extensions):
+    """Tải song song các phần của index vào file tạm, chỉ đổi tên khi mọi phần đã tải xong"""
+    targets = {ext: os.path.join(DATA_DIR, f"{unique_filename}{ext}") for ext in extensions}
+    # Unique per call: downloads of the same file with other extension sets (pickle vs chunk store,
+    # both including .faiss) are not coalesced and must not share a temp file
+    token = uuid.uuid4().hex[:12]
+    temps = {ext: f"{path}.tmp.{os.getpid()}.{token}" for ext, path in targets.items()}
+    started = time.time()
+    try:
+        futures = [
+            _download_executor.submit(_download_part, f"faiss_indexes/{unique_filename}{ext}", temps[ext])
+            for ext in extensions
+        ]
+        # Wait for every part so no worker is still writing a temp file when it gets cleaned up
+        wait(futures)
+        size = sum(future.result() for future in futures)
+        for ext in extensions:
+            os.replace(temps[ext], targets[ext])
+    finally:
+        for tmp_path in temps.values():
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+    with _inflight_lock:
+        _download_stats["downloads"] += 1
+        _download_stats["bytes"] += size
+        _download_stats["seconds"] += time.time() - started
+
+def download_from_s3(unique_filename, extensions=(".faiss", ".pkl")):
+    """
+    Tải index từ S3: các phần tải song song (multipart với file lớn), ghi vào file tạm rồi os.replace
+    nên không ai đọc được index tải dở. Các lời gọi đồng thời cho cùng một index dùng chung một lần tải.
+    """
+    key = (unique_filename, tuple(extensions))
+    with _inflight_lock:
+        future = _inflight_downloads.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight_downloads[key] = future
+        else:
+            _download_stats["coalesced"] += 1
+    if not leader:
+        return future.result()
 
+    ok = False
     try:
-        s3_client.download_file(BUCKET_NAME, faiss_key, local_faiss_path)
-        s3_client.download_file(BUCKET_NAME, pkl_key, local_pkl_path)
-        return True
-    except Exception:
-        return False
+        _download_index_parts(unique_filename, key[1])
+        ok = True
+    except Exception as e:
+        print(f"[WARNING] Failed to download index {unique_filename} from S3: {e}")
+        with _inflight_lock:
+            _download_stats["failures"] += 1
+    finally:
+        with _inflight_lock:
+            _inflight_downloads.pop(key, None)
+        future.set_result(ok)
+    return ok
+
+def get_s3_download_stats():
+    """Thống kê tải index từ S3"""
+    with _inflight_lock:
+        stats = dict(_download_stats)
+        stats["in_flight"] = len(_inflight_downloads)
+    stats["seconds"] = round(stats["seconds"], 3)
+    stats["mb_per_second"] = round(stats["bytes"] / 1048576 / stats["seconds"], 2) if stats["seconds"] else 0.0
+    return stats
 
 def get_file_name_from_url(url):
     return url.split('/')[-1]
@@ -272,15 +386,9 @@ def delete_file_complete(filename):
         try:
             actual_unique_filename = None
             try:
-                registry_key = "faiss_indexes/file_registry.json"
-                response = s3_client.get_object(Bucket=BUCKET_NAME, Key=registry_key)
-                registry = json.loads(response['Body'].read().decode('utf-8'))
-                
-                for file_entry in registry.get("files", []):
-                    if (file_entry.get("unique_filename") == unique_filename or 
-                        file_entry.get("unique_filename") == filename or
-                        file_entry.get("original_filename") == filename):
-                        actual_unique_filename = file_entry.get("unique_filename")
+                for file_entry in find_registry_entries([unique_filename, filename]):
+                    if file_entry.original_filename == filename or file_entry.unique_filename in (unique_filename, filename):
+                        actual_unique_filename = file_entry.unique_filename
                         print(f"Found actual unique_filename in registry: {actual_unique_filename}")
                         break
             except Exception as e:
@@ -288,14 +396,10 @@ def delete_file_complete(filename):
             
             faiss_keys_to_try = []
             if actual_unique_filename:
-                faiss_keys_to_try.extend([
-                    f"faiss_indexes/{actual_unique_filename}.faiss",
-                    f"faiss_indexes/{actual_unique_filename}.pkl"
-                ])
+                faiss_keys_to_try.extend(f"faiss_indexes/{actual_unique_filename}{ext}" for ext in INDEX_FILE_EXTENSIONS)
             
+            faiss_keys_to_try.extend(f"faiss_indexes/{unique_filename}{ext}" for ext in INDEX_FILE_EXTENSIONS)
             faiss_keys_to_try.extend([
-                f"faiss_indexes/{unique_filename}.faiss",
-                f"faiss_indexes/{unique_filename}.pkl",
                 f"faiss_indexes/{filename}.faiss",
                 f"faiss_indexes/{filename}.pkl"
             ])
@@ -314,43 +418,29 @@ def delete_file_complete(filename):
         except Exception as e:
             s3_bucket1_deletion_errors.append(f"Error accessing BUCKET_NAME: {str(e)}")
 
-        registry_deletion_success = False
         registry_error = None
         try:
-            registry_key = "faiss_indexes/file_registry.json"
-            try:
-                response = s3_client.get_object(Bucket=BUCKET_NAME, Key=registry_key)
-                registry = json.loads(response['Body'].read().decode('utf-8'))
-                
-                original_count = len(registry.get("files", []))
-                
-                entries_to_remove = []
-                for f in registry.get("files", []):
-                    if (f["unique_filename"] == unique_filename or 
-                        f["unique_filename"] == filename or
-                        f["original_filename"] == filename or
-                        f["request_id"] == unique_filename or
-                        f["request_id"] == filename):
-                        entries_to_remove.append(f["unique_filename"])
-                
-                registry["files"] = [f for f in registry.get("files", []) 
-                                   if f["unique_filename"] not in entries_to_remove]
-                registry["last_updated"] = int(time.time())
-                
-                updated_body = json.dumps(registry, indent=2)
-                s3_client.put_object(Bucket=BUCKET_NAME, Key=registry_key, Body=updated_body)
-                registry_deletion_success = True
-                removed_count = original_count - len(registry["files"])
-                print(f"Updated registry: removed {removed_count} entries")
-            except s3_client.exceptions.NoSuchKey:
-                print(f"Registry file {registry_key} not found in S3")
-            except ClientError as e:
-                registry_error = str(e)
-                print(f"Error updating registry: {e}")
+            entries_to_remove = [f.unique_filename for f in find_registry_entries([unique_filename, filename])]
+            removed, registry_error = remove_registry_entries(entries_to_remove)
+            if removed:
+                _invalidate_loaded_indexes(*removed)
+                _mark_registry_changed()
+            if not registry_error:
+                print(f"Updated registry: removed {len(removed)} entries")
         except Exception as e:
+            db.session.rollback()
             registry_error = str(e)
             print(f"Unexpected error updating registry: {e}")
 
+        _invalidate_loaded_indexes(unique_filename, filename, actual_unique_filename)
+        _remove_cached_index_files(unique_filename, filename, actual_unique_filename)
+
+        try:
+            from .corpus_index import remove_from_corpus_index
+            remove_from_corpus_index([unique_filename, filename, actual_unique_filename])
+        except Exception as e:
+            print(f"Error removing file from corpus index: {e}")
+
         local_deletion_errors = []
         for ext in [".faiss", ".pkl", ".pdf"]:
             for name in [unique_filename, filename]:
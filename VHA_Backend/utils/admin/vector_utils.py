@@ -13,7 +13,20 @@ from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from langchain.text_splitter import CharacterTextSplitter
-from .upload_s3_utils import DATA_DIR, s3_lock, list_registry
+from .upload_s3_utils import DATA_DIR, s3_lock, list_registry, _invalidate_loaded_indexes, download_from_s3
+from .upload_s3_utils import update_file_registry as _update_registry_table
+from .corpus_index import add_to_corpus_index
+from .index_cache import record_local_index
+from .index_builder import build_vector_store, reconstruct_vectors
+from .chunk_store import write_chunk_store, chunk_store_paths, iter_store_documents
+from .lexical_index import write_lexical_index
+from .file_routing import compute_file_routing, compute_file_summary
+from .file_registry import set_file_routing
+
+try:
+    from config.performance import CHUNK_STORE_ENABLED
+except ImportError:
+    CHUNK_STORE_ENABLED = True
 from utils.aws_client import s3_client, bedrock_embeddings
 from typing import List
 from langchain.schema import Document
@@ -158,26 +171,57 @@ def create_vector_store(request_id, documents, original_filename, bedrock_embedd
         faiss_path = os.path.join(folder_path, f"{unique_filename}.faiss")
         pkl_path = os.path.join(folder_path, f"{unique_filename}.pkl")
 
-        vectorstore_faiss = FAISS.from_documents(documents, bedrock_embeddings)
+        vectorstore_faiss = build_vector_store(documents, bedrock_embeddings)
         vectorstore_faiss.save_local(index_name=unique_filename, folder_path=folder_path)
         print(f"FAISS saved locally to {faiss_path} & {pkl_path}")
 
+        add_to_corpus_index(unique_filename, original_filename, vectorstore_faiss, bedrock_embeddings)
+
+        storage_format = "pickle"
+        extra_paths = []
+        try:
+            extra_paths.append(write_lexical_index(unique_filename, (doc.page_content for doc in iter_store_documents(vectorstore_faiss))))
+        except Exception as e:
+            print(f"Failed to write lexical index, retrieval will be vector-only for this file: {e}")
+        if CHUNK_STORE_ENABLED:
+            try:
+                write_chunk_store(unique_filename, vectorstore_faiss, folder_path)
+                extra_paths.extend(chunk_store_paths(unique_filename, folder_path))
+                storage_format = "chunks"
+            except Exception as e:
+                print(f"Failed to write chunk store, keeping pickle format only: {e}")
+
         s3_faiss_key = f"faiss_indexes/{unique_filename}.faiss"
         s3_pkl_key = f"faiss_indexes/{unique_filename}.pkl"
 
         with s3_lock:
             s3_client.upload_file(Filename=faiss_path, Bucket=os.getenv("BUCKET_NAME"), Key=s3_faiss_key)
             s3_client.upload_file(Filename=pkl_path, Bucket=os.getenv("BUCKET_NAME"), Key=s3_pkl_key)
+            for path in extra_paths:
+                s3_client.upload_file(Filename=path, Bucket=os.getenv("BUCKET_NAME"), Key=f"faiss_indexes/{os.path.basename(path)}")
             print(f"Uploaded to S3: {s3_faiss_key}, {s3_pkl_key}")
 
+        # Keep the local copy as a warm index cache entry instead of re-downloading it on first query
+        content_hashes = None
         try:
-            os.remove(faiss_path)
-            os.remove(pkl_path)
-            print(f"Deleted local files: {faiss_path}, {pkl_path}")
+            content_hashes = record_local_index(unique_filename)
         except Exception as e:
-            print(f"Failed to delete local files: {e}")
+            print(f"Failed to record local index cache entry: {e}")
 
-        update_file_registry(unique_filename, original_filename, timestamp, request_id)
+        # Saved before the registry row so readers never see the file without its routing topics
+        routing = compute_file_routing(documents)
+        summary = None
+        try:
+            summary = compute_file_summary(reconstruct_vectors(vectorstore_faiss.index))
+        except Exception as e:
+            print(f"Failed to compute summary vectors, file will not be pruned: {e}")
+        routing_error = set_file_routing(unique_filename, routing, summary)
+        if routing_error:
+            print(f"Failed to save file routing: {routing_error}")
+        else:
+            print(f"Routing topics of {original_filename}: {routing['topics']}")
+
+        update_file_registry(unique_filename, original_filename, timestamp, request_id, content_hashes, storage_format)
         print(f"Registry updated with file: {original_filename}")
 
         return unique_filename
@@ -186,37 +230,14 @@ def create_vector_store(request_id, documents, original_filename, bedrock_embedd
         print(f"Error in create_vector_store: {e}")
         return None
 
-def update_file_registry(unique_filename, original_filename, timestamp, request_id):
-    registry_key = "faiss_indexes/file_registry.json"
-
-    try:
-        try:
-            response = s3_client.get_object(Bucket=os.getenv("BUCKET_NAME"), Key=registry_key)
-            registry = json.loads(response['Body'].read().decode('utf-8'))
-        except s3_client.exceptions.NoSuchKey:
-            registry = {"files": []}
-
-        if isinstance(timestamp, str):
-            timestamp = int(float(timestamp))
-
-        file_entry = {
-            "unique_filename": unique_filename,
-            "original_filename": original_filename,
-            "request_id": request_id,
-            "timestamp": timestamp,
-            "upload_date": datetime.fromtimestamp(timestamp).isoformat(),
-            "faiss_key": f"faiss_indexes/{unique_filename}.faiss",
-            "pkl_key": f"faiss_indexes/{unique_filename}.pkl"
-        }
-
-        registry["files"].append(file_entry)
-        registry["last_updated"] = timestamp
+def update_file_registry(unique_filename, original_filename, timestamp, request_id, content_hashes=None, storage_format="pickle"):
+    if isinstance(timestamp, str):
+        timestamp = int(float(timestamp))
 
-        registry_body = json.dumps(registry, indent=2)
-        s3_client.put_object(Bucket=os.getenv("BUCKET_NAME"), Key=registry_key, Body=registry_body)
-
-    except Exception as e:
-        print(f"Failed to update file registry: {e}")
+    file_entry, error = _update_registry_table(unique_filename, original_filename, timestamp, request_id, content_hashes, storage_format)
+    if error:
+        print(f"Failed to update file registry: {error}")
+    return file_entry
 
 def load_vector_store_if_exists(request_id, bedrock_embeddings):
     for filename in os.listdir(DATA_DIR):
@@ -254,21 +275,6 @@ def initialize_model():
 
     return None, vector_stores
 
-def download_from_s3(unique_filename):
-    faiss_key = f"faiss_indexes/{unique_filename}.faiss"
-    pkl_key = f"faiss_indexes/{unique_filename}.pkl"
-
-    local_faiss_path = os.path.join(DATA_DIR, f"{unique_filename}.faiss")
-    local_pkl_path = os.path.join(DATA_DIR, f"{unique_filename}.pkl")
-
-    try:
-        s3_client.download_file(os.getenv("BUCKET_NAME"), faiss_key, local_faiss_path)
-        s3_client.download_file(os.getenv("BUCKET_NAME"), pkl_key, local_pkl_path)
-        return True
-    except Exception as e:
-        print(f"Download error: {e}")
-        return False
-
 def load_vector_store_from_s3(unique_filename, bedrock_embeddings):
     if download_from_s3(unique_filename):
         try:
@@ -3,6 +3,7 @@ import boto3
 import warnings
 from dotenv import load_dotenv
 from langchain_community.embeddings import BedrockEmbeddings
+from utils.embedding_cache import CachedEmbeddings
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 warnings.filterwarnings("ignore", message=".*BedrockEmbeddings.*")
@@ -16,8 +17,20 @@ session = boto3.Session(
 )
 bedrock_client = session.client(service_name="bedrock-runtime")
 s3_client = session.client("s3")
-bedrock_embeddings = BedrockEmbeddings(
-    model_id=os.getenv("MODEL_ID"),
-    client=bedrock_client
-)
+try:
+    from config.performance import EMBEDDING_DIMENSIONS
+except ImportError:
+    EMBEDDING_DIMENSIONS = None
+
+def make_bedrock_embeddings(dimensions=None):
+    """Titan v2 embeddings, optionally with reduced output dimensions (256/512); cached per dimension"""
+    model_id = os.getenv("MODEL_ID")
+    if not dimensions:
+        return CachedEmbeddings(BedrockEmbeddings(model_id=model_id, client=bedrock_client), model_id=model_id)
+    return CachedEmbeddings(
+        BedrockEmbeddings(model_id=model_id, client=bedrock_client, model_kwargs={"dimensions": int(dimensions)}),
+        model_id=f"{model_id}:{int(dimensions)}"
+    )
+
+bedrock_embeddings = make_bedrock_embeddings(EMBEDDING_DIMENSIONS)
 print("region:", os.getenv("REGION"))
\ No newline at end of file
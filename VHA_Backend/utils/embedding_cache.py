@@ -0,0 +1,190 @@
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+try:
+    from config.performance import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL
+except ImportError:
+    EMBEDDING_CACHE_SIZE = 100
+    EMBEDDING_CACHE_TTL = 7 * 24 * 3600
+
+REDIS_RETRY_INTERVAL = 30
+
+_stats_lock = threading.Lock()
+_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0}
+
+
+def _bump(counter: str, amount: int = 1):
+    if amount:
+        with _stats_lock:
+            _stats[counter] += amount
+
+
+def normalize_embedding_text(text: str) -> str:
+    """Chuẩn hóa text trước khi embed/cache: Unicode NFC và gộp khoảng trắng"""
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def chunk_text_hash(text: str) -> str:
+    """sha256 của text sau khi chuẩn hóa; dùng cho cache key và chunk embedding store"""
+    return hashlib.sha256(normalize_embedding_text(text).encode("utf-8")).hexdigest()
+
+
+def embedding_cache_key(text: str, model_id: str, namespace: str = "emb") -> str:
+    return f"{namespace}:{model_id}:{chunk_text_hash(text)}"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc một Embeddings (Bedrock Titan) với cache hai tầng: LRU trong process và Redis.
+    Vector được lưu dạng float32 bytes, key theo model id + text đã chuẩn hóa.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str = None, namespace: str = "emb",
+                 local_size: int = EMBEDDING_CACHE_SIZE, ttl: Optional[int] = EMBEDDING_CACHE_TTL,
+                 redis_client=None):
+        self.embeddings = embeddings
+        self.model_id = model_id or getattr(embeddings, "model_id", None) or "default"
+        self.namespace = namespace
+        self.local_size = local_size
+        self.ttl = ttl
+        self._redis = redis_client
+        self._redis_retry_after = 0.0
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Expose attributes of the wrapped embeddings (model_id, client, model_kwargs, ...)
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _get_redis(self):
+        if time.time() < self._redis_retry_after:
+            return None
+        if self._redis is None:
+            from utils.redis_client import redis_binary_client
+            self._redis = redis_binary_client
+        return self._redis
+
+    def _redis_failed(self, e: Exception):
+        _bump("redis_errors")
+        self._redis_retry_after = time.time() + REDIS_RETRY_INTERVAL
+        print(f"[WARNING] Embedding cache Redis unavailable: {e}")
+
+    def _local_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is None:
+                return None
+            self._local.move_to_end(key)
+        return vector.tolist()
+
+    def _local_put(self, key: str, vector: List[float]):
+        # float32 arrays are ~8x smaller than lists of Python floats
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._local[key] = vector
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _redis_get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        client = self._get_redis()
+        if client is None or not keys:
+            return {}
+        try:
+            values = client.mget(keys)
+        except Exception as e:
+            self._redis_failed(e)
+            return {}
+        found = {}
+        for key, raw in zip(keys, values):
+            if raw:
+                found[key] = np.frombuffer(raw, dtype=np.float32).tolist()
+        return found
+
+    def _redis_put_many(self, items: Dict[str, List[float]]):
+        client = self._get_redis()
+        if client is None or not items:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, vector in items.items():
+                pipe.set(key, np.asarray(vector, dtype=np.float32).tobytes(), ex=self.ttl)
+            pipe.execute()
+        except Exception as e:
+            self._redis_failed(e)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        normalized = [normalize_embedding_text(text) for text in texts]
+        keys = [embedding_cache_key(text, self.model_id, self.namespace) for text in normalized]
+
+        vectors: Dict[str, List[float]] = {}
+        for key in keys:
+            vector = self._local_get(key)
+            if vector is not None:
+                vectors[key] = vector
+        _bump("local_hits", sum(1 for key in keys if key in vectors))
+
+        remote_keys = list(dict.fromkeys(key for key in keys if key not in vectors))
+        from_redis = self._redis_get_many(remote_keys)
+        for key, vector in from_redis.items():
+            vectors[key] = vector
+            self._local_put(key, vector)
+        _bump("redis_hits", sum(1 for key in keys if key in from_redis))
+
+        missing = {}
+        for key, text in zip(keys, normalized):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        _bump("misses", sum(1 for key in keys if key in missing))
+
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), computed))
+            for key, vector in new_items.items():
+                vectors[key] = vector
+                self._local_put(key, vector)
+            self._redis_put_many(new_items)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        normalized = normalize_embedding_text(text)
+        key = embedding_cache_key(normalized, self.model_id, self.namespace)
+
+        vector = self._local_get(key)
+        if vector is not None:
+            _bump("local_hits")
+            return vector
+
+        vector = self._redis_get_many([key]).get(key)
+        if vector is not None:
+            _bump("redis_hits")
+            self._local_put(key, vector)
+            return vector
+
+        _bump("misses")
+        vector = self.embeddings.embed_query(normalized)
+        self._local_put(key, vector)
+        self._redis_put_many({key: vector})
+        return vector
+
+
+def get_embedding_cache_stats() -> Dict[str, float]:
+    """Hit/miss counters of every CachedEmbeddings in this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+    stats["lookups"] = lookups
+    stats["hit_rate"] = round((stats["local_hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+    return stats
@@ -9,3 +9,13 @@ redis_client = redis.StrictRedis(
     db=0,
     decode_responses=True
 )
+
+# Raw bytes values (e.g. float32 embedding vectors) cannot go through the decoding client
+redis_binary_client = redis.StrictRedis(
+    host=os.getenv("REDIS_HOST"),
+    port=(os.getenv("REDIS_PORT")),
+    db=0,
+    decode_responses=False,
+    socket_connect_timeout=2,
+    socket_timeout=2
+)
\ No newline at end of file
@@ -10,8 +10,8 @@ from .keywords_utils import (
 )
 
 from .vector_store_utils import (
-    get_latest_n_files, load_multiple_vector_stores, retrieve_relevant_docs,
-    build_context, prioritize_files_for_hr_questions
+    get_latest_n_files, load_multiple_vector_stores, retrieve_relevant_docs, retrieve_relevant_docs_multi,
+    build_context, build_context_with_docs, prioritize_files_for_hr_questions, embed_question, embed_questions
 )
 
 from .chitchat_handler import handle_chitchat, should_handle_as_chitchat, is_basic_greeting
@@ -45,8 +45,12 @@ __all__ = [
     'get_latest_n_files',
     'load_multiple_vector_stores',
     'retrieve_relevant_docs',
+    'retrieve_relevant_docs_multi',
     'build_context',
+    'build_context_with_docs',
     'prioritize_files_for_hr_questions',
+    'embed_question',
+    'embed_questions',
     
     'handle_chitchat',
     'should_handle_as_chitchat',
@@ -38,9 +38,12 @@ from utils.user.keywords_utils import (
     lightweight_context_analysis, enhance_question_with_context
 )
 from utils.user.vector_store_utils import (
-    get_latest_n_files, load_multiple_vector_stores, retrieve_relevant_docs,
-    build_context, prioritize_files_for_hr_questions
+    get_latest_n_files, load_multiple_vector_stores, retrieve_relevant_docs, retrieve_relevant_docs_multi,
+    build_context_with_docs, prioritize_files_for_hr_questions, embed_question, prune_files_by_summary,
+    HYBRID_RETRIEVAL_ENABLED, MULTI_QUERY_ENABLED
 )
+from utils.user.rerank_utils import rerank_documents
+from utils.user.dedup_utils import suppress_near_duplicates
 from utils.user.chitchat_handler import handle_chitchat, should_handle_as_chitchat
 from utils.user.response_utils import (
     notify_no_documents, notify_error_loading_vectors, notify_no_answer_found,
@@ -59,6 +62,39 @@ session = boto3.Session(
 s3_client = session.client("s3")
 bedrock_client = session.client(service_name="bedrock-runtime")
 
+def _rerank_docs(question: str, docs, rerank_k: int, vector_stores):
+    """Giữ rerank_k chunk tốt nhất; embedding câu hỏi lấy lại từ cache của lần retrieval"""
+    try:
+        query_embedding = embed_question(question, bedrock_embeddings)
+    except Exception as e:
+        print(f"[WARNING] Rerank without query embedding: {e}")
+        query_embedding = None
+    return rerank_documents(question, docs, rerank_k, vector_stores, query_embedding)
+
+def _retrieve_docs(vector_stores, enhanced_question: str, question: str, retrieve_k: int):
+    """
+    Tìm với câu hỏi đã viết lại và câu hỏi gốc trong cùng một lượt (một lần embed, mỗi shard
+    search một lần) thay vì tìm lại bằng câu hỏi gốc khi kết quả đầu không chứa từ khóa.
+    """
+    if MULTI_QUERY_ENABLED:
+        variants = [q for q in (enhanced_question, question) if q]
+        docs = retrieve_relevant_docs_multi(vector_stores, variants, k=retrieve_k)
+        if docs and not HYBRID_RETRIEVAL_ENABLED and not check_keywords_in_docs(docs):
+            print("[WARNING] No relevant keywords found, but continuing with document search")
+        return docs
+
+    docs = retrieve_relevant_docs(vector_stores, enhanced_question, k=retrieve_k)
+    if docs and not HYBRID_RETRIEVAL_ENABLED and not check_keywords_in_docs(docs):
+        # Same text would give the same vector search, so only re-query when the raw question differs
+        fallback_docs = None
+        if question != enhanced_question:
+            fallback_docs = retrieve_relevant_docs(vector_stores, question, k=retrieve_k)
+        if fallback_docs and check_keywords_in_docs(fallback_docs):
+            docs = fallback_docs
+        else:
+            print("[WARNING] No relevant keywords found, but continuing with document search")
+    return docs
+
 class StreamingResultContainer:
     """Container to share data between generator and caller"""
     def __init__(self):
@@ -182,27 +218,25 @@ def get_response_from_multiple_sources(
     else:
         prioritized_files = latest_files
 
+    prioritized_files = prune_files_by_summary(prioritized_files, enhanced_question, bedrock_embeddings)
     vector_stores = load_multiple_vector_stores(prioritized_files, bedrock_embeddings)
     if not vector_stores:
         print("[WARNING] No vector stores available, using chitchat fallback")
         chitchat_response = handle_chitchat(question, lang, t0, model)
         return {"response": chitchat_response, "references": []}
 
-    docs = retrieve_relevant_docs(vector_stores, enhanced_question, k=retrieve_k)
+    docs = _retrieve_docs(vector_stores, enhanced_question, question, retrieve_k)
     
     if not docs:
         print("[WARNING] No documents retrieved, using chitchat fallback")
         chitchat_response = handle_chitchat(question, lang, t0, model)
         return {"response": chitchat_response, "references": []}
     
-    if not check_keywords_in_docs(docs):
-        fallback_docs = retrieve_relevant_docs(vector_stores, question, k=retrieve_k)
-        if fallback_docs and check_keywords_in_docs(fallback_docs):
-            docs = fallback_docs
-        else:
-            print("[WARNING] No relevant keywords found, but continuing with document search")
+    docs = suppress_near_duplicates(docs, vector_stores)
+    if enable_rerank:
+        docs = _rerank_docs(enhanced_question, docs, rerank_k, vector_stores)
 
-    context = build_context(docs, enhanced_question)
+    context, context_docs = build_context_with_docs(docs, enhanced_question, model=model or "gpt-4o-mini")
     safe_question = enhanced_question or question or ""
     safe_context = context or ""
     prompt = build_prompt(safe_context, safe_question, lang, chat_history=chat_history)
@@ -214,7 +248,7 @@ def get_response_from_multiple_sources(
         if validation_result:
             return validation_result
 
-        references = extract_references_from_docs(docs, response, question)
+        references = extract_references_from_docs(context_docs, response, question)
         formatted_response = format_references_in_response(response, references)
         
         _save_conversation_message(user_id, conversation_id, "assistant", formatted_response)
@@ -354,6 +388,7 @@ def get_streaming_response_from_multiple_sources(
     else:
         prioritized_files = latest_files
 
+    prioritized_files = prune_files_by_summary(prioritized_files, enhanced_question, bedrock_embeddings)
     vector_stores = load_multiple_vector_stores(prioritized_files, bedrock_embeddings)
     if not vector_stores:
         print("[WARNING] No vector stores available, using chitchat fallback")
@@ -365,7 +400,7 @@ def get_streaming_response_from_multiple_sources(
             yield chunk
         return
 
-    docs = retrieve_relevant_docs(vector_stores, enhanced_question, k=retrieve_k)
+    docs = _retrieve_docs(vector_stores, enhanced_question, question, retrieve_k)
     
     if not docs:
         print("[WARNING] No documents retrieved, using chitchat fallback")
@@ -377,14 +412,11 @@ def get_streaming_response_from_multiple_sources(
             yield chunk
         return
     
-    if not check_keywords_in_docs(docs):
-        fallback_docs = retrieve_relevant_docs(vector_stores, question, k=retrieve_k)
-        if fallback_docs and check_keywords_in_docs(fallback_docs):
-            docs = fallback_docs
-        else:
-            print("[WARNING] No relevant keywords found, but continuing with document search")
+    docs = suppress_near_duplicates(docs, vector_stores)
+    if enable_rerank:
+        docs = _rerank_docs(enhanced_question, docs, rerank_k, vector_stores)
 
-    context = build_context(docs, enhanced_question)
+    context, context_docs = build_context_with_docs(docs, enhanced_question, model=model or "gpt-4o-mini")
     safe_question = enhanced_question or question or ""
     safe_context = context or ""
     prompt = build_prompt(safe_context, safe_question, lang, chat_history=chat_history)
@@ -406,7 +438,7 @@ def get_streaming_response_from_multiple_sources(
             yield f"\n{error_msg}"
             return
 
-        references = extract_references_from_docs(docs, full_response, question)
+        references = extract_references_from_docs(context_docs, full_response, question)
         
         if result_container:
             result_container.references = references
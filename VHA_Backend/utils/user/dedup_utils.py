@@ -0,0 +1,117 @@
+import re
+import time
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+from langchain.schema import Document
+
+from utils.admin.lexical_index import fold_diacritics
+from utils.user.vector_store_utils import get_doc_vectors
+
+try:
+    from config.performance import DEDUP_ENABLED, DEDUP_COSINE_THRESHOLD, DEDUP_SHINGLE_SIZE, DEDUP_JACCARD_THRESHOLD
+except ImportError:
+    DEDUP_ENABLED = True
+    DEDUP_COSINE_THRESHOLD = 0.95
+    DEDUP_SHINGLE_SIZE = 5
+    DEDUP_JACCARD_THRESHOLD = 0.8
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "candidates": 0, "dropped": 0, "dropped_by_vector": 0, "dropped_by_shingles": 0,
+          "tokens_saved": 0, "seconds": 0.0}
+
+
+def _shingles(text: str, size: int = DEDUP_SHINGLE_SIZE) -> Set[tuple]:
+    words = _WORD_RE.findall(fold_diacritics((text or "").lower()))
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(first: Set[tuple], second: Set[tuple]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def _count_tokens(docs: List[Document]) -> int:
+    try:
+        from utils.admin.token_utils import count_tokens
+        return sum(count_tokens(doc.page_content or "") for doc in docs)
+    except Exception:
+        # Rough estimate when tiktoken is unavailable
+        return sum(len(doc.page_content or "") // 4 for doc in docs)
+
+
+def suppress_near_duplicates(docs: List[Document], vector_stores: Optional[List[Dict[str, Any]]] = None) -> List[Document]:
+    """
+    Bỏ các chunk gần trùng với một chunk xếp hạng cao hơn (cùng điều khoản lặp lại giữa các sổ tay,
+    hoặc phần overlap giữa các chunk liền kề). Dùng vector đã lưu trong index, không gọi Bedrock;
+    chunk không đọc được vector thì so bằng word shingles. Giữ nguyên thứ tự các chunk còn lại.
+    """
+    if not DEDUP_ENABLED or len(docs) < 2:
+        return docs
+
+    t0 = time.time()
+    try:
+        vectors = get_doc_vectors(docs, vector_stores or [])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        has_vector = ~np.isnan(vectors[:, 0])
+        shingles = [None] * len(docs)
+
+        kept_positions: List[int] = []
+        dropped: List[Document] = []
+        by_vector = by_shingles = 0
+        for position, doc in enumerate(docs):
+            duplicate = False
+            for kept in kept_positions:
+                if has_vector[position] and has_vector[kept]:
+                    if float(vectors[position] @ vectors[kept]) >= DEDUP_COSINE_THRESHOLD:
+                        duplicate = True
+                        by_vector += 1
+                        break
+                    continue
+                for candidate in (position, kept):
+                    if shingles[candidate] is None:
+                        shingles[candidate] = _shingles(docs[candidate].page_content)
+                if _jaccard(shingles[position], shingles[kept]) >= DEDUP_JACCARD_THRESHOLD:
+                    duplicate = True
+                    by_shingles += 1
+                    break
+            if duplicate:
+                dropped.append(doc)
+            else:
+                kept_positions.append(position)
+    except Exception as e:
+        print(f"[WARNING] Near-duplicate suppression failed, keeping all chunks: {e}")
+        return docs
+
+    tokens_saved = _count_tokens(dropped) if dropped else 0
+    elapsed = time.time() - t0
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["candidates"] += len(docs)
+        _stats["dropped"] += len(dropped)
+        _stats["dropped_by_vector"] += by_vector
+        _stats["dropped_by_shingles"] += by_shingles
+        _stats["tokens_saved"] += tokens_saved
+        _stats["seconds"] += elapsed
+    if not dropped:
+        return docs
+    print(f"[INFO] Dropped {len(dropped)}/{len(docs)} near-duplicate chunks, ~{tokens_saved} prompt tokens saved "
+          f"({elapsed * 1000:.1f}ms)")
+    return [docs[position] for position in kept_positions]
+
+
+def get_dedup_stats() -> Dict[str, Any]:
+    """Số chunk gần trùng đã bỏ và số token prompt tiết kiệm được trong process này"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["enabled"] = DEDUP_ENABLED
+    stats["drop_rate"] = round(stats["dropped"] / stats["candidates"], 4) if stats["candidates"] else 0.0
+    stats["seconds"] = round(stats["seconds"], 3)
+    return stats
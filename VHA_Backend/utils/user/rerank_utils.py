@@ -0,0 +1,138 @@
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain.schema import Document
+
+from utils.admin.lexical_index import tokenize_query, tokenize, fold_diacritics
+from utils.user.vector_store_utils import get_doc_vectors
+
+try:
+    from config.rerank import RERANKER, RERANK_EMBEDDING_WEIGHT
+except ImportError:
+    RERANKER = "combined"
+    RERANK_EMBEDDING_WEIGHT = 0.7
+
+# scorer(question, docs, query_embedding, doc_vectors) -> one score per doc, higher is better.
+# doc_vectors has a NaN row for docs whose vector could not be read back from their index.
+Scorer = Callable[[str, List[Document], Optional[np.ndarray], np.ndarray], Sequence[float]]
+
+_scorers: Dict[str, Scorer] = {}
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "candidates": 0, "kept": 0, "chars_in": 0, "chars_out": 0, "seconds": 0.0,
+          "missing_vectors": 0, "errors": 0}
+
+
+def register_reranker(name: str, scorer: Scorer):
+    """Đăng ký scorer (ví dụ cross-encoder hoặc rerank model trên Bedrock) để chọn qua RERANKER"""
+    _scorers[name] = scorer
+
+
+def available_rerankers() -> List[str]:
+    return sorted(_scorers)
+
+
+def _cosine(query_embedding: Optional[np.ndarray], doc_vectors: np.ndarray) -> np.ndarray:
+    if query_embedding is None or doc_vectors.shape[1] != len(query_embedding):
+        return np.full(len(doc_vectors), np.nan, dtype=np.float32)
+    query = query_embedding / (np.linalg.norm(query_embedding) or 1.0)
+    norms = np.linalg.norm(doc_vectors, axis=1)
+    norms[norms == 0] = 1.0
+    return (doc_vectors @ query) / norms
+
+
+def embedding_scorer(question, docs, query_embedding, doc_vectors) -> np.ndarray:
+    """Cosine giữa câu hỏi và vector đã lưu của chunk (khác khoảng cách L2 xấp xỉ của ANN/PQ)"""
+    return np.nan_to_num(_cosine(query_embedding, doc_vectors), nan=0.0)
+
+
+def lexical_scorer(question, docs, query_embedding, doc_vectors) -> np.ndarray:
+    """Tỉ lệ term của câu hỏi (âm tiết + bigram, bỏ dấu) xuất hiện trong chunk; bigram tính gấp đôi"""
+    query_terms = {fold_diacritics(term) for term in tokenize_query(question)}
+    if not query_terms:
+        return np.zeros(len(docs), dtype=np.float32)
+    weights = {term: 2.0 if "_" in term else 1.0 for term in query_terms}
+    total = sum(weights.values())
+    scores = []
+    for doc in docs:
+        doc_terms = {fold_diacritics(term) for term in tokenize(doc.page_content)}
+        scores.append(sum(weight for term, weight in weights.items() if term in doc_terms) / total)
+    return np.asarray(scores, dtype=np.float32)
+
+
+def combined_scorer(question, docs, query_embedding, doc_vectors) -> np.ndarray:
+    cosine = _cosine(query_embedding, doc_vectors)
+    lexical = lexical_scorer(question, docs, query_embedding, doc_vectors)
+    # Docs without a stored vector are ranked on term overlap alone
+    return np.where(np.isnan(cosine), lexical,
+                    RERANK_EMBEDDING_WEIGHT * np.nan_to_num(cosine) + (1.0 - RERANK_EMBEDDING_WEIGHT) * lexical)
+
+
+register_reranker("embedding", embedding_scorer)
+register_reranker("lexical", lexical_scorer)
+register_reranker("combined", combined_scorer)
+
+
+def rerank_documents(question: str, docs: List[Document], top_k: int,
+                     vector_stores: Optional[List[Dict[str, Any]]] = None,
+                     query_embedding: Optional[Sequence[float]] = None,
+                     reranker: str = None) -> List[Document]:
+    """
+    Chấm điểm lại các chunk đã gộp từ mọi shard và giữ ``top_k`` chunk tốt nhất.
+    Lỗi của scorer không làm hỏng request: giữ thứ tự retrieval và cắt ở ``top_k``.
+    """
+    if not docs or top_k <= 0 or len(docs) <= top_k:
+        return docs
+
+    t0 = time.time()
+    reranker = reranker or RERANKER
+    scorer = _scorers.get(reranker)
+    if scorer is None:
+        print(f"[WARNING] Unknown reranker {reranker!r}, using combined")
+        scorer = combined_scorer
+
+    try:
+        doc_vectors = get_doc_vectors(docs, vector_stores or [])
+        query = np.asarray(query_embedding, dtype=np.float32) if query_embedding is not None else None
+        scores = np.asarray(scorer(question, docs, query, doc_vectors), dtype=np.float32)
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        kept = []
+        for position in order:
+            doc = docs[position]
+            doc.metadata['rerank_score'] = round(float(scores[position]), 6)
+            kept.append(doc)
+        missing = int(np.isnan(doc_vectors[:, 0]).sum())
+    except Exception as e:
+        print(f"[ERROR] Reranking failed, keeping retrieval order: {e}")
+        with _stats_lock:
+            _stats["errors"] += 1
+        return docs[:top_k]
+
+    elapsed = time.time() - t0
+    chars_in = sum(len(doc.page_content or "") for doc in docs)
+    chars_out = sum(len(doc.page_content or "") for doc in kept)
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["candidates"] += len(docs)
+        _stats["kept"] += len(kept)
+        _stats["chars_in"] += chars_in
+        _stats["chars_out"] += chars_out
+        _stats["seconds"] += elapsed
+        _stats["missing_vectors"] += missing
+    print(f"[INFO] Reranked {len(docs)} -> {len(kept)} chunks with {reranker} in {elapsed * 1000:.1f}ms "
+          f"({chars_in} -> {chars_out} chars)")
+    return kept
+
+
+def get_rerank_stats() -> Dict[str, Any]:
+    """Số chunk trước/sau rerank, lượng context tiết kiệm và độ trễ trung bình"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["reranker"] = RERANKER
+    stats["available"] = available_rerankers()
+    stats["context_reduction"] = round(1 - stats["chars_out"] / stats["chars_in"], 4) if stats["chars_in"] else 0.0
+    stats["avg_ms"] = round(stats["seconds"] * 1000 / stats["requests"], 2) if stats["requests"] else 0.0
+    stats["seconds"] = round(stats["seconds"], 3)
+    return stats
@@ -0,0 +1,211 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    from config.performance import RETRIEVAL_MAX_WORKERS, SHARD_LOAD_MAX_WORKERS
+except ImportError:
+    RETRIEVAL_MAX_WORKERS = 8
+    SHARD_LOAD_MAX_WORKERS = 16
+
+SLOW_SHARD_LOG_MS = 500
+
+
+class _FanoutPool:
+    """
+    Executor của một loại tác vụ fan-out, kèm số tác vụ đang chờ/chạy. Tác vụ cùng tên có thể
+    dùng chung (``coalesce``): request sau chờ kết quả của tác vụ đang chạy thay vì chiếm thêm thread.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"shard-{name}")
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.inflight: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"queued": 0, "running": 0, "abandoned": 0, "submitted": 0, "coalesced": 0, "cancelled": 0}
+
+    def submit(self, name: str, fn: Callable[[], Any], coalesce: bool = False) -> Dict[str, Any]:
+        with self.lock:
+            task = self.inflight.get(name) if coalesce else None
+            if task is not None:
+                task["waiters"] += 1
+                self.stats["coalesced"] += 1
+                return task
+            task = {"started": None, "waiters": 1, "finished": False, "abandoned": False}
+            self.stats["queued"] += 1
+            self.stats["submitted"] += 1
+            task["future"] = self.executor.submit(self._run, task, fn)
+            if coalesce:
+                self.inflight[name] = task
+        task["future"].add_done_callback(lambda _: self._done(name, task))
+        return task
+
+    def _run(self, task: Dict[str, Any], fn: Callable[[], Any]):
+        with self.lock:
+            self.stats["queued"] -= 1
+            self.stats["running"] += 1
+            task["started"] = time.time()
+        try:
+            return fn()
+        finally:
+            with self.lock:
+                self.stats["running"] -= 1
+                task["finished"] = True
+                if task["abandoned"]:
+                    self.stats["abandoned"] -= 1
+
+    def _done(self, name: str, task: Dict[str, Any]):
+        with self.lock:
+            if self.inflight.get(name) is task:
+                del self.inflight[name]
+            if task["future"].cancelled():
+                self.stats["queued"] -= 1
+                self.stats["cancelled"] += 1
+
+    def release(self, task: Dict[str, Any]):
+        """A request stops waiting: a task nobody waits for is cancelled if it has not started yet"""
+        with self.lock:
+            task["waiters"] -= 1
+            if task["waiters"] > 0 or task["finished"]:
+                return
+            if task["started"] is not None:
+                # Running tasks cannot be interrupted; counted until they finish
+                task["abandoned"] = True
+                self.stats["abandoned"] += 1
+        task["future"].cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["inflight_shared"] = len(self.inflight)
+        stats["max_workers"] = self.max_workers
+        return stats
+
+
+# Loads (S3 download, disk read) get their own pool: a few slow shards that outlive their
+# timeout keep a load thread busy but never hold back the search stage of other requests
+_pools = {
+    "search": _FanoutPool("search", RETRIEVAL_MAX_WORKERS),
+    "load": _FanoutPool("load", SHARD_LOAD_MAX_WORKERS),
+}
+
+_latency_lock = threading.Lock()
+_latency_stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+
+def _record(stage: str, shard: str, elapsed_ms: float = None, outcome: str = "ok"):
+    with _latency_lock:
+        shard_stats = _latency_stats.setdefault(stage, {}).setdefault(shard, {
+            "count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0, "timeouts": 0, "errors": 0
+        })
+        if outcome == "timeout":
+            shard_stats["timeouts"] += 1
+            return
+        if outcome == "error":
+            shard_stats["errors"] += 1
+        shard_stats["count"] += 1
+        shard_stats["total_ms"] += elapsed_ms
+        shard_stats["last_ms"] = elapsed_ms
+        shard_stats["max_ms"] = max(shard_stats["max_ms"], elapsed_ms)
+
+
+def run_with_deadlines(
+    stage: str,
+    tasks: List[Tuple[str, Callable[[], Any]]],
+    shard_timeout: float,
+    deadline: float,
+    pool: str = "search",
+    coalesce: bool = False
+) -> Dict[str, Any]:
+    """
+    Chạy song song các tác vụ theo shard với timeout riêng cho từng shard và deadline chung.
+
+    Mỗi phần tử của ``tasks`` là (shard_name, callable). Trả về dict shard_name -> kết quả
+    chỉ cho các shard hoàn thành kịp thời gian và không lỗi; shard chậm hoặc lỗi bị bỏ qua.
+    Timeout của một shard được tính từ lúc nó thực sự bắt đầu chạy, không phải lúc xếp hàng.
+    ``pool`` chọn executor ("search" hoặc "load"); ``coalesce`` cho các request dùng chung tác vụ
+    cùng shard đang chạy (chỉ dùng khi kết quả không phụ thuộc request, ví dụ nạp index).
+    """
+    if not tasks:
+        return {}
+
+    executor = _pools[pool]
+    t0 = time.time()
+    global_deadline = t0 + deadline
+    handles = {name: executor.submit(name, fn, coalesce) for name, fn in tasks}
+    futures = {handle["future"]: name for name, handle in handles.items()}
+    pending = set(futures)
+    results: Dict[str, Any] = {}
+
+    while pending:
+        now = time.time()
+        if now >= global_deadline:
+            break
+        done, pending = wait(pending, timeout=min(0.05, global_deadline - now), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            name = futures[future]
+            elapsed_ms = (time.time() - (handles[name]["started"] or t0)) * 1000
+            executor.release(handles[name])
+            try:
+                results[name] = future.result()
+                _record(stage, name, elapsed_ms)
+                if elapsed_ms > SLOW_SHARD_LOG_MS:
+                    print(f"[WARNING] Slow shard in {stage}: {name} took {elapsed_ms:.0f}ms")
+            except Exception as e:
+                _record(stage, name, elapsed_ms, outcome="error")
+                print(f"[ERROR] Shard {name} failed in {stage}: {e}")
+
+        now = time.time()
+        for future in list(pending):
+            name = futures[future]
+            started = handles[name]["started"]
+            if started is not None and now - started > shard_timeout:
+                pending.discard(future)
+                executor.release(handles[name])
+                _record(stage, name, outcome="timeout")
+                print(f"[WARNING] Shard {name} exceeded {shard_timeout}s in {stage}, skipping")
+
+    for future in pending:
+        name = futures[future]
+        executor.release(handles[name])
+        _record(stage, name, outcome="timeout")
+        print(f"[WARNING] Deadline reached in {stage}, skipping shard {name}")
+
+    total_ms = (time.time() - t0) * 1000
+    print(f"[INFO] {stage}: {len(results)}/{len(tasks)} shards in {total_ms:.0f}ms")
+    return results
+
+
+def get_fanout_pool_stats() -> Dict[str, Any]:
+    """Số tác vụ đang chờ (queue depth), đang chạy và bị bỏ dở của từng pool fan-out"""
+    return {name: pool.get_stats() for name, pool in _pools.items()}
+
+
+def get_shard_latency_stats(stage: str = None) -> Dict[str, Any]:
+    """Per-shard latency summary (slowest first) for each fan-out stage"""
+    with _latency_lock:
+        snapshot = {
+            name: {shard: dict(stats) for shard, stats in shards.items()}
+            for name, shards in _latency_stats.items()
+            if stage is None or name == stage
+        }
+
+    report = {}
+    for name, shards in snapshot.items():
+        rows = []
+        for shard, stats in shards.items():
+            avg_ms = stats["total_ms"] / stats["count"] if stats["count"] else 0.0
+            rows.append({
+                "shard": shard,
+                "avg_ms": round(avg_ms, 2),
+                "max_ms": round(stats["max_ms"], 2),
+                "last_ms": round(stats["last_ms"], 2),
+                "count": stats["count"],
+                "timeouts": stats["timeouts"],
+                "errors": stats["errors"]
+            })
+        rows.sort(key=lambda row: row["avg_ms"], reverse=True)
+        report[name] = rows
+    return report
@@ -2,15 +2,29 @@ import os
 import json
 import time
 import re
-from typing import List, Dict, Any, Tuple
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
 
 from utils.admin.upload_s3_utils import s3_client, BUCKET_NAME, DATA_DIR, download_from_s3
+from utils.admin.corpus_index import CORPUS_INDEX_NAME, get_corpus_files, corpus_positions_for
+from utils.admin.index_cache import (
+    ensure_local_index, registry_index_hashes, registry_index_kinds, remove_local_index, record_local_index,
+    pin_local_index, LEXICAL_KINDS
+)
+from utils.admin.lexical_index import load_lexical_index
+from utils.admin.file_routing import question_topics, build_topic_files, build_summary_matrix, score_files
+from utils.admin.chunk_store import LazyFaissStore, load_lazy_store
+from utils.admin.faiss_io import load_faiss_store
+from utils.admin.index_builder import search_params_for, get_index_search_settings, reconstruct_vectors
+from utils.admin.token_utils import count_tokens
+from utils.user.shard_fanout import run_with_deadlines
 from utils.aws_client import bedrock_embeddings
 
-_registry_cache = None
-_cache_timestamp = 0
 CACHE_TTL = 60
 
 try:
@@ -20,66 +34,434 @@ except ImportError:
     FILE_LOADING_STRATEGY = "latest"
     SMART_LOADING_KEYWORDS = ["lương", "bảo hiểm", "nghỉ phép", "tuyển dụng"]
 
+try:
+    from config.performance import VECTOR_STORE_CACHE_SIZE, VECTOR_STORE_CACHE_MAX_BYTES
+except ImportError:
+    VECTOR_STORE_CACHE_SIZE = 32
+    VECTOR_STORE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+try:
+    from config.performance import USE_CORPUS_INDEX, CORPUS_FETCH_K_MULTIPLIER, CORPUS_REFRESH_INTERVAL
+except ImportError:
+    USE_CORPUS_INDEX = True
+    CORPUS_FETCH_K_MULTIPLIER = 4
+    CORPUS_REFRESH_INTERVAL = 300
+
+try:
+    from config.performance import SHARD_LOAD_TIMEOUT, SHARD_SEARCH_TIMEOUT, RETRIEVAL_DEADLINE
+except ImportError:
+    SHARD_LOAD_TIMEOUT = 5.0
+    SHARD_SEARCH_TIMEOUT = 2.0
+    RETRIEVAL_DEADLINE = 8.0
+
+try:
+    from config.performance import REGISTRY_VERSION_CHECK_INTERVAL
+except ImportError:
+    REGISTRY_VERSION_CHECK_INTERVAL = 5
+
+try:
+    from config.performance import MISSING_INDEX_MIN_TTL, MISSING_INDEX_TTL
+except ImportError:
+    MISSING_INDEX_MIN_TTL = 30
+    MISSING_INDEX_TTL = 300
+
+try:
+    from config.performance import CHUNK_STORE_ENABLED
+except ImportError:
+    CHUNK_STORE_ENABLED = True
+
+try:
+    from config.performance import HYBRID_RETRIEVAL_ENABLED, HYBRID_RRF_K, HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT
+except ImportError:
+    HYBRID_RETRIEVAL_ENABLED = True
+    HYBRID_RRF_K = 60
+    HYBRID_VECTOR_WEIGHT = 1.0
+    HYBRID_LEXICAL_WEIGHT = 1.0
+
+try:
+    from config.performance import MULTI_QUERY_ENABLED, MULTI_QUERY_SECONDARY_WEIGHT
+except ImportError:
+    MULTI_QUERY_ENABLED = True
+    MULTI_QUERY_SECONDARY_WEIGHT = 0.5
+
+try:
+    from config.performance import ROUTING_ENABLED
+except ImportError:
+    ROUTING_ENABLED = True
+
+try:
+    from config.performance import FILE_PRUNING_ENABLED, FILE_PRUNING_TOP_M
+except ImportError:
+    FILE_PRUNING_ENABLED = True
+    FILE_PRUNING_TOP_M = 8
+
+try:
+    from config.performance import CONTEXT_TOKEN_BUDGETS, CONTEXT_DEFAULT_TOKEN_BUDGET, CONTEXT_MIN_PARTIAL_TOKENS
+except ImportError:
+    CONTEXT_TOKEN_BUDGETS = {}
+    CONTEXT_DEFAULT_TOKEN_BUDGET = 3000
+    CONTEXT_MIN_PARTIAL_TOKENS = 60
+
+# etags: S3 ETags of the corpus .faiss/.pkl this process last downloaded in a background refresh
+_corpus_state = {"loaded_at": 0.0, "retry_after": 0.0, "stale": False, "refreshing": False, "etags": None}
+
+_vector_store_cache = OrderedDict()
+_vector_store_cache_lock = threading.RLock()
+_vector_store_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "bytes": 0}
+
+# (unique_filename, kind) -> why the index could not be served, until when it is not retried
+_missing_indexes_lock = threading.Lock()
+_missing_indexes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_missing_index_stats = {"recorded": 0, "skipped": 0, "retries": 0}
+
+_context_stats_lock = threading.Lock()
+_context_stats = {"requests": 0, "tokens_used": 0, "tokens_dropped": 0, "chunks_packed": 0, "chunks_cut": 0,
+                  "chunks_dropped": 0}
+
+_pruning_stats_lock = threading.Lock()
+_pruning_stats = {"requests": 0, "candidates": 0, "kept": 0, "unscored": 0, "seconds": 0.0}
+
+_multi_query_stats_lock = threading.Lock()
+_multi_query_stats = {"requests": 0, "multi_variant_requests": 0, "variants": 0, "shard_searches": 0}
+
+_hybrid_stats_lock = threading.Lock()
+_hybrid_stats = {"queries": 0, "vector_hits": 0, "lexical_hits": 0, "lexical_only_docs": 0, "shards_without_lexical": 0}
+
+def _estimate_store_bytes(unique_filename: str, store=None) -> int:
+    """Estimate resident size of a loaded store from its on-disk index files"""
+    total = 0
+    # A chunk store only keeps its offsets resident; chunk text is paged in from disk on demand
+    extensions = (".faiss", ".chunks.idx") if isinstance(store, LazyFaissStore) else (".faiss", ".pkl")
+    if getattr(store, "lexical_index", None) is not None:
+        extensions += (".bm25",)
+    for ext in extensions:
+        path = os.path.join(DATA_DIR, f"{unique_filename}{ext}")
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+def _get_cached_vector_store(unique_filename: str):
+    with _vector_store_cache_lock:
+        entry = _vector_store_cache.get(unique_filename)
+        if entry is None:
+            _vector_store_cache_stats["misses"] += 1
+            return None
+        _vector_store_cache.move_to_end(unique_filename)
+        _vector_store_cache_stats["hits"] += 1
+        return entry[0]
+
+def _put_cached_vector_store(unique_filename: str, store, nbytes: int):
+    """Insert a store and evict least recently used entries over the count/byte budget"""
+    with _vector_store_cache_lock:
+        previous = _vector_store_cache.pop(unique_filename, None)
+        if previous is not None:
+            _vector_store_cache_stats["bytes"] -= previous[1]
+        _vector_store_cache[unique_filename] = (store, nbytes)
+        _vector_store_cache_stats["bytes"] += nbytes
+
+        while len(_vector_store_cache) > 1 and (
+            len(_vector_store_cache) > VECTOR_STORE_CACHE_SIZE
+            or _vector_store_cache_stats["bytes"] > VECTOR_STORE_CACHE_MAX_BYTES
+        ):
+            evicted_name, (_, evicted_bytes) = _vector_store_cache.popitem(last=False)
+            _vector_store_cache_stats["bytes"] -= evicted_bytes
+            _vector_store_cache_stats["evictions"] += 1
+            print(f"[INFO] Evicted vector store from cache: {evicted_name}")
+
+def invalidate_vector_store_cache(unique_filename: str = None):
+    """Drop one cached store (or all of them when unique_filename is None)"""
+    forget_missing_index(unique_filename)
+    with _vector_store_cache_lock:
+        if unique_filename is None:
+            removed = len(_vector_store_cache)
+            _vector_store_cache.clear()
+            _vector_store_cache_stats["bytes"] = 0
+        else:
+            entry = _vector_store_cache.pop(unique_filename, None)
+            removed = 0
+            if entry is not None:
+                _vector_store_cache_stats["bytes"] -= entry[1]
+                removed = 1
+        _vector_store_cache_stats["invalidations"] += removed
+
+class EmptyVectorStore:
+    """Store rỗng dùng chung khi không nạp được shard nào: không có index, mọi truy vấn trả về rỗng"""
+
+    index = None
+    lexical_index = None
+    embedding_function = None
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, **kwargs):
+        return []
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs):
+        return []
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        return []
+
+    def iter_documents(self):
+        return iter(())
+
+EMPTY_VECTOR_STORE = EmptyVectorStore()
+EMPTY_STORE_NAME = "empty"
+
+def _entry_signature(file_info: Dict[str, Any]) -> Tuple:
+    return (file_info.get('storage_format'),) + tuple(sorted(registry_index_hashes(file_info).items()))
+
+def _index_signature(unique_filename: str) -> Tuple:
+    """What the registry currently expects for a file; a miss is retried as soon as this changes"""
+    return _entry_signature(_registry_file_info(unique_filename))
+
+def _known_missing(unique_filename: str, kind: str = "index") -> Optional[Dict[str, Any]]:
+    """The negative cache entry of an index that failed recently, or None if it should be tried"""
+    with _missing_indexes_lock:
+        entry = _missing_indexes.get((unique_filename, kind))
+        if entry is None:
+            return None
+        if entry["signature"] != _index_signature(unique_filename):
+            # Re-uploaded or re-indexed since the failure
+            del _missing_indexes[(unique_filename, kind)]
+            return None
+        if time.time() >= entry["retry_at"]:
+            # Kept until the retry succeeds, so repeated failures keep backing off
+            _missing_index_stats["retries"] += 1
+            return None
+        entry["skipped"] += 1
+        _missing_index_stats["skipped"] += 1
+        return entry
+
+def _remember_missing(unique_filename: str, reason: str, kind: str = "index"):
+    now = time.time()
+    with _missing_indexes_lock:
+        entry = _missing_indexes.setdefault((unique_filename, kind), {
+            "first_seen": now, "failures": 0, "skipped": 0
+        })
+        entry["failures"] += 1
+        # S3 errors are not told apart from missing keys, so a first miss is retried soon and the
+        # delay doubles up to MISSING_INDEX_TTL while the index keeps failing
+        ttl = min(MISSING_INDEX_TTL, MISSING_INDEX_MIN_TTL * 2 ** (entry["failures"] - 1))
+        entry.update(reason=reason, last_failure=now, retry_at=now + ttl,
+                     signature=_index_signature(unique_filename))
+        _missing_index_stats["recorded"] += 1
+    print(f"[WARNING] {kind} of {unique_filename} unavailable ({reason}), not retried for {ttl}s")
+
+def forget_missing_index(unique_filename: str = None, kind: str = None):
+    """Retry an index (or every index when unique_filename is None) on its next request"""
+    with _missing_indexes_lock:
+        if unique_filename is None:
+            _missing_indexes.clear()
+            return
+        for key in [key for key in _missing_indexes if key[0] == unique_filename and kind in (None, key[1])]:
+            del _missing_indexes[key]
+
+def get_missing_index_stats() -> Dict[str, Any]:
+    """Các index đang bị bỏ qua vì thiếu hoặc hỏng (cache âm của process này)"""
+    now = time.time()
+    with _missing_indexes_lock:
+        stats = dict(_missing_index_stats)
+        entries = [dict(entry, unique_filename=name, kind=kind) for (name, kind), entry in _missing_indexes.items()]
+    missing = []
+    for entry in sorted(entries, key=lambda e: -e["last_failure"]):
+        missing.append({
+            "unique_filename": entry["unique_filename"],
+            "original_filename": _registry_file_info(entry["unique_filename"]).get('original_filename'),
+            "kind": entry["kind"],
+            "reason": entry["reason"],
+            "failures": entry["failures"],
+            "requests_skipped": entry["skipped"],
+            "first_seen": datetime.fromtimestamp(entry["first_seen"]).isoformat(timespec="seconds"),
+            "retry_in_s": max(0, round(entry["retry_at"] - now))
+        })
+    stats["min_ttl"] = MISSING_INDEX_MIN_TTL
+    stats["max_ttl"] = MISSING_INDEX_TTL
+    stats["missing"] = missing
+    return stats
+
+def get_vector_store_cache_stats() -> Dict[str, Any]:
+    """Return hit/miss/eviction counters and current size of the vector store cache"""
+    with _vector_store_cache_lock:
+        stats = dict(_vector_store_cache_stats)
+        stats["entries"] = len(_vector_store_cache)
+        stats["max_entries"] = VECTOR_STORE_CACHE_SIZE
+        stats["max_bytes"] = VECTOR_STORE_CACHE_MAX_BYTES
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    return stats
+
+REGISTRY_KEY = "faiss_indexes/file_registry.json"
+
+_registry_lock = threading.Lock()
+_registry_state = {
+    "registry": None,
+    "views": None,
+    "etag": None,
+    "checked_at": 0.0,
+    "version": 0,
+    "db_version": None,
+    "db_checked_at": 0.0,
+    "force_revalidate": False,
+    "refreshing": False
+}
+
 def clear_registry_cache():
-    """Clear registry cache để force reload"""
-    global _registry_cache, _cache_timestamp
-    _registry_cache = None
-    _cache_timestamp = 0
-    print("[INFO] Registry cache cleared - will reload from S3 on next request")
+    """Force a synchronous revalidation of the registry on the next request"""
+    with _registry_lock:
+        _registry_state["force_revalidate"] = True
+    print("[INFO] Registry cache marked stale - will revalidate on next request")
 
-def get_file_registry():
-    """Get file registry with S3 fallback and caching"""
-    global _registry_cache, _cache_timestamp
-    
-    current_time = time.time()
-    
-    if _registry_cache and (current_time - _cache_timestamp) < CACHE_TTL:
-        print(f"[INFO] Using cached registry: {len(_registry_cache.get('files', []))} files")
-        return _registry_cache
-    
-    registry_key = "faiss_indexes/file_registry.json"
-    
+def _build_registry_views(registry: Dict[str, Any]) -> Dict[str, Any]:
+    """Precompute derived views once per registry version"""
+    files = registry.get("files", [])
+    keyword_files = {}
+    for keyword in SMART_LOADING_KEYWORDS:
+        keyword_files[keyword] = [
+            f for f in files if keyword in f.get('original_filename', '').lower()
+        ]
+    return {
+        "files": files,
+        "files_by_timestamp": sorted(files, key=lambda x: x.get('timestamp', 0), reverse=True),
+        "by_unique_filename": {f.get('unique_filename'): f for f in files},
+        "keyword_files": keyword_files,
+        **build_topic_files(files),
+        **build_summary_matrix(registry.get("summaries") or {})
+    }
+
+def _install_registry(registry: Dict[str, Any], etag: Optional[str]):
+    views = _build_registry_views(registry)
+    with _registry_lock:
+        previous = (_registry_state["views"] or {}).get("by_unique_filename", {})
+        _registry_state["registry"] = registry
+        _registry_state["views"] = views
+        _registry_state["etag"] = etag
+        _registry_state["version"] += 1
+
+    # Files deleted or re-indexed (possibly by another worker) must not be served from the store cache
+    current = views["by_unique_filename"]
+    changed = [
+        unique_filename for unique_filename, file_info in previous.items()
+        if unique_filename not in current or _entry_signature(file_info) != _entry_signature(current[unique_filename])
+    ]
+    for unique_filename in changed:
+        invalidate_vector_store_cache(unique_filename)
+    if changed:
+        print(f"[INFO] Dropped {len(changed)} cached stores changed since the previous registry")
+
+def _load_local_registry() -> Dict[str, Any]:
+    local_registry_path = REGISTRY_KEY
     try:
-        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=registry_key)
+        if os.path.exists(local_registry_path):
+            with open(local_registry_path, 'r', encoding='utf-8') as f:
+                registry = json.load(f)
+            print(f"[INFO] Loaded registry from local: {len(registry.get('files', []))} files")
+            return registry
+        print("[INFO] No local registry found, creating empty one")
+    except Exception as local_e:
+        print(f"[ERROR] Local registry load failed: {local_e}")
+    return {"files": []}
+
+def _revalidate_registry():
+    """Conditional GET of the registry; the body is parsed only when the ETag changed"""
+    etag = _registry_state["etag"]
+    request = {"Bucket": BUCKET_NAME, "Key": REGISTRY_KEY}
+    if etag and _registry_state["registry"] is not None:
+        request["IfNoneMatch"] = etag
+
+    try:
+        response = s3_client.get_object(**request)
         registry = json.loads(response['Body'].read().decode('utf-8'))
+        _install_registry(registry, response.get('ETag'))
         print(f"[INFO] Loaded registry from S3: {len(registry.get('files', []))} files")
-        
-        _registry_cache = registry
-        _cache_timestamp = current_time
-        
-        return registry
     except Exception as e:
-        
-        local_registry_path = "faiss_indexes/file_registry.json"
-        try:
-            if os.path.exists(local_registry_path):
-                with open(local_registry_path, 'r', encoding='utf-8') as f:
-                    registry = json.load(f)
-                print(f"[INFO] Loaded registry from local: {len(registry.get('files', []))} files")
-                
-                _registry_cache = registry
-                _cache_timestamp = current_time
-                
-                return registry
-            else:
-                print("[INFO] No local registry found, creating empty one")
-                empty_registry = {"files": []}
-                _registry_cache = empty_registry
-                _cache_timestamp = current_time
-                return empty_registry
-        except Exception as local_e:
-            print(f"[ERROR] Local registry load failed: {local_e}")
-            empty_registry = {"files": []}
-            _registry_cache = empty_registry
-            _cache_timestamp = current_time
-            return empty_registry
+        error_code = getattr(e, "response", {}).get("Error", {}).get("Code")
+        if error_code in ("304", "NotModified"):
+            pass
+        elif _registry_state["registry"] is None:
+            _install_registry(_load_local_registry(), None)
+        else:
+            print(f"[WARNING] Registry revalidation failed, keeping cached copy: {e}")
+    finally:
+        with _registry_lock:
+            _registry_state["checked_at"] = time.time()
+            _registry_state["refreshing"] = False
+
+def _revalidate_registry_in_background():
+    with _registry_lock:
+        if _registry_state["refreshing"]:
+            return
+        _registry_state["refreshing"] = True
+    threading.Thread(target=_revalidate_registry, name="registry-revalidate", daemon=True).start()
+
+def _refresh_registry_from_db(force: bool = False) -> bool:
+    """
+    Check the registry version row and reload the table only when it changed.
+    Returns False when the database is unavailable so callers can fall back to S3.
+    """
+    try:
+        from utils.admin.file_registry import get_registry_version, load_registry_snapshot
+        version = get_registry_version()
+        if version == 0:
+            # Table never written (legacy registry not imported yet): serve the S3 registry instead
+            return False
+        if not force and version == _registry_state["db_version"] and _registry_state["registry"] is not None:
+            return True
+
+        version, registry = load_registry_snapshot()
+        previous_version = _registry_state["db_version"]
+        _install_registry(registry, None)
+        with _registry_lock:
+            _registry_state["db_version"] = version
+        if previous_version is not None and version != previous_version:
+            # The corpus index is edited together with the registry; revalidated against S3 on next use
+            _corpus_state["stale"] = True
+        print(f"[INFO] Loaded registry version {version} from database: {len(registry['files'])} files")
+        return True
+    except Exception as e:
+        print(f"[WARNING] Registry table unavailable, falling back to S3: {e}")
+        return False
+    finally:
+        with _registry_lock:
+            _registry_state["db_checked_at"] = time.time()
+
+def _ensure_registry():
+    """Version check against the database; stale-while-revalidate on the legacy S3 registry otherwise"""
+    with _registry_lock:
+        has_registry = _registry_state["registry"] is not None
+        force = _registry_state["force_revalidate"]
+        _registry_state["force_revalidate"] = False
+        expired = time.time() - _registry_state["checked_at"] >= CACHE_TTL
+        db_due = time.time() - _registry_state["db_checked_at"] >= REGISTRY_VERSION_CHECK_INTERVAL
+
+    if (not has_registry or force or db_due) and _refresh_registry_from_db(force=force):
+        return
+    if has_registry and _registry_state["db_version"] is not None:
+        # Registry comes from the database; the throttled version check above keeps it fresh
+        return
+
+    if not has_registry or force:
+        with _registry_lock:
+            _registry_state["refreshing"] = True
+        _revalidate_registry()
+    elif expired:
+        _revalidate_registry_in_background()
+
+def get_file_registry():
+    """Get file registry from the database, with S3 fallback, ETag revalidation and caching"""
+    _ensure_registry()
+    return _registry_state["registry"]
+
+def get_registry_views() -> Dict[str, Any]:
+    """Derived registry views (files sorted by timestamp, keyword -> files) for the current version"""
+    _ensure_registry()
+    return _registry_state["views"]
 
 def get_latest_n_files(n: int) -> List[Dict[str, Any]]:
     """Get latest files with fallback"""
-    registry = get_file_registry()
-    files = registry.get("files", [])
+    sorted_files = get_registry_views()["files_by_timestamp"]
     
-    if not files:
+    if not sorted_files:
         print("[WARNING] No files in registry, using sample data")
         return [{
             'unique_filename': 'sample_file',
@@ -87,51 +469,200 @@ def get_latest_n_files(n: int) -> List[Dict[str, Any]]:
             'timestamp': time.time()
         }]
     
-    sorted_files = sorted(files, key=lambda x: x.get('timestamp', 0), reverse=True)
     result = sorted_files[:n]
     
     print(f"[INFO] Loaded {len(result)} latest files from registry")
     return result
 
 def load_faiss_index(unique_filename: str, embeddings) -> FAISS:
-    """Load FAISS index with fallback"""
+    """Load FAISS index with fallback, served from the process-wide cache when possible"""
+    cached = _get_cached_vector_store(unique_filename)
+    if cached is not None:
+        return cached
+    if _known_missing(unique_filename):
+        return None
+
+    # Pinned from validation to the end of the load so a concurrent quota sweep cannot evict the files
+    with pin_local_index(unique_filename):
+        index = _load_faiss_index_uncached(unique_filename, embeddings)
+        if index is not None:
+            _attach_lexical_index(unique_filename, index)
+    if index is not None:
+        forget_missing_index(unique_filename, "index")
+        _put_cached_vector_store(unique_filename, index, _estimate_store_bytes(unique_filename, index))
+    return index
+
+def _registry_file_info(unique_filename: str) -> Dict[str, Any]:
+    # Read the installed views directly: this runs on fan-out threads without an app context
+    views = _registry_state["views"] or {}
+    return views.get("by_unique_filename", {}).get(unique_filename) or {}
+
+def _load_faiss_index_uncached(unique_filename: str, embeddings) -> FAISS:
     try:
-        local_faiss_path = os.path.join(DATA_DIR, f"{unique_filename}.faiss")
-        local_pkl_path = os.path.join(DATA_DIR, f"{unique_filename}.pkl")
-        
-        if os.path.exists(local_faiss_path) and os.path.exists(local_pkl_path):
-            index = FAISS.load_local(
-                index_name=unique_filename,
-                folder_path=DATA_DIR,
-                embeddings=embeddings,
-                allow_dangerous_deserialization=True
-            )
-            print(f"[INFO] Loaded FAISS index from local: {unique_filename}")
-            return index
-        
-        if download_from_s3(unique_filename):
-            index = FAISS.load_local(
-                index_name=unique_filename,
-                folder_path=DATA_DIR,
-                embeddings=embeddings,
-                allow_dangerous_deserialization=True
-            )
-            return index
-        else:
+        file_info = _registry_file_info(unique_filename)
+        expected_hashes = registry_index_hashes(file_info)
+        kinds = registry_index_kinds(file_info)
+
+        if CHUNK_STORE_ENABLED and "chunks.bin" in kinds:
+            if ensure_local_index(unique_filename, expected_hashes, kinds):
+                try:
+                    index = load_lazy_store(unique_filename, embeddings)
+                    print(f"[INFO] Loaded FAISS index with chunk store: {unique_filename}")
+                    return index
+                except Exception as e:
+                    print(f"[WARNING] Chunk store of {unique_filename} unusable, loading pickle: {e}")
+
+        if not ensure_local_index(unique_filename, expected_hashes):
+            _remember_missing(unique_filename, "not on S3 or hash mismatch")
             return None
+
+        index = load_faiss_store(unique_filename, embeddings, DATA_DIR)
+        print(f"[INFO] Loaded FAISS index from local cache: {unique_filename}")
+        return index
         
     except Exception as e:
         print(f"[ERROR] Cannot load FAISS {unique_filename}: {e}")
+        _remember_missing(unique_filename, f"unreadable: {e}")
         return None
 
+def _attach_lexical_index(unique_filename: str, store):
+    """Gắn BM25 sidecar vào store nếu có; không có thì shard này chỉ được tìm bằng vector"""
+    store.lexical_index = None
+    if not HYBRID_RETRIEVAL_ENABLED or _known_missing(unique_filename, "bm25"):
+        return
+    try:
+        if not ensure_local_index(unique_filename, None, LEXICAL_KINDS):
+            _remember_missing(unique_filename, "no lexical sidecar on S3", "bm25")
+            return
+        lexical_index = load_lexical_index(unique_filename)
+        if len(lexical_index) != store.index.ntotal:
+            print(f"[WARNING] Lexical index of {unique_filename} is stale "
+                  f"({len(lexical_index)} docs, {store.index.ntotal} vectors), using vector search only")
+            return
+        forget_missing_index(unique_filename, "bm25")
+        store.lexical_index = lexical_index
+    except Exception as e:
+        print(f"[WARNING] Cannot load lexical index of {unique_filename}: {e}")
+
+def _load_corpus_index(embeddings):
+    """Load the merged corpus index (the cached copy when present; refreshes happen in the background)"""
+    now = time.time()
+    if now < _corpus_state["retry_after"]:
+        return None
+
+    corpus = load_faiss_index(CORPUS_INDEX_NAME, embeddings)
+    if corpus is None:
+        _corpus_state["retry_after"] = now + CORPUS_REFRESH_INTERVAL
+        return None
+    if not _corpus_state["loaded_at"]:
+        _corpus_state["loaded_at"] = now
+    return corpus
+
+def _refresh_corpus_index(embeddings):
+    """
+    Tải lại corpus index nếu object trên S3 đã đổi (so ETag), rồi thay vào cache.
+    File local được thay bằng os.replace nên request đang dùng bản cũ không bị ảnh hưởng.
+    """
+    try:
+        etags = {
+            ext: s3_client.head_object(Bucket=BUCKET_NAME, Key=f"faiss_indexes/{CORPUS_INDEX_NAME}{ext}").get("ETag")
+            for ext in (".faiss", ".pkl")
+        }
+        if etags == _corpus_state["etags"]:
+            _corpus_state["loaded_at"] = time.time()
+            return
+        with pin_local_index(CORPUS_INDEX_NAME):
+            if not download_from_s3(CORPUS_INDEX_NAME):
+                print("[WARNING] Corpus index refresh failed, keeping the loaded copy")
+                return
+            # The BM25 sidecar has to match the new vectors: fetched again on attach
+            remove_local_index(CORPUS_INDEX_NAME, kinds=LEXICAL_KINDS)
+            record_local_index(CORPUS_INDEX_NAME)
+
+            corpus = _load_faiss_index_uncached(CORPUS_INDEX_NAME, embeddings)
+            if corpus is None:
+                return
+            _attach_lexical_index(CORPUS_INDEX_NAME, corpus)
+        _put_cached_vector_store(CORPUS_INDEX_NAME, corpus, _estimate_store_bytes(CORPUS_INDEX_NAME, corpus))
+        _corpus_state.update(etags=etags, loaded_at=time.time(), retry_after=0.0)
+        print(f"[INFO] Corpus index refreshed: {corpus.index.ntotal} vectors")
+    except Exception as e:
+        print(f"[WARNING] Corpus index refresh failed: {e}")
+    finally:
+        _corpus_state["refreshing"] = False
+
+def _refresh_corpus_in_background(embeddings):
+    with _registry_lock:
+        if _corpus_state["refreshing"]:
+            return
+        _corpus_state["refreshing"] = True
+        _corpus_state["stale"] = False
+    threading.Thread(target=_refresh_corpus_index, args=(embeddings,), name="corpus-refresh", daemon=True).start()
+
+def _load_corpus_entry(selected_files: List[Dict[str, Any]], embeddings):
+    """
+    Split selected files into those covered by the corpus index and those that still
+    need their own shard. Returns (corpus_entry or None, remaining_files).
+    """
+    try:
+        corpus = _load_corpus_index(embeddings)
+        if corpus is None:
+            return None, selected_files
+
+        # Stale-while-revalidate: this request uses the loaded corpus (uncovered files are served
+        # by their own shards) while a changed corpus is fetched in the background
+        corpus_files = get_corpus_files(corpus)
+        uncovered = [f for f in selected_files if f['unique_filename'] not in corpus_files]
+        if _corpus_state["stale"] or (uncovered and time.time() - _corpus_state["loaded_at"] > CORPUS_REFRESH_INTERVAL):
+            _refresh_corpus_in_background(embeddings)
+
+        covered = {f['unique_filename'] for f in selected_files if f['unique_filename'] in corpus_files}
+        remaining = [f for f in selected_files if f['unique_filename'] not in covered]
+        if not covered:
+            return None, selected_files
+
+        # Restrict the search to the selected files' chunks, so a narrow selection in a large corpus
+        # still gets k hits instead of a top-k*multiplier that is mostly filtered away
+        allowed_ids = None
+        if len(covered) < len(corpus_files):
+            allowed_ids = corpus_positions_for(corpus, covered)
+        return {
+            'vectorstore': corpus,
+            'filename': CORPUS_INDEX_NAME,
+            'unique_filename': CORPUS_INDEX_NAME,
+            'is_corpus': True,
+            'allowed_files': covered,
+            'allowed_ids': allowed_ids
+        }, remaining
+    except Exception as e:
+        print(f"[ERROR] Cannot use corpus index: {e}")
+        return None, selected_files
+
 def load_multiple_vector_stores(selected_files: List[Dict[str, Any]], embeddings) -> List[Dict[str, Any]]:
-    """Load vector stores with fallback"""
+    """Load vector stores with fallback.
+
+    Files already merged into the corpus index are served by a single corpus
+    entry; only files missing from it are loaded as individual shards.
+    """
     vector_stores = []
     
+    if USE_CORPUS_INDEX and selected_files:
+        corpus_entry, selected_files = _load_corpus_entry(selected_files, embeddings)
+        if corpus_entry:
+            vector_stores.append(corpus_entry)
+            print(f"[INFO] Corpus index covers {len(corpus_entry['allowed_files'])} files")
+    
+    load_tasks = [
+        (file_info['unique_filename'], lambda name=file_info['unique_filename']: load_faiss_index(name, embeddings))
+        for file_info in selected_files
+    ]
+    # Concurrent requests for the same shard share one load on the dedicated load pool
+    loaded = run_with_deadlines("load_vector_stores", load_tasks, SHARD_LOAD_TIMEOUT, RETRIEVAL_DEADLINE,
+                                pool="load", coalesce=True)
     
     for file_info in selected_files:
         unique_filename = file_info['unique_filename']
-        faiss_index = load_faiss_index(unique_filename, embeddings)
+        faiss_index = loaded.get(unique_filename)
         
         if faiss_index:
             vector_stores.append({
@@ -146,17 +677,13 @@ def load_multiple_vector_stores(selected_files: List[Dict[str, Any]], embeddings
     
     if not vector_stores:
         print("[WARNING] No vector stores loaded - this is normal for first run")
-        try:
-            dummy_docs = [Document(page_content="Sample document for testing", metadata={})]
-            dummy_store = FAISS.from_documents(dummy_docs, embeddings)
-            vector_stores.append({
-                'vectorstore': dummy_store,
-                'filename': 'dummy.pdf',
-                'unique_filename': 'dummy'
-            })
-            print("[INFO] Created dummy vector store for testing")
-        except Exception as e:
-            print(f"[ERROR] Failed to create dummy store: {e}")
+        # Shared placeholder: no embedding call, and retrieval skips it without embedding the question
+        vector_stores.append({
+            'vectorstore': EMPTY_VECTOR_STORE,
+            'filename': EMPTY_STORE_NAME,
+            'unique_filename': EMPTY_STORE_NAME,
+            'is_empty': True
+        })
     
     return vector_stores
 
@@ -177,49 +704,480 @@ def find_accurate_section(page_content: str) -> str:
     
     return first_line[:100] if first_line else "Unknown"
 
-def retrieve_relevant_docs(vector_stores: List[Dict[str, Any]], question: str, k: int) -> List:
-    """Retrieve relevant documents with similarity scores"""
-    all_docs_with_scores = []
-    
-    for vs_info in vector_stores:
+def embed_question(question: str, embeddings=None) -> List[float]:
+    """Embed the question once so every vector store can be searched by vector"""
+    embeddings = embeddings or bedrock_embeddings
+    return embeddings.embed_query(question)
+
+def embed_questions(questions: List[str], embeddings=None) -> List[List[float]]:
+    """
+    Embed every query variant in one embed_documents call. CachedEmbeddings shares its cache
+    with embed_query, so variants seen before are not sent to Bedrock again.
+    """
+    embeddings = embeddings or bedrock_embeddings
+    return embeddings.embed_documents(list(questions))
+
+def _store_embeddings(store):
+    """Return the Embeddings object a store was loaded with, defaulting to Bedrock"""
+    embedding_function = getattr(store, "embedding_function", None)
+    if hasattr(embedding_function, "embed_query"):
+        return embedding_function
+    return bedrock_embeddings
+
+def _search_store_by_vector(store, query_embedding: List[float], k: int,
+                            search_settings: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float, int]]:
+    """Search one store with a precomputed query vector, returning (doc, score, vector_id)"""
+    return _search_store_by_vectors(store, [query_embedding], k, search_settings)[0]
+
+def _search_store_by_vectors(store, query_embeddings: List[List[float]], k: int,
+                             search_settings: Optional[Dict[str, Any]] = None,
+                             allowed_ids: Optional[np.ndarray] = None) -> List[List[Tuple[Document, float, int]]]:
+    """
+    Search one store with an (nq, d) query matrix in a single index.search call; one result
+    list of (doc, score, vector_id) per query. A chunk hit by several queries is decoded once.
+    ``allowed_ids`` limits the search to those vector ids (faiss IDSelector).
+    """
+    index = getattr(store, "index", None)
+    get_document = getattr(store, "get_document", None)
+    if index is None or (get_document is None and not hasattr(store, "index_to_docstore_id")):
+        return [
+            [(doc, score, -1) for doc, score in store.similarity_search_with_score_by_vector(query_embedding, k=k)]
+            for query_embedding in query_embeddings
+        ]
+
+    vectors = np.asarray(query_embeddings, dtype=np.float32)
+    if vectors.shape[1] != index.d:
+        raise ValueError(f"Query has {vectors.shape[1]} dimensions but index has {index.d}; "
+                         f"re-encode indexes after changing EMBEDDING_DIMENSIONS")
+    if getattr(store, "_normalize_L2", False):
+        import faiss
+        vectors = np.ascontiguousarray(vectors)
+        faiss.normalize_L2(vectors)
+
+    selector = None
+    if allowed_ids is not None:
+        if not len(allowed_ids):
+            return [[] for _ in query_embeddings]
+        import faiss
+        selector = faiss.IDSelectorBatch(allowed_ids)
+        k = min(k, len(allowed_ids))
+    params = search_params_for(index, search_settings, selector)
+    scores, indices = index.search(vectors, min(k, index.ntotal) or 1, params=params)
+    documents: Dict[int, Any] = {}
+    results = []
+    for query_scores, query_indices in zip(scores, indices):
+        hits = []
+        for score, vector_id in zip(query_scores, query_indices):
+            if vector_id == -1:
+                continue
+            vector_id = int(vector_id)
+            if vector_id not in documents:
+                documents[vector_id] = _document_by_vector_id(store, vector_id)
+            if isinstance(documents[vector_id], Document):
+                hits.append((documents[vector_id], float(score), vector_id))
+        results.append(hits)
+    return results
+
+def _document_by_vector_id(store, vector_id: int):
+    get_document = getattr(store, "get_document", None)
+    if get_document is not None:
+        # Only the hits are decoded from the chunk store
+        return get_document(vector_id)
+    return store.docstore.search(store.index_to_docstore_id[vector_id])
+
+def get_doc_vectors(docs: List[Document], vector_stores: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Vector của các chunk đọc lại từ index đã nạp (không gọi Bedrock); dòng NaN nếu không đọc được
+    (store không có index, vector_id = -1, hoặc index không reconstruct được).
+    """
+    stores = {vs_info['unique_filename']: vs_info['vectorstore'] for vs_info in vector_stores}
+    by_shard: Dict[str, List[int]] = {}
+    for position, doc in enumerate(docs):
+        if doc.metadata.get('vector_id', -1) != -1 and doc.metadata.get('shard') in stores:
+            by_shard.setdefault(doc.metadata['shard'], []).append(position)
+
+    dim = None
+    rows: Dict[int, np.ndarray] = {}
+    for shard, positions in by_shard.items():
+        index = getattr(stores[shard], "index", None)
+        if index is None:
+            continue
         try:
-            results = vs_info['vectorstore'].similarity_search_with_score(question, k=k)
-            
-            for doc, score in results:
-                doc.metadata['source_file'] = vs_info['filename']
-                doc.metadata['source'] = vs_info['filename']  
-                doc.metadata['similarity_score'] = score  
-                doc.metadata["section"] = find_accurate_section(doc.page_content)
-                all_docs_with_scores.append((doc, score))
-                
+            vectors = reconstruct_vectors(index, [docs[position].metadata['vector_id'] for position in positions])
         except Exception as e:
-            print(f"[ERROR] Error retrieving from {vs_info['filename']}: {e}")
-            continue 
-    all_docs_with_scores.sort(key=lambda x: x[1])
-    
-    docs = [doc for doc, score in all_docs_with_scores]
-    
-    return docs
+            print(f"[WARNING] Cannot read stored vectors of {shard}: {e}")
+            continue
+        dim = vectors.shape[1]
+        rows.update(zip(positions, vectors))
 
-def build_context(docs: List, question: str) -> str:
-    """Build context from documents"""
-    if not docs:
-        return ""
-    
-    context_parts = []
+    result = np.full((len(docs), dim or 1), np.nan, dtype=np.float32)
+    for position, vector in rows.items():
+        result[position] = vector
+    return result
+
+def _annotate_hit(vs_info: Dict[str, Any], doc: Document, vector_id: int) -> Optional[Document]:
+    """Annotated copy of a hit, or None when a corpus hit belongs to a file that was not selected"""
+    if vs_info.get('is_corpus', False):
+        unique_filename = doc.metadata.get('unique_filename')
+        if unique_filename not in vs_info['allowed_files']:
+            return None
+        filename = doc.metadata.get('source_file', unique_filename)
+    else:
+        unique_filename = vs_info['unique_filename']
+        filename = vs_info['filename']
+    # Cached stores share Document objects across requests, so never mutate them in place
+    doc = Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+    doc.metadata['source_file'] = filename
+    doc.metadata['source'] = filename
+    doc.metadata['vector_id'] = vector_id
+    doc.metadata['unique_filename'] = unique_filename
+    doc.metadata['shard'] = vs_info['unique_filename']
+    doc.metadata["section"] = find_accurate_section(doc.page_content)
+    return doc
+
+def _search_shard(vs_info: Dict[str, Any], query_embedding: List[float], k: int,
+                  search_settings: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+    """Search one loaded shard (or the corpus index) and annotate copies of the hits"""
+    return _search_shard_multi(vs_info, [query_embedding], k, search_settings)[0]
+
+def _search_shard_multi(vs_info: Dict[str, Any], query_embeddings: List[List[float]], k: int,
+                        search_settings: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+    """One batched search of a shard for every query vector; annotated hits per query"""
+    allowed_ids = vs_info.get('allowed_ids')
+    try:
+        results = _search_store_by_vectors(vs_info['vectorstore'], query_embeddings, k, search_settings, allowed_ids)
+    except RuntimeError as e:
+        if allowed_ids is None:
+            raise
+        # Index type without IDSelector support: over-fetch and drop other files' hits in _annotate_hit
+        print(f"[WARNING] Restricted search of {vs_info['unique_filename']} failed, filtering instead: {e}")
+        results = _search_store_by_vectors(vs_info['vectorstore'], query_embeddings,
+                                           k * CORPUS_FETCH_K_MULTIPLIER, search_settings)
+
+    rankings = []
+    for hits in results:
+        docs_with_scores = []
+        for doc, score, vector_id in hits:
+            doc = _annotate_hit(vs_info, doc, vector_id)
+            if doc is None:
+                continue
+            doc.metadata['similarity_score'] = score
+            docs_with_scores.append((doc, score))
+        rankings.append(docs_with_scores)
+    return rankings
+
+def _search_shard_lexical(vs_info: Dict[str, Any], question: str, k: int) -> List[Tuple[Document, float]]:
+    """BM25 hits of one shard as (doc, bm25_score); empty when the shard has no lexical index"""
+    store = vs_info['vectorstore']
+    lexical_index = getattr(store, "lexical_index", None)
+    if lexical_index is None:
+        with _hybrid_stats_lock:
+            _hybrid_stats["shards_without_lexical"] += 1
+        return []
+
+    docs_with_scores = []
+    for vector_id, score in lexical_index.search(question, k, allowed_ids=vs_info.get('allowed_ids')):
+        doc = _document_by_vector_id(store, vector_id)
+        if not isinstance(doc, Document):
+            continue
+        doc = _annotate_hit(vs_info, doc, vector_id)
+        if doc is None:
+            continue
+        doc.metadata['lexical_score'] = score
+        docs_with_scores.append((doc, score))
+    return docs_with_scores
+
+def _search_shard_hybrid(vs_info: Dict[str, Any], questions: List[str], query_embeddings: List[List[float]], k: int,
+                         search_settings: Optional[Dict[str, Any]] = None):
+    return (_search_shard_multi(vs_info, query_embeddings, k, search_settings),
+            [_search_shard_lexical(vs_info, question, k) for question in questions])
+
+def _hit_key(doc: Document):
+    vector_id = doc.metadata.get('vector_id', -1)
+    return (doc.metadata.get('shard'), vector_id if vector_id != -1 else id(doc))
+
+def _fuse_hits(vector_rankings: List[List[Tuple[Document, float]]], lexical_rankings: List[List[Tuple[Document, float]]],
+               limit: int) -> List[Document]:
+    """
+    Weighted reciprocal rank fusion: one vector ranking (by distance) and one BM25 ranking (by
+    score) per query variant, each over all shards; variants after the first count
+    MULTI_QUERY_SECONDARY_WEIGHT. A chunk found by several rankings keeps the first vector copy,
+    with the best similarity_score and lexical_score seen; hybrid_score is the fused score.
+    """
+    fused: Dict[Tuple[str, int], List] = {}
+
+    vector_hits = lexical_hits = 0
+    for variant, hits in enumerate(vector_rankings):
+        vector_hits += len(hits)
+        weight = HYBRID_VECTOR_WEIGHT * (MULTI_QUERY_SECONDARY_WEIGHT if variant else 1.0)
+        for rank, (doc, score) in enumerate(sorted(hits, key=lambda hit: hit[1])):
+            entry = fused.setdefault(_hit_key(doc), [doc, 0.0])
+            if score < entry[0].metadata.get('similarity_score', score):
+                entry[0].metadata['similarity_score'] = score
+            entry[1] += weight / (HYBRID_RRF_K + rank + 1)
+
+    for variant, hits in enumerate(lexical_rankings):
+        lexical_hits += len(hits)
+        weight = HYBRID_LEXICAL_WEIGHT * (MULTI_QUERY_SECONDARY_WEIGHT if variant else 1.0)
+        for rank, (doc, score) in enumerate(sorted(hits, key=lambda hit: -hit[1])):
+            entry = fused.get(_hit_key(doc))
+            if entry is None:
+                entry = fused[_hit_key(doc)] = [doc, 0.0]
+            elif score > entry[0].metadata.get('lexical_score', score - 1):
+                entry[0].metadata['lexical_score'] = score
+            entry[1] += weight / (HYBRID_RRF_K + rank + 1)
+
+    ranked = sorted(fused.values(), key=lambda entry: -entry[1])[:limit]
+    for doc, score in ranked:
+        doc.metadata['hybrid_score'] = round(score, 6)
+
+    with _hybrid_stats_lock:
+        _hybrid_stats["queries"] += 1
+        _hybrid_stats["vector_hits"] += vector_hits
+        _hybrid_stats["lexical_hits"] += lexical_hits
+        _hybrid_stats["lexical_only_docs"] += sum(1 for doc, _ in ranked if 'similarity_score' not in doc.metadata)
+    return [doc for doc, _ in ranked]
+
+def _merge_by_distance(vector_rankings: List[List[Tuple[Document, float]]], limit: int = None) -> List[Document]:
+    """Vector-only merge: each chunk once, at the smallest distance any query variant gave it"""
+    best: Dict[Tuple[str, int], Tuple[Document, float]] = {}
+    for hits in vector_rankings:
+        for doc, score in hits:
+            key = _hit_key(doc)
+            if key not in best or score < best[key][1]:
+                best[key] = (doc, score)
+    merged = sorted(best.values(), key=lambda hit: hit[1])
+    return [doc for doc, _ in merged[:limit]]
+
+def get_hybrid_retrieval_stats() -> Dict[str, Any]:
+    """Bao nhiêu kết quả đến từ BM25 mà vector search không tìm thấy"""
+    with _hybrid_stats_lock:
+        stats = dict(_hybrid_stats)
+    stats["enabled"] = HYBRID_RETRIEVAL_ENABLED
+    stats["lexical_only_per_query"] = round(stats["lexical_only_docs"] / stats["queries"], 3) if stats["queries"] else 0.0
+    return stats
+
+def retrieve_relevant_docs(vector_stores: List[Dict[str, Any]], question: str, k: int,
+                           query_embedding: Optional[List[float]] = None,
+                           search_settings: Optional[Dict[str, Any]] = None) -> List:
+    """Retrieve relevant documents with similarity scores.
+
+    The question is embedded once (or ``query_embedding`` is reused) and every
+    store is searched by vector, instead of one embedding call per store.
+    Stores are searched concurrently; shards that fail or exceed
+    SHARD_SEARCH_TIMEOUT / RETRIEVAL_DEADLINE are skipped. ANN parameters
+    (nprobe / efSearch) are read here, on the request thread, and passed
+    to every shard search. With HYBRID_RETRIEVAL_ENABLED each shard is also
+    searched with its BM25 index and both rankings are fused (RRF).
+    """
+    return retrieve_relevant_docs_multi(
+        vector_stores, [question], k,
+        query_embeddings=[query_embedding] if query_embedding is not None else None,
+        search_settings=search_settings
+    )
+
+def retrieve_relevant_docs_multi(vector_stores: List[Dict[str, Any]], questions: List[str], k: int,
+                                 query_embeddings: Optional[List[List[float]]] = None,
+                                 search_settings: Optional[Dict[str, Any]] = None) -> List:
+    """Retrieve with several variants of one question (rewritten + raw) at about the cost of one.
+
+    All variants are embedded in one batch call and each shard is searched once
+    with an (nq, d) query matrix. Results are fused across variants: reciprocal
+    rank fusion with the BM25 rankings when HYBRID_RETRIEVAL_ENABLED, otherwise
+    each chunk at its best distance. The number of returned chunks is the same
+    as for a single question.
+    """
+    vector_stores = [vs_info for vs_info in vector_stores if not vs_info.get('is_empty')]
+    if not vector_stores or not questions:
+        return []
+    # Drop repeated variants (the rewrite often equals the raw question), keeping their embeddings aligned
+    keep = [position for position, question in enumerate(questions) if question not in questions[:position]]
+    questions = [questions[position] for position in keep]
+    if query_embeddings is not None:
+        query_embeddings = [query_embeddings[position] for position in keep]
+    else:
+        try:
+            embeddings = _store_embeddings(vector_stores[0]['vectorstore'])
+            if len(questions) == 1:
+                query_embeddings = [embed_question(questions[0], embeddings)]
+            else:
+                query_embeddings = embed_questions(questions, embeddings)
+        except Exception as e:
+            print(f"[ERROR] Failed to embed question: {e}")
+            return []
+
+    if search_settings is None:
+        search_settings = get_index_search_settings()
+
+    with _multi_query_stats_lock:
+        _multi_query_stats["requests"] += 1
+        _multi_query_stats["variants"] += len(questions)
+        _multi_query_stats["shard_searches"] += len(vector_stores)
+        if len(questions) > 1:
+            _multi_query_stats["multi_variant_requests"] += 1
+
+    if HYBRID_RETRIEVAL_ENABLED:
+        search_tasks = [
+            (vs_info['unique_filename'],
+             lambda vs_info=vs_info: _search_shard_hybrid(vs_info, questions, query_embeddings, k, search_settings))
+            for vs_info in vector_stores
+        ]
+        shard_results = run_with_deadlines("search_vector_stores", search_tasks, SHARD_SEARCH_TIMEOUT, RETRIEVAL_DEADLINE)
+        vector_rankings = [[] for _ in questions]
+        lexical_rankings = [[] for _ in questions]
+        for vs_info in vector_stores:
+            shard_vector_hits, shard_lexical_hits = shard_results.get(vs_info['unique_filename'], ([], []))
+            for variant, hits in enumerate(shard_vector_hits):
+                vector_rankings[variant].extend(hits)
+            for variant, hits in enumerate(shard_lexical_hits):
+                lexical_rankings[variant].extend(hits)
+        return _fuse_hits(vector_rankings, lexical_rankings, k * len(vector_stores))
+
+    search_tasks = [
+        (vs_info['unique_filename'],
+         lambda vs_info=vs_info: _search_shard_multi(vs_info, query_embeddings, k, search_settings))
+        for vs_info in vector_stores
+    ]
+    shard_results = run_with_deadlines("search_vector_stores", search_tasks, SHARD_SEARCH_TIMEOUT, RETRIEVAL_DEADLINE)
+
+    vector_rankings = [[] for _ in questions]
+    for vs_info in vector_stores:
+        for variant, hits in enumerate(shard_results.get(vs_info['unique_filename'], [])):
+            vector_rankings[variant].extend(hits)
+    if len(questions) == 1:
+        return [doc for doc, score in sorted(vector_rankings[0], key=lambda x: x[1])]
+    return _merge_by_distance(vector_rankings, k * len(vector_stores))
+
+def get_multi_query_stats() -> Dict[str, Any]:
+    """Số biến thể câu hỏi được tìm chung trong một lượt tìm mỗi shard"""
+    with _multi_query_stats_lock:
+        stats = dict(_multi_query_stats)
+    stats["variants_per_request"] = round(stats["variants"] / stats["requests"], 3) if stats["requests"] else 0.0
+    return stats
+
+_SENTENCE_END_RE = re.compile(r"[.!?;:…](?=\s)|\n")
+_WORD_END_RE = re.compile(r"\S(?=\s)")
+
+def context_token_budget(model: str = None) -> int:
+    return CONTEXT_TOKEN_BUDGETS.get(model or "", CONTEXT_DEFAULT_TOKEN_BUDGET)
+
+def _cut_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Longest prefix within ``max_tokens`` ending at a sentence boundary (or a word boundary if no sentence fits)"""
+    for pattern in (_SENTENCE_END_RE, _WORD_END_RE):
+        cuts = [match.end() for match in pattern.finditer(text)]
+        low, high, best = 0, len(cuts) - 1, None
+        while low <= high:
+            middle = (low + high) // 2
+            if count_tokens(text[:cuts[middle]], model) <= max_tokens:
+                best = cuts[middle]
+                low = middle + 1
+            else:
+                high = middle - 1
+        if best:
+            return text[:best].strip()
+    return ""
+
+def pack_context(docs: List, model: str = None, budget: int = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Xếp các chunk theo thứ tự hạng vào context cho đến khi hết ngân sách token của model.
+    Chunk đầu tiên không vừa được cắt ở ranh giới câu (hoặc bỏ nếu phần còn lại quá ngắn); mọi chunk
+    sau đó bị bỏ, kể cả chunk nhỏ còn vừa, để không chunk hạng thấp nào đứng sau một chunk bị cắt.
+    Trả về (context, report); report["docs"] là các chunk có mặt trong context (kể cả chunk bị cắt).
+    """
+    budget = budget or context_token_budget(model)
+    separator_tokens = count_tokens("\n\n", model)
+    parts: List[str] = []
+    kept: List = []
+    used = dropped = packed = cut = skipped = 0
+
+    full = False
     for doc in docs:
-        if doc.page_content:
-            content = doc.page_content[:800]
-            source = doc.metadata.get("section", doc.metadata.get("source_file", "unknown"))
-            context_parts.append(f"[{source}]\n{content.strip()}")
-    
-    return "\n\n".join(context_parts).strip()
+        content = (doc.page_content or "").strip()
+        if not content:
+            continue
+        if full:
+            dropped += count_tokens(content, model)
+            skipped += 1
+            continue
+        source = doc.metadata.get("section", doc.metadata.get("source_file", "unknown"))
+        header = f"[{source}]\n"
+        cost = (separator_tokens if parts else 0) + count_tokens(header, model)
+        content_tokens = count_tokens(content, model)
+        remaining = budget - used - cost
+
+        if content_tokens <= remaining:
+            parts.append(header + content)
+            kept.append(doc)
+            used += cost + content_tokens
+            packed += 1
+            continue
+
+        full = True
+        partial = _cut_to_tokens(content, remaining, model) if remaining >= CONTEXT_MIN_PARTIAL_TOKENS else ""
+        if partial:
+            partial_tokens = count_tokens(partial, model)
+            parts.append(header + partial)
+            kept.append(doc)
+            used += cost + partial_tokens
+            dropped += content_tokens - partial_tokens
+            cut += 1
+        else:
+            dropped += content_tokens
+            skipped += 1
+
+    report = {"budget": budget, "tokens_used": used, "tokens_dropped": dropped,
+              "chunks_packed": packed, "chunks_cut": cut, "chunks_dropped": skipped, "docs": kept}
+    return "\n\n".join(parts).strip(), report
+
+def build_context(docs: List, question: str, model: str = None) -> str:
+    """Build a token-budgeted context from ranked documents"""
+    return build_context_with_docs(docs, question, model)[0]
+
+def build_context_with_docs(docs: List, question: str, model: str = None) -> Tuple[str, List]:
+    """Token-budgeted context and the documents that made it into it (cite only those)"""
+    if not docs:
+        return "", []
+
+    try:
+        context, report = pack_context(docs, model)
+    except Exception as e:
+        # Keep answering if the tokenizer is unavailable: fall back to fixed-size excerpts
+        print(f"[WARNING] Token-budgeted context failed, using truncated chunks: {e}")
+        kept = [doc for doc in docs if doc.page_content]
+        return "\n\n".join(
+            f"[{doc.metadata.get('section', doc.metadata.get('source_file', 'unknown'))}]\n{doc.page_content[:800].strip()}"
+            for doc in kept
+        ).strip(), kept
+
+    with _context_stats_lock:
+        _context_stats["requests"] += 1
+        for key in ("tokens_used", "tokens_dropped", "chunks_packed", "chunks_cut", "chunks_dropped"):
+            _context_stats[key] += report[key]
+    print(f"[INFO] Context: {report['tokens_used']}/{report['budget']} tokens, {report['chunks_packed']} chunks "
+          f"+ {report['chunks_cut']} cut, {report['chunks_dropped']} dropped ({report['tokens_dropped']} tokens left out)")
+    return context, report["docs"]
+
+def get_context_packing_stats() -> Dict[str, Any]:
+    """Token dùng / bị bỏ khi dựng context trong process này"""
+    with _context_stats_lock:
+        stats = dict(_context_stats)
+    stats["avg_tokens_used"] = round(stats["tokens_used"] / stats["requests"], 1) if stats["requests"] else 0.0
+    stats["budgets"] = dict(CONTEXT_TOKEN_BUDGETS, default=CONTEXT_DEFAULT_TOKEN_BUDGET)
+    return stats
 
 def prioritize_files_for_hr_questions(latest_files: List[Dict[str, Any]], enhanced_question: str) -> List[Dict[str, Any]]:
     """Prioritize files based on HR question content"""
     question_lower = enhanced_question.lower()
     prioritized_files = []
     
+    topics = question_topics(enhanced_question) if ROUTING_ENABLED else []
+    if topics and any(f.get('routing') for f in latest_files):
+        # Files tagged with the question's topics first (highest topic share first), in a stable order
+        def topic_weight(file_info):
+            routed = (file_info.get('routing') or {}).get('topics', {})
+            return max((routed.get(topic, 0.0) for topic in topics), default=0.0)
+        return sorted(latest_files, key=topic_weight, reverse=True)
+
     if any(word in question_lower for word in ['bảo hiểm', 'bhxh', 'bhyt', 'bhtn', 'insurance']):
         for file_info in latest_files:
             if 'bao hiem' in file_info['original_filename'].lower():
@@ -243,13 +1201,89 @@ def prioritize_files_for_hr_questions(latest_files: List[Dict[str, Any]], enhanc
     
     return prioritized_files 
 
+def _route_files(views: Dict[str, Any], question: str, max_files: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Files tagged at ingestion with the topics the question mentions, plus files that have no
+    routing metadata yet (they cannot be excluded safely). None when routing does not apply.
+    """
+    topics = question_topics(question)
+    if not topics:
+        return None
+    seen = set()
+    routed = []
+    for topic in topics:
+        for file_info in views.get("topic_files", {}).get(topic, []):
+            if file_info['unique_filename'] not in seen:
+                seen.add(file_info['unique_filename'])
+                routed.append(file_info)
+    if not routed:
+        return None
+    unrouted = views.get("unrouted_files", [])
+    result = (routed + unrouted)[:max_files]
+    print(f"[INFO] Routing: topics {topics} -> {len(routed)} tagged + {len(result) - min(len(routed), len(result))} "
+          f"unrouted of {len(views['files'])} files")
+    return result
+
+def prune_files_by_summary(files: List[Dict[str, Any]], question: str, embeddings=None,
+                           top_m: int = None, query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """
+    Keep the ``top_m`` files whose summary vectors are closest to the question, scored for every
+    file in one matrix product before any index is loaded. Files without summary vectors are
+    always kept. The question embedding is cached, so retrieval reuses it.
+    """
+    top_m = top_m or FILE_PRUNING_TOP_M
+    if not FILE_PRUNING_ENABLED or len(files) <= top_m:
+        return files
+    views = get_registry_views()
+    if views.get("summary_matrix") is None:
+        return files
+
+    t0 = time.time()
+    try:
+        if query_embedding is None:
+            query_embedding = embed_question(question, embeddings)
+        scores = score_files(views, query_embedding)
+    except Exception as e:
+        print(f"[WARNING] File pruning skipped: {e}")
+        return files
+    if not scores:
+        return files
+
+    scored = sorted((f for f in files if f['unique_filename'] in scores),
+                    key=lambda f: scores[f['unique_filename']], reverse=True)
+    kept_names = {f['unique_filename'] for f in scored[:top_m]}
+    result = [f for f in files if f['unique_filename'] in kept_names or f['unique_filename'] not in scores]
+    unscored = len(files) - len(scored)
+
+    elapsed = time.time() - t0
+    with _pruning_stats_lock:
+        _pruning_stats["requests"] += 1
+        _pruning_stats["candidates"] += len(files)
+        _pruning_stats["kept"] += len(result)
+        _pruning_stats["unscored"] += unscored
+        _pruning_stats["seconds"] += elapsed
+    print(f"[INFO] File pruning: {len(files)} -> {len(result)} files ({unscored} without summary) "
+          f"in {elapsed * 1000:.1f}ms")
+    return result
+
+def get_file_pruning_stats() -> Dict[str, Any]:
+    """Số file ứng viên / được giữ sau khi chấm điểm bằng summary vectors"""
+    with _pruning_stats_lock:
+        stats = dict(_pruning_stats)
+    stats["enabled"] = FILE_PRUNING_ENABLED
+    stats["top_m"] = FILE_PRUNING_TOP_M
+    stats["files_with_summary"] = len((_registry_state["views"] or {}).get("summary_files", []))
+    stats["avg_kept"] = round(stats["kept"] / stats["requests"], 2) if stats["requests"] else 0.0
+    stats["seconds"] = round(stats["seconds"], 3)
+    return stats
+
 def get_smart_files(question: str, max_files: int = None) -> List[Dict[str, Any]]:
     """Get files based on smart strategy"""
     if max_files is None:
         max_files = MAX_FILES_TO_LOAD
     
-    registry = get_file_registry()
-    files = registry.get("files", [])
+    views = get_registry_views()
+    files = views["files"]
     
     if not files:
         print("[WARNING] No files in registry, using sample data")
@@ -265,26 +1299,20 @@ def get_smart_files(question: str, max_files: int = None) -> List[Dict[str, Any]
         print(f"[INFO] Loading all {len(files)} files for comprehensive search")
         return files[:max_files]
     
-    relevant_files = []
-    other_files = []
-    
-    for file_info in files:
-        filename_lower = file_info.get('original_filename', '').lower()
-        
-        is_relevant = False
-        for keyword in SMART_LOADING_KEYWORDS:
-            if keyword in question_lower and keyword in filename_lower:
-                is_relevant = True
-                break
-        
-        if is_relevant:
-            relevant_files.append(file_info)
-        else:
-            other_files.append(file_info)
+    routed_files = _route_files(views, question, max_files) if ROUTING_ENABLED else None
+    if routed_files:
+        return routed_files
+
+    relevant_ids = {
+        id(file_info)
+        for keyword in SMART_LOADING_KEYWORDS if keyword in question_lower
+        for file_info in views["keyword_files"].get(keyword, [])
+    }
+    relevant_files = [f for f in files if id(f) in relevant_ids]
     
     result = relevant_files[:max_files//2]
     
-    sorted_other = sorted(other_files, key=lambda x: x.get('timestamp', 0), reverse=True)
+    sorted_other = [f for f in views["files_by_timestamp"] if id(f) not in relevant_ids]
     remaining_slots = max_files - len(result)
     result.extend(sorted_other[:remaining_slots])
     